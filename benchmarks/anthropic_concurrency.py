@@ -0,0 +1,43 @@
+# Checks that N parallel Anthropic calls finish in roughly one call's latency, i.e. the integration does not block the
+# event loop while waiting for the provider.
+#
+# > poetry run python benchmarks/anthropic_concurrency.py --parallel 10 --latency 0.5
+
+import argparse
+import asyncio
+import os
+from time import perf_counter
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionMessageRole
+from chatlib.llm.integration import AnthropicChatCompletionAPI, AnthropicModel
+from stub_server import start_stub_server, get_base_url, ANTHROPIC_MESSAGE_RESPONSE
+
+MESSAGES = [ChatCompletionMessage(content="Hi!", role=ChatCompletionMessageRole.USER)]
+
+
+async def main(parallel: int, latency: float):
+    os.environ.setdefault(
+        AnthropicChatCompletionAPI.env_key_for_spec(AnthropicChatCompletionAPI.get_auth_variable_specs()[0]), "stub")
+    server = start_stub_server(ANTHROPIC_MESSAGE_RESPONSE, delay=latency)
+    try:
+        async with AnthropicChatCompletionAPI(base_url=get_base_url(server)) as api:
+            start = perf_counter()
+            await asyncio.gather(*[api.run_chat_completion(AnthropicModel.CLAUDE_3_OPUS_20240229, MESSAGES, {})
+                                   for _ in range(parallel)])
+            elapsed = perf_counter() - start
+
+        print(f"{parallel} parallel calls with {latency:.2f} s provider latency took {elapsed:.2f} s "
+              f"({elapsed / latency:.1f}x a single call).")
+
+        if elapsed > latency * 2:
+            raise SystemExit("Anthropic calls appear to be serialized - the event loop is blocked.")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--parallel", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.parallel, args.latency))
@@ -0,0 +1,62 @@
+# Runs ChatCompletionFewShotMapper.run_batch against a local stand-in batch endpoint. The stand-in answers a share of
+# the requests with malformed JSON on the first job, so the re-queue path is exercised as well.
+#
+# > poetry run python benchmarks/batch_mapper.py --inputs 1000 --malformed 0.1
+
+import argparse
+import asyncio
+import json
+import os
+import random
+from time import perf_counter
+
+from chatlib.chatbot import ChatCompletionParams
+from chatlib.llm.integration import GPTChatCompletionAPI, GPTBatchAPI, ChatGPTModel
+from chatlib.tool.converter import generate_type_converter
+from chatlib.tool.versatile_mapper import ChatCompletionFewShotMapper, ChatCompletionFewShotMapperParams
+from stub_batch_server import start_stub_batch_server
+from stub_server import get_base_url
+
+
+async def main(inputs: int, malformed: float):
+    os.environ.setdefault(GPTChatCompletionAPI.env_key_for_spec(GPTChatCompletionAPI.get_auth_variable_specs()[0]),
+                          "stub")
+
+    answered: set[str] = set()
+
+    def answer(body: dict) -> str:
+        text = body["messages"][-1]["content"]
+        if text not in answered and random.random() < malformed:
+            answered.add(text)
+            return "{not json"
+        answered.add(text)
+        return json.dumps({"length": len(text)})
+
+    server = start_stub_batch_server(answer)
+    str_to_dict, dict_to_str = generate_type_converter(dict, 'json')
+    mapper = ChatCompletionFewShotMapper(GPTChatCompletionAPI(), "Return the length of the input as JSON.", None,
+                                         dict_to_str, str_to_dict,
+                                         output_validator=lambda input, output: output["length"] == len(input))
+
+    params = ChatCompletionFewShotMapperParams(model=ChatGPTModel.GPT_4o,
+                                               api_params=ChatCompletionParams(temperature=0))
+    batch_api = GPTBatchAPI(base_url=get_base_url(server, "/v1"))
+    try:
+        start = perf_counter()
+        outputs = await mapper.run_batch(batch_api, None, [f"input {i}" for i in range(inputs)], params,
+                                         poll_interval=0.01)
+        elapsed = perf_counter() - start
+    finally:
+        await batch_api.aclose()
+        server.shutdown()
+
+    assert all(output["length"] == len(f"input {i}") for i, output in enumerate(outputs))
+    print(f"Mapped {len(outputs)} inputs in {elapsed:.2f} s through the batch endpoint.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=int, default=1000)
+    parser.add_argument("--malformed", type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(main(args.inputs, args.malformed))
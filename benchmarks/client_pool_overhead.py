@@ -0,0 +1,69 @@
+# Measures per-request overhead of creating a fresh SDK client per call versus reusing the pooled client owned by
+# GPTChatCompletionAPI, against a local OpenAI-compatible stub server.
+#
+# > poetry run python benchmarks/client_pool_overhead.py --requests 200
+
+import argparse
+import asyncio
+import os
+from statistics import mean, median
+from time import perf_counter
+
+from openai import AsyncOpenAI
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionMessageRole
+from chatlib.llm.integration import GPTChatCompletionAPI
+from stub_server import start_stub_server, get_base_url, OPENAI_CHAT_COMPLETION_RESPONSE
+
+MESSAGES = [ChatCompletionMessage(content="Hi!", role=ChatCompletionMessageRole.USER)]
+
+
+async def run_fresh_client(base_url: str, n: int) -> list[float]:
+    latencies = []
+    for _ in range(n):
+        start = perf_counter()
+        client = AsyncOpenAI(api_key="stub", base_url=base_url)
+        await client.chat.completions.create(model="gpt-4-0613", messages=[m.dict() for m in MESSAGES])
+        latencies.append(perf_counter() - start)
+        await client.close()
+    return latencies
+
+
+async def run_pooled_client(base_url: str, n: int) -> list[float]:
+    latencies = []
+    async with GPTChatCompletionAPI(base_url=base_url) as api:
+        for _ in range(n):
+            start = perf_counter()
+            await api.run_chat_completion("gpt-4-0613", MESSAGES, {})
+            latencies.append(perf_counter() - start)
+    return latencies
+
+
+def summarize(name: str, latencies: list[float]):
+    print(f"{name:>14}: mean {mean(latencies) * 1000:.2f} ms, median {median(latencies) * 1000:.2f} ms")
+
+
+async def main(n: int):
+    os.environ.setdefault(GPTChatCompletionAPI.env_key_for_spec(GPTChatCompletionAPI.get_auth_variable_specs()[0]),
+                          "stub")
+    server = start_stub_server(OPENAI_CHAT_COMPLETION_RESPONSE)
+    base_url = get_base_url(server, "/v1")
+    try:
+        # Warm up imports and the stub server.
+        await run_fresh_client(base_url, 5)
+
+        fresh = await run_fresh_client(base_url, n)
+        pooled = await run_pooled_client(base_url, n)
+
+        summarize("fresh client", fresh)
+        summarize("pooled client", pooled)
+        print(f"Per-request overhead saved: {(mean(fresh) - mean(pooled)) * 1000:.2f} ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,67 @@
+# Tracks the cold import latency of chatlib entry points, each measured in a fresh interpreter, and reports which
+# heavyweight provider SDKs the import pulled in. Exits with a non-zero status if the median exceeds --max-ms.
+#
+# > poetry run python benchmarks/import_time.py --runs 10 --max-ms 500
+
+import argparse
+import json
+import subprocess
+import sys
+from os import path
+from statistics import median, quantiles
+
+HEAVY_MODULES = ["openai", "anthropic", "cohere", "google.generativeai", "transformers", "torch", "tiktoken",
+                 "questionary"]
+
+MEASURE_SCRIPT = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+elapsed = perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy_modules!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    output = subprocess.run([sys.executable, "-c", MEASURE_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)],
+                            check=True, capture_output=True, text=True,
+                            cwd=path.dirname(path.dirname(path.abspath(__file__)))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="+", default=["chatlib.chatbot", "chatlib.chatbot.generators"])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if the median import time of the first module exceeds this")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        # The first run warms the filesystem cache and bytecode; it is not counted.
+        measure(module)
+        samples = [measure(module) for _ in range(args.runs)]
+        latencies = [sample["elapsed"] * 1000 for sample in samples]
+        results[module] = {
+            "median_ms": median(latencies),
+            "p95_ms": quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0],
+            "min_ms": min(latencies),
+            "loaded_sdks": samples[-1]["loaded"]
+        }
+        print(f"{module}: median {results[module]['median_ms']:.1f} ms, p95 {results[module]['p95_ms']:.1f} ms, "
+              f"min {results[module]['min_ms']:.1f} ms, loaded {', '.join(results[module]['loaded_sdks']) or '-'}")
+
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_ms is not None and results[args.modules[0]]["median_ms"] > args.max_ms:
+        print(f"Import of {args.modules[0]} exceeds the budget of {args.max_ms} ms.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Measures the cost of recording one event in the metrics registry, as done on every provider call, turn and session
+# write. Exits with a non-zero status if any operation exceeds --max-ns.
+#
+# > poetry run python benchmarks/metrics_overhead.py --events 1000000 --max-ns 1000
+
+import argparse
+import json
+import sys
+from time import perf_counter_ns
+
+from chatlib.utils.metrics import MetricsRegistry
+
+
+def measure(operation, events: int) -> float:
+    """
+    :return: Nanoseconds per event, net of the loop itself
+    """
+
+    def empty():
+        pass
+
+    def run(function) -> int:
+        start = perf_counter_ns()
+        for _ in range(events):
+            function()
+        return perf_counter_ns() - start
+
+    run(operation)
+    return max(0.0, (min(run(operation) for _ in range(3)) - min(run(empty) for _ in range(3))) / events)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--max-ns", type=float, default=None, help="Fail if any operation exceeds this per event")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "", ("provider", "model", "outcome"))
+    histogram = registry.histogram("latency_seconds", "", ("provider", "model"))
+    bound_counter = counter.labels("OpenAI", "gpt-4o", "success")
+    bound_histogram = histogram.labels("OpenAI", "gpt-4o")
+
+    operations = {
+        "counter_labels_inc": lambda: counter.labels("OpenAI", "gpt-4o", "success").inc(),
+        "counter_bound_inc": lambda: bound_counter.inc(),
+        "histogram_labels_observe": lambda: histogram.labels("OpenAI", "gpt-4o").observe(0.42),
+        "histogram_bound_observe": lambda: bound_histogram.observe(0.42),
+    }
+
+    results = {}
+    for name, operation in operations.items():
+        results[name] = measure(operation, args.events)
+        print(f"{name}: {results[name]:.0f} ns/event")
+
+    # Snapshots are taken by scrapers, off the recording path.
+    start = perf_counter_ns()
+    registry.to_prometheus_text()
+    results["prometheus_snapshot_us"] = (perf_counter_ns() - start) / 1000
+    print(f"prometheus snapshot: {results['prometheus_snapshot_us']:.1f} us")
+
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_ns is not None:
+        exceeded = [name for name in operations if results[name] > args.max_ns]
+        if len(exceeded) > 0:
+            print(f"{', '.join(exceeded)} exceed(s) the budget of {args.max_ns} ns per event.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
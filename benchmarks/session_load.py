@@ -0,0 +1,205 @@
+# Measures how many concurrent TurnTakingChatSessions one process sustains. Each session pushes user messages through
+# the full stack (session, file session writer, response generator, scheduler, retries) against the in-process mock
+# provider, for every concurrency level given.
+# Reports throughput, p50/p95/p99 turn latency, event-loop lag, CPU time per turn and RSS growth, and saves them as JSON
+# so that runs can be compared across versions.
+#
+# > poetry run python benchmarks/session_load.py --sessions 10 100 500 --turns 10 --output session_load.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+from importlib.metadata import version, PackageNotFoundError
+from statistics import median, quantiles
+from time import perf_counter, process_time
+
+from chatlib.chatbot import TurnTakingChatSession, ChatCompletionResponseGenerator, DialogueTurn
+from chatlib.chatbot.session_writer import SessionFileWriter
+from chatlib.llm.integration import MockChatCompletionAPI, LogNormalLatency, UniformLatency
+from chatlib.llm.retry import ExponentialBackoffRetryPolicy
+from chatlib.llm.scheduler import request_scheduler
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_percentiles(samples: list[float]) -> dict:
+    if len(samples) < 2:
+        value = samples[0] if len(samples) > 0 else None
+        return {"p50": value, "p95": value, "p99": value, "max": value}
+    cuts = quantiles(samples, n=100)
+    return {"p50": median(samples), "p95": cuts[94], "p99": cuts[98], "max": max(samples)}
+
+
+class EventLoopLagMonitor:
+    """
+    Sleeps for a fixed interval in a loop and records how late each wake-up is.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: list[float] = []
+        self.__task: asyncio.Task | None = None
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+
+
+async def run_level(num_sessions: int, args) -> dict:
+    api = MockChatCompletionAPI(latency=LogNormalLatency(args.latency, args.latency_sigma),
+                                time_to_first_token=UniformLatency(args.latency / 4, args.latency / 2),
+                                error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                rate_limit_retry_after=0.05, seed=args.seed)
+    api.retry_policy = ExponentialBackoffRetryPolicy(base_delay=0.05, max_delay=0.5)
+    if not args.circuit_breaker:
+        # Injected errors at a high request rate would otherwise open the circuit and fail every session at once.
+        api.circuit_breakers = None
+    request_scheduler.set_max_concurrency(api.provider_name(), args.max_concurrency)
+
+    writer = SessionFileWriter()
+    sessions = [TurnTakingChatSession(f"load-{num_sessions}-{i}",
+                                      ChatCompletionResponseGenerator(api, "mock", token_limit_tolerance=0),
+                                      writer)
+                for i in range(num_sessions)]
+
+    turn_latencies: list[float] = []
+    failures: list[str] = []
+
+    async def drive(session: TurnTakingChatSession):
+        try:
+            await session.initialize()
+            for turn in range(args.turns):
+                start = perf_counter()
+                await session.push_user_message(DialogueTurn(message=f"This is user message {turn}. How are you?",
+                                                             is_user=True))
+                turn_latencies.append((perf_counter() - start) * 1000)
+        except Exception as e:
+            failures.append(type(e).__name__)
+
+    monitor = EventLoopLagMonitor()
+    rss_before = get_rss_bytes()
+    cpu_start = process_time()
+    monitor.start()
+    start = perf_counter()
+    await asyncio.gather(*[drive(session) for session in sessions])
+    elapsed = perf_counter() - start
+    await monitor.stop()
+    cpu_time = process_time() - cpu_start
+    rss_after = get_rss_bytes()
+
+    for session in sessions:
+        session.save()
+    # Sessions write their info when collected; the writes above already covered it.
+    for session in sessions:
+        session._session_writer = None
+
+    num_turns = len(turn_latencies)
+    result = {
+        "sessions": num_sessions,
+        "turns": num_turns,
+        "failed_sessions": len(failures),
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": num_turns / elapsed,
+        "turn_latency_ms": get_percentiles(turn_latencies),
+        "event_loop_lag_ms": get_percentiles([lag * 1000 for lag in monitor.lags]),
+        "cpu_ms_per_turn": cpu_time * 1000 / num_turns,
+        "rss_growth_mb": (rss_after - rss_before) / (1024 * 1024),
+        "rss_growth_kb_per_session": (rss_after - rss_before) / 1024 / num_sessions,
+        "provider_calls": api.stats.calls,
+        "provider_errors": api.stats.server_errors + api.stats.rate_limited
+    }
+    print(f"{num_sessions} sessions: {result['throughput_turns_per_s']:.1f} turns/s, "
+          f"latency p50 {result['turn_latency_ms']['p50']:.1f} / p95 {result['turn_latency_ms']['p95']:.1f} / "
+          f"p99 {result['turn_latency_ms']['p99']:.1f} ms, "
+          f"loop lag p99 {result['event_loop_lag_ms']['p99']:.2f} ms, "
+          f"CPU {result['cpu_ms_per_turn']:.2f} ms/turn, RSS +{result['rss_growth_mb']:.1f} MB, "
+          f"{len(failures)} failed session(s)")
+    return result
+
+
+def get_chatlib_version() -> str | None:
+    try:
+        return version("chatlib")
+    except PackageNotFoundError:
+        return None
+
+
+async def main(args):
+    levels = []
+    for num_sessions in args.sessions:
+        levels.append(await run_level(num_sessions, args))
+
+    report = {
+        "benchmark": "session_load",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "chatlib": get_chatlib_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "levels": levels
+    }
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="Median provider latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.01)
+    parser.add_argument("--max-concurrency", type=int, default=1024,
+                        help="Concurrent provider calls admitted by the request scheduler")
+    parser.add_argument("--circuit-breaker", action="store_true", help="Keep the default circuit breakers enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the session files written during the run")
+    args = parser.parse_args()
+
+    if args.output is not None:
+        args.output = os.path.abspath(args.output)
+
+    # The file session writer stores under the working directory.
+    data_dir = tempfile.mkdtemp(prefix="chatlib-session-load-")
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        asyncio.run(main(args))
+    finally:
+        os.chdir(cwd)
+        if args.keep_data:
+            print(f"Session files are kept in {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,102 @@
+# A local stand-in for the OpenAI Batch API (/files, /batches), answering each request in the uploaded JSONL with
+# a caller-provided function. Jobs report in_progress on the first poll and complete on the next one.
+
+import json
+import threading
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+from typing import Callable
+
+
+def make_chat_completion_body(content: str, model: str) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+    }
+
+
+def start_stub_batch_server(answer: Callable[[dict], str]) -> ThreadingHTTPServer:
+    """
+    :param answer: Returns the assistant content for a chat completion request body
+    """
+    files: dict[str, str] = dict()
+    batches: dict[str, dict] = dict()
+    ids = count()
+    lock = threading.Lock()
+
+    def run_batch(batch: dict):
+        lines = []
+        for line in files[batch["input_file_id"]].splitlines():
+            request = json.loads(line)
+            body = make_chat_completion_body(answer(request["body"]), request["body"]["model"])
+            lines.append(json.dumps({"id": f"response-{next(ids)}", "custom_id": request["custom_id"],
+                                     "response": {"status_code": 200, "body": body}, "error": None}))
+        output_file_id = f"file-{next(ids)}"
+        files[output_file_id] = "\n".join(lines) + "\n"
+        batch.update(status="completed", output_file_id=output_file_id)
+
+    class StubBatchHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def __send_json(self, data: dict):
+            self.__send(json.dumps(data).encode("utf-8"), "application/json")
+
+        def __send(self, body: bytes, content_type: str, status: int = 200):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                if self.path.endswith("/files"):
+                    message = BytesParser().parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+                    content = [part for part in message.get_payload()
+                               if part.get_param("name", header="content-disposition") == "file"][0]
+                    file_id = f"file-{next(ids)}"
+                    files[file_id] = content.get_payload(decode=True).decode("utf-8")
+                    self.__send_json({"id": file_id, "object": "file", "purpose": "batch"})
+                elif self.path.endswith("/batches"):
+                    request = json.loads(body)
+                    batch_id = f"batch-{next(ids)}"
+                    batches[batch_id] = {"id": batch_id, "object": "batch", "status": "validating",
+                                         "input_file_id": request["input_file_id"], "output_file_id": None,
+                                         "error_file_id": None}
+                    self.__send_json(batches[batch_id])
+                elif self.path.endswith("/cancel"):
+                    batch = batches[self.path.split("/")[-2]]
+                    batch.update(status="cancelled")
+                    self.__send_json(batch)
+                else:
+                    self.__send(b"", "text/plain", 404)
+
+        def do_GET(self):
+            with lock:
+                segments = self.path.strip("/").split("/")
+                if segments[-1] == "content":
+                    self.__send(files[segments[-2]].encode("utf-8"), "application/jsonl")
+                elif segments[-2] == "batches":
+                    batch = batches[segments[-1]]
+                    if batch["status"] == "validating":
+                        batch.update(status="in_progress")
+                    elif batch["status"] == "in_progress":
+                        run_batch(batch)
+                    self.__send_json(batch)
+                else:
+                    self.__send(b"", "text/plain", 404)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBatchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,61 @@
+# A minimal local HTTP server that answers every POST with a canned JSON body, optionally after a delay.
+# Used by the benchmarks to measure client-side overhead without network noise.
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+OPENAI_CHAT_COMPLETION_RESPONSE = {
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4-0613",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello."}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+}
+
+ANTHROPIC_MESSAGE_RESPONSE = {
+    "id": "msg_stub",
+    "type": "message",
+    "role": "assistant",
+    "model": "claude-3-opus-20240229",
+    "content": [{"type": "text", "text": "Hello."}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 10, "output_tokens": 2}
+}
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections opened at once by parallel clients, which then retry after a second.
+    request_queue_size = 128
+
+
+def start_stub_server(response: dict, delay: float = 0) -> ThreadingHTTPServer:
+    body = json.dumps(response).encode("utf-8")
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if delay > 0:
+                time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = StubHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_base_url(server: ThreadingHTTPServer, path: str = "") -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
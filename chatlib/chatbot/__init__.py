@@ -1,3 +1,4 @@
+from .context_trimming import *
 from .response_generator import *
 from .session import *
 from .types import *
@@ -0,0 +1,118 @@
+from bisect import bisect_left
+from typing import Callable, Any
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage
+from .types import Dialogue, DialogueTurn
+
+
+class ContextTokenAccount:
+    """
+    Running token counts of a chat completion context: the head (instruction and initial messages), the tool schemas,
+    and prefix sums over the dialogue turns. Dialogues grow and shrink at the end, so syncing only counts the turns
+    appended since the last sync, and the total is available in O(1).
+    """
+
+    def __init__(self, overhead: int = 0):
+        """
+        :param overhead: Tokens added once per request, e.g., the priming of the reply
+        """
+        self.overhead = overhead
+
+        self.__head_key: tuple | None = None
+        self.__head_tokens = 0
+
+        self.__tools: Any = None
+        self.__tools_tokens = 0
+
+        self.__turn_ids: list[str] = []
+        # __turn_prefix_sums[i] is the number of tokens in the first i turns.
+        self.__turn_prefix_sums: list[int] = [0]
+        # Likewise, for the parts of the turns that may be dropped to save room (function messages).
+        self.__droppable_prefix_sums: list[int] = [0]
+
+    @property
+    def head_tokens(self) -> int:
+        return self.__head_tokens
+
+    @property
+    def tools_tokens(self) -> int:
+        return self.__tools_tokens
+
+    @property
+    def fixed_tokens(self) -> int:
+        return self.overhead + self.__head_tokens + self.__tools_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.fixed_tokens + self.__turn_prefix_sums[-1]
+
+    def sync_head(self, messages: list[ChatCompletionMessage], count: Callable[[ChatCompletionMessage], int]):
+        key = tuple((message.role, message.name, message.content) for message in messages)
+        if key != self.__head_key:
+            self.__head_key = key
+            self.__head_tokens = sum([count(message) for message in messages])
+
+    def sync_tools(self, tools: Any, count: Callable[[Any], int]):
+        if tools is not self.__tools:
+            self.__tools = tools
+            self.__tools_tokens = count(tools) if tools is not None else 0
+
+    @property
+    def num_turns(self) -> int:
+        return len(self.__turn_ids)
+
+    def sync_turns(self, dialog: Dialogue, count: Callable[[DialogueTurn], int],
+                   count_droppable: Callable[[DialogueTurn], int] | None = None):
+        """
+        :param count: Counts the tokens of a turn. With count_droppable, only those that must be kept.
+        :param count_droppable: Counts the tokens of the parts of a turn that may be dropped, e.g., function messages.
+        They are added to the total of the turn.
+        """
+        common = min(len(self.__turn_ids), len(dialog))
+        if common > 0 and dialog[common - 1].id != self.__turn_ids[common - 1]:
+            # The dialogue was replaced rather than extended or shortened; find where it diverges.
+            common = 0
+            while common < min(len(self.__turn_ids), len(dialog)) and dialog[common].id == self.__turn_ids[common]:
+                common += 1
+
+        del self.__turn_ids[common:]
+        del self.__turn_prefix_sums[common + 1:]
+        del self.__droppable_prefix_sums[common + 1:]
+
+        for turn in dialog[common:]:
+            droppable = count_droppable(turn) if count_droppable is not None else 0
+            self.__turn_ids.append(turn.id)
+            self.__turn_prefix_sums.append(self.__turn_prefix_sums[-1] + count(turn) + droppable)
+            self.__droppable_prefix_sums.append(self.__droppable_prefix_sums[-1] + droppable)
+
+    def get_turn_tokens(self, start: int, end: int | None = None) -> int:
+        """
+        :return: Tokens of the synced turns in [start, end)
+        """
+        return self.__turn_prefix_sums[len(self.__turn_ids) if end is None else end] - self.__turn_prefix_sums[start]
+
+    def get_droppable_tokens(self, start: int, end: int | None = None) -> int:
+        """
+        :return: Droppable tokens of the synced turns in [start, end)
+        """
+        return (self.__droppable_prefix_sums[len(self.__turn_ids) if end is None else end]
+                - self.__droppable_prefix_sums[start])
+
+    def find_trim_start(self, budget: int) -> int:
+        """
+        Binary-search the oldest turn to keep so that the context fits in the budget.
+        :return: The index of the first turn to keep. Equals the number of turns if even the fixed part does not fit.
+        """
+        available = budget - self.fixed_tokens
+        if available < 0:
+            return len(self.__turn_ids)
+        return bisect_left(self.__turn_prefix_sums, self.__turn_prefix_sums[-1] - available)
+
+    def reset(self):
+        self.__head_key = None
+        self.__head_tokens = 0
+        self.__tools = None
+        self.__tools_tokens = 0
+        self.__turn_ids.clear()
+        self.__turn_prefix_sums[1:] = []
+        self.__droppable_prefix_sums[1:] = []
@@ -0,0 +1,124 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Callable, Collection
+
+from chatlib.utils import dict_utils
+from .context_accounting import ContextTokenAccount
+from .types import Dialogue, DialogueTurn
+
+
+def strip_function_messages(turn: DialogueTurn) -> DialogueTurn:
+    """
+    :return: A copy of the turn without the function messages that preceded it, or the turn itself if it has none
+    """
+    if dict_utils.get_nested_value(turn.metadata, ["chatcompletion", "function_messages"]) is None:
+        return turn
+    chatcompletion = {key: value for key, value in turn.metadata["chatcompletion"].items()
+                      if key != "function_messages"}
+    return turn.model_copy(update=dict(metadata={**turn.metadata, "chatcompletion": chatcompletion}))
+
+
+def _find_first(low: int, high: int, test: Callable[[int], bool]) -> int:
+    """
+    :return: The smallest index in [low, high] passing the test, which must pass for all indices after it,
+    or high + 1 if none passes.
+    """
+    high += 1
+    while low < high:
+        middle = (low + high) // 2
+        if test(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class ContextTrimmingHandler(ABC):
+    """
+    A built-in token limit exceed handler. Instead of answering by itself, it selects the part of the dialogue that
+    fits, and ChatCompletionResponseGenerator sends it along with the instruction.
+    Selection works on the generator's cached per-turn token counts, so nothing is counted again.
+    Handlers keep no state and can be shared among generators.
+    """
+
+    @abstractmethod
+    def trim(self, dialog: Dialogue, account: ContextTokenAccount, budget: int) -> Dialogue | None:
+        """
+        :param dialog: The whole dialogue
+        :param account: Token counts synced with the dialogue
+        :param budget: Tokens that the context, including the instruction and tool schemas, must fit in
+        :return: The turns to send, or None if nothing fits
+        """
+        pass
+
+
+class RecentTurnsTrimmingHandler(ContextTrimmingHandler):
+    """
+    Keeps the instruction and the most recent turns that fit, dropping older turns.
+
+    :param pinned: Turns to keep regardless of their age, as turn ids or a predicate. Pinned turns are kept whole.
+    A collection of ids is referenced rather than copied, so turns can be pinned as the session goes on.
+    :param drop_function_messages_first: Strip the function messages of the oldest turns, then of all turns, before
+    dropping any turn
+    :param min_recent_turns: Give up, raising TokenLimitExceedError, if fewer of the most recent turns fit
+    """
+
+    def __init__(self,
+                 pinned: Collection[str] | Callable[[DialogueTurn], bool] | None = None,
+                 drop_function_messages_first: bool = False,
+                 min_recent_turns: int = 1):
+        if pinned is None or callable(pinned):
+            self.__is_pinned = pinned
+        else:
+            self.__is_pinned = lambda turn: turn.id in pinned
+        self.__drop_function_messages_first = drop_function_messages_first
+        self.__min_recent_turns = min_recent_turns
+
+    def trim(self, dialog: Dialogue, account: ContextTokenAccount, budget: int) -> Dialogue | None:
+        available = budget - account.fixed_tokens
+        num_turns = len(dialog)
+
+        pinned = [i for i, turn in enumerate(dialog) if self.__is_pinned(turn)] if self.__is_pinned is not None else []
+        pinned_set = set(pinned)
+        pinned_tokens = [account.get_turn_tokens(i, i + 1) for i in pinned]
+        pinned_droppable = [account.get_droppable_tokens(i, i + 1) for i in pinned]
+        # Prefix sums over the pinned turns, so that their share of any range is a bisection away.
+        pinned_droppable_sums = [0] + list(accumulate(pinned_droppable))
+
+        if self.__drop_function_messages_first:
+            total = account.get_turn_tokens(0)
+
+            def fits_with_stripped_before(end: int) -> bool:
+                unpinned_droppable = (account.get_droppable_tokens(0, end)
+                                      - pinned_droppable_sums[bisect_left(pinned, end)])
+                return total - unpinned_droppable <= available
+
+            strip_end = _find_first(0, num_turns, fits_with_stripped_before)
+            if strip_end <= num_turns:
+                return [strip_function_messages(turn) if i < strip_end and i not in pinned_set else turn
+                        for i, turn in enumerate(dialog)]
+
+        # Unpinned turns count without their function messages if those are dropped; pinned turns count whole.
+        pinned_costs = [tokens - droppable for tokens, droppable in zip(pinned_tokens, pinned_droppable)] \
+            if self.__drop_function_messages_first else pinned_tokens
+        pinned_cost_sums = [0] + list(accumulate(pinned_costs))
+        pinned_total = sum(pinned_tokens)
+
+        def fits_from(start: int) -> bool:
+            cost = account.get_turn_tokens(start)
+            if self.__drop_function_messages_first:
+                cost -= account.get_droppable_tokens(start)
+            cost -= pinned_cost_sums[-1] - pinned_cost_sums[bisect_left(pinned, start)]
+            return cost + pinned_total <= available
+
+        start = _find_first(0, num_turns, fits_from)
+        if num_turns - start < self.__min_recent_turns:
+            return None
+
+        kept = [dialog[i] for i in pinned if i < start]
+        for i in range(start, num_turns):
+            turn = dialog[i]
+            kept.append(strip_function_messages(turn)
+                        if self.__drop_function_messages_first and i not in pinned_set else turn)
+        return kept
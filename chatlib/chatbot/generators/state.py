@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic
+from typing import TypeVar, Generic, AsyncIterator
 
-from chatlib.chatbot import ResponseGenerator, Dialogue
+from chatlib.chatbot import ResponseGenerator, Dialogue, ResponseStreamChunk
 from chatlib.chatbot.message_transformer import MessageTransformerChain
 from chatlib.utils import dict_utils
+from chatlib.utils.tracing import trace_span
 
 StateType = TypeVar('StateType')
 
@@ -60,7 +61,7 @@ class StateBasedResponseGenerator(ResponseGenerator, Generic[StateType], ABC):
         """
         pass
 
-    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+    async def __update_state(self, dialog: Dialogue, dry: bool):
         if dry is False:  # Update state only when the dry flag is False.
             # Calculate state and update response generator if the state was changed:
             next_state, next_state_payload = await self.calc_next_state_info(self.current_state, dialog) or (None, None)
@@ -80,6 +81,10 @@ class StateBasedResponseGenerator(ResponseGenerator, Generic[StateType], ABC):
             elif self.__current_generator is None:  # No state change but initial run.
                 self.__current_generator = self.get_generator(self.current_state, self.current_state_payload)
 
+    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+        with trace_span("state_evaluation"):
+            await self.__update_state(dialog, dry)
+
         # Generate response from the child generator:
         message, metadata, elapsed = await self.__current_generator.get_response(dialog, dry)
 
@@ -88,6 +93,19 @@ class StateBasedResponseGenerator(ResponseGenerator, Generic[StateType], ABC):
 
         return message, metadata
 
+    async def _get_response_stream_impl(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        with trace_span("state_evaluation"):
+            await self.__update_state(dialog, dry)
+
+        # Stream response from the child generator:
+        async for chunk in self.__current_generator.get_response_stream(dialog, dry):
+            if chunk.is_final:
+                metadata = dict_utils.set_nested_value(chunk.metadata, "state", self.current_state)
+                metadata = dict_utils.set_nested_value(metadata, "payload", self.current_state_payload)
+                yield ResponseStreamChunk(message=chunk.message, metadata=metadata)
+            else:
+                yield chunk
+
     def state_num_appearance(self, state: StateType) -> int:
         """
         Get the number of appearance of the state in the history.
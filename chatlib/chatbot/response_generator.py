@@ -1,8 +1,10 @@
 import json
 from abc import ABC, abstractmethod
-from functools import cache
+from contextlib import aclosing
+from contextvars import copy_context
+from dataclasses import dataclass
 from time import perf_counter
-from typing import TypeAlias, Callable, Awaitable, Any, Optional
+from typing import TypeAlias, Callable, Awaitable, Any, Optional, AsyncIterator, TYPE_CHECKING
 
 from jinja2 import Template
 from pydantic import BaseModel, Field, ConfigDict
@@ -10,11 +12,33 @@ from typing_extensions import TypedDict
 
 from chatlib.chatbot.message_transformer import MessageTransformerChain, run_message_transformer_chain, \
     SpecialTokenListExtractionTransformer
+from chatlib.llm.deadline import enforce_deadline, Deadline, set_deadline, iterate_with_deadline, run_with_deadline
+from chatlib.utils.tracing import trace_span, start_span, set_current_span, Span
 from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionAPI, ChatCompletionMessageRole, \
     TokenLimitExceedError, ChatCompletionFinishReason, ChatCompletionResult
-from .types import Dialogue, RegenerateRequestException
+from .context_accounting import ContextTokenAccount
+from .context_trimming import ContextTrimmingHandler
+from .types import Dialogue, DialogueTurn, RegenerateRequestException
 from ..utils import dict_utils
 
+if TYPE_CHECKING:
+    from chatlib.tool.summary_memory import RollingSummaryMemory
+
+
+@dataclass(frozen=True)
+class ResponseStreamChunk:
+    delta: str | None = None
+
+    # Set only on the last chunk. The final message is authoritative: message transformers may have altered the
+    # concatenated deltas.
+    message: str | None = None
+    metadata: dict | None = None
+    elapsed: int | None = None
+
+    @property
+    def is_final(self) -> bool:
+        return self.message is not None
+
 
 class ResponseGenerator(ABC):
 
@@ -32,27 +56,112 @@ class ResponseGenerator(ABC):
     async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
         pass
 
-    async def get_response(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None, int]:
+    async def get_response(self, dialog: Dialogue, dry: bool = False,
+                           timeout: float | None = None) -> tuple[str, dict | None, int]:
+        """
+        :param timeout: Seconds within which the response must be generated, including tool calls and retries.
+        The generation is cancelled with a DeadlineExceededError when it runs out.
+        """
         start = perf_counter()
 
+        with trace_span("response") as span:
+            async with enforce_deadline(timeout) as deadline:
+                try:
+                    self._pre_get_response(dialog)
+                    response, metadata = await self._get_response_impl(dialog, dry)
+                except RegenerateRequestException as regen:
+                    print(f"Regenerate response. Reason: {regen.reason}")
+                    response, metadata = await self._get_response_impl(dialog, dry)
+                except Exception as ex:
+                    raise ex
+
+            response, metadata = self.__transform_response(response, metadata)
+            metadata = self.__mark_timings(metadata, span)
+
+        end = perf_counter()
+
+        return response, self.__mark_deadline(metadata, deadline), int((end - start) * 1000)
+
+    async def _get_response_stream_impl(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        # Generators without a streaming path deliver the whole response as a single delta.
+        response, metadata = await self._get_response_impl(dialog, dry)
+        yield ResponseStreamChunk(delta=response)
+        yield ResponseStreamChunk(message=response, metadata=metadata)
+
+    async def get_response_stream(self, dialog: Dialogue, dry: bool = False,
+                                  timeout: float | None = None) -> AsyncIterator[ResponseStreamChunk]:
+        """
+        :param timeout: Seconds within which the response must be generated, counting the time the consumer takes
+        between chunks. Waiting for the next chunk raises DeadlineExceededError when it runs out.
+        """
+        start = perf_counter()
+        first_token_at = None
+
+        response = None
+        metadata = None
+        span = start_span("response", stream=True)
+        # The stream runs in a context of its own, so that neither the span nor the deadline leaks to the consumer
+        # between chunks, and the deadline applies only while waiting for a chunk.
+        context = copy_context()
+        context.run(set_current_span, span)
+        deadline = context.run(set_deadline, timeout)
         try:
-            self._pre_get_response(dialog)
-            response, metadata = await self._get_response_impl(dialog, dry)
-        except RegenerateRequestException as regen:
-            print(f"Regenerate response. Reason: {regen.reason}")
-            response, metadata = await self._get_response_impl(dialog, dry)
-        except Exception as ex:
-            raise ex
+            try:
+                context.run(self._pre_get_response, dialog)
+                async with aclosing(iterate_with_deadline(self._get_response_stream_impl(dialog, dry),
+                                                          context)) as chunks:
+                    async for chunk in chunks:
+                        if chunk.is_final:
+                            response, metadata = chunk.message, chunk.metadata
+                        else:
+                            if first_token_at is None:
+                                first_token_at = perf_counter()
+                            yield chunk
+            except RegenerateRequestException as regen:
+                # Deltas already delivered cannot be retracted, so the regenerated response arrives only as the final chunk.
+                print(f"Regenerate response. Reason: {regen.reason}")
+                response, metadata = await run_with_deadline(self._get_response_impl(dialog, dry), context)
+
+            response, metadata = context.run(self.__transform_response, response, metadata)
+            metadata = self.__mark_timings(metadata, span)
+        except BaseException as e:
+            span.end(e)
+            raise
+        span.end()
+        metadata = self.__mark_deadline(metadata, deadline)
+
+        end = perf_counter()
+
+        if first_token_at is not None:
+            metadata = dict_utils.set_nested_value(metadata, "time_to_first_token", int((first_token_at - start) * 1000))
+
+        yield ResponseStreamChunk(message=response, metadata=metadata, elapsed=int((end - start) * 1000))
 
+    @staticmethod
+    def __mark_deadline(metadata: dict | None, deadline: Deadline | None) -> dict | None:
+        if deadline is None:
+            return metadata
+        return dict_utils.set_nested_value(metadata, "deadline", {
+            "budget": int(deadline.budget * 1000),
+            "remaining": int(deadline.remaining * 1000),
+            "within_budget": not deadline.expired
+        })
+
+    @staticmethod
+    def __mark_timings(metadata: dict | None, span: Span) -> dict | None:
+        # Milliseconds per stage. A generator delegating to another overwrites the inner breakdown with its own,
+        # which includes the inner stages.
+        return dict_utils.set_nested_value(metadata, "timings", span.get_stage_timings())
+
+    def __transform_response(self, response: str, metadata: dict | None) -> tuple[str, dict | None]:
         if self._message_transformers is not None:
-            cleaned_response, metadata = run_message_transformer_chain(response, metadata, self._message_transformers)
+            with trace_span("transform"):
+                cleaned_response, metadata = run_message_transformer_chain(response, metadata,
+                                                                           self._message_transformers)
             if cleaned_response != response:
                 metadata = dict_utils.set_nested_value(metadata, "original_message", response)
                 response = cleaned_response
-
-        end = perf_counter()
-
-        return response, metadata, int((end - start) * 1000)
+        return response, metadata
 
     @abstractmethod
     def write_to_json(self, parcel: dict):
@@ -65,7 +174,12 @@ class ResponseGenerator(ABC):
 
 ##################
 
-TokenLimitExceedHandler: TypeAlias = Callable[[Dialogue, list[ChatCompletionMessage]], Awaitable[Any]]
+# Either answers an overlong dialogue by itself, or selects the part of it to send (see ContextTrimmingHandler).
+TokenLimitExceedHandler: TypeAlias = Callable[[Dialogue, list[ChatCompletionMessage]], Awaitable[Any]] \
+                                     | ContextTrimmingHandler
+
+# Assumed until a provider reports the prompt usage; roughly four characters of English text per token.
+_DEFAULT_PROMPT_TOKENS_PER_CHAR = 0.25
 
 
 class ChatCompletionFunctionParameterProperty(TypedDict):
@@ -93,8 +207,8 @@ class ChatCompletionParams(BaseModel):
     frequency_penalty: Optional[float] = Field(None, ge=-2, le=2)
     tools: list[ChatCompletionFunctionInfo | dict] | None = None
 
-    @cache
     def dict(self) -> dict:
+        # Not cached: functools.cache hashes the model, which fails once tools (a list) is set.
         return super().dict(exclude_none=True)
 
 
@@ -111,8 +225,20 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
                  special_tokens: list[tuple[str, str, Any]] | None = None, verbose: bool = False,
 
                  token_limit_exceed_handler: TokenLimitExceedHandler | None = None,
-                 token_limit_tolerance: int = 1024
+                 token_limit_tolerance: int = 1024,
+                 coalesce_requests: bool = False,
+                 optimistic_send: bool = False,
+                 optimistic_send_window_fraction: float = 0.5,
+                 memory: 'RollingSummaryMemory | None' = None
                  ):
+        """
+        :param optimistic_send: If True, requests are sent without counting tokens first. A prompt rejected by the
+        provider for its length is counted and passed to token_limit_exceed_handler.
+        :param optimistic_send_window_fraction: In the optimistic mode, tokens are counted again before sending once
+        the estimated prompt reaches this fraction of the model's context window.
+        :param memory: Summarizes older turns in the background and sends the summary in place of them.
+        A memory keeps the state of one dialogue, so it must not be shared among generators.
+        """
 
         self.__api = api
 
@@ -135,6 +261,19 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
         self.__token_limit_exceed_handler = token_limit_exceed_handler
         self.__token_limit_tolerance = token_limit_tolerance
 
+        # Identical concurrent requests (e.g., sessions opening with the same instruction) share one provider call.
+        self.__coalesce_requests = coalesce_requests
+
+        self.__context_account: ContextTokenAccount | None = None
+        self.__context_account_model: str | None = None
+
+        self.__memory = memory
+
+        self.__optimistic_send = optimistic_send
+        self.__optimistic_send_window_fraction = optimistic_send_window_fraction
+        # Calibrated with the prompt usage reported for the previous request.
+        self.__prompt_tokens_per_char = _DEFAULT_PROMPT_TOKENS_PER_CHAR
+
         if special_tokens is not None and len(special_tokens) > 0:
 
             def onTokenFound(tokens: list[str], original_message: str, cleaned_message: str, metadata: dict | None):
@@ -185,18 +324,26 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
             self.__instruction_parameters = params
         self.__resolve_instruction()
 
-    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
-        dialogue_converted: list[ChatCompletionMessage] = []
-        for turn in dialog:
-            function_messages = dict_utils.get_nested_value(turn.metadata, ["chatcompletion", "function_messages"])
-            if function_messages is not None:
-                dialogue_converted.extend(turn.metadata["chatcompletion"]["function_messages"])
+    @staticmethod
+    def __get_function_messages(turn: DialogueTurn) -> list[ChatCompletionMessage]:
+        function_messages = dict_utils.get_nested_value(turn.metadata, ["chatcompletion", "function_messages"])
+        return function_messages if function_messages is not None else []
+
+    @staticmethod
+    def __convert_turn_message(turn: DialogueTurn) -> ChatCompletionMessage:
+        original_message = dict_utils.get_nested_value(turn.metadata, ["chatcompletion", "token_uncleaned_message"])
+        return ChatCompletionMessage(content=original_message if original_message is not None else turn.message,
+                                     role=ChatCompletionMessageRole.USER if turn.is_user else ChatCompletionMessageRole.ASSISTANT)
+
+    @classmethod
+    def __convert_turn(cls, turn: DialogueTurn) -> list[ChatCompletionMessage]:
+        return cls.__get_function_messages(turn) + [cls.__convert_turn_message(turn)]
 
-            original_message = dict_utils.get_nested_value(turn.metadata, ["chatcompletion", "token_uncleaned_message"])
-            dialogue_converted.append(
-                ChatCompletionMessage(content=original_message if original_message is not None else turn.message,
-                                      role=ChatCompletionMessageRole.USER if turn.is_user else ChatCompletionMessageRole.ASSISTANT))
+    @property
+    def memory(self) -> 'RollingSummaryMemory | None':
+        return self.__memory
 
+    def __build_head_messages(self, summary: str | None = None) -> list[ChatCompletionMessage]:
         instruction = self.__instruction
         if instruction is not None:
 
@@ -208,46 +355,213 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
                     messages.append(ChatCompletionMessage(content=self.initial_user_message, role=ChatCompletionMessageRole.USER))
                 else:
                     messages.extend(self.initial_user_message)
-
-            messages.extend(dialogue_converted)
         else:
-            messages = dialogue_converted
-
-        result: ChatCompletionResult
-        if self.__api.is_messages_within_token_limit(messages, self.model, self.__token_limit_tolerance):
-            result = await self.__api.run_chat_completion(self.model, messages, self.__params.dict())
+            messages = []
+
+        if summary is not None:
+            messages.append(self.__memory.make_summary_message(summary))
+        return messages
+
+    def __get_prompt_turns(self, dialog: Dialogue) -> tuple[str | None, Dialogue]:
+        """
+        :return: The summary of the older turns if the memory has one, and the turns to send as they are
+        """
+        if self.__memory is None:
+            return None, dialog
+        return self.__memory.get_prompt(dialog)
+
+    def __build_prompt(self, summary: str | None, turns: Dialogue) -> list[ChatCompletionMessage]:
+        messages = self.__build_head_messages(summary)
+        for turn in turns:
+            messages.extend(self.__convert_turn(turn))
+        return messages
+
+    def __build_messages(self, dialog: Dialogue) -> list[ChatCompletionMessage]:
+        return self.__build_prompt(*self.__get_prompt_turns(dialog))
+
+    def __sync_context_account(self, dialog: Dialogue) -> ContextTokenAccount | None:
+        """
+        Bring the running token counts up to date with the dialogue, counting only what changed since the last turn.
+        :return: The account, or None if the API cannot count tokens message by message.
+        """
+        if self.__api.get_token_limit(self.model) is None:
+            return None
+
+        if self.__context_account is None or self.__context_account_model != self.model:
+            self.__context_account = ContextTokenAccount(self.__api.get_token_overhead(self.model))
+            self.__context_account_model = self.model
+
+        def count_message(message: ChatCompletionMessage) -> int:
+            return self.__api.count_token_in_message(message, self.model)
+
+        # With a memory, the account covers the summary in the head and the turns after it. Once a new summary is
+        # adopted, the remaining turns are counted again.
+        summary, turns = self.__get_prompt_turns(dialog)
+        account = self.__context_account
+        account.sync_head(self.__build_head_messages(summary), count_message)
+        # Tool schemas are sent along with every request, so they take up the window as well.
+        account.sync_tools(self.__params.tools, lambda tools: count_message(
+            ChatCompletionMessage(content=json.dumps(tools), role=ChatCompletionMessageRole.SYSTEM)))
+        # Function messages are counted apart, so that trimming handlers know what dropping them saves.
+        account.sync_turns(turns, lambda turn: count_message(self.__convert_turn_message(turn)),
+                           lambda turn: sum([count_message(message) for message in self.__get_function_messages(turn)]))
+        return account
+
+    def __get_context_budget(self) -> int:
+        return self.__api.get_token_limit(self.model) - self.__token_limit_tolerance - 1
+
+    async def __is_within_token_limit(self, dialog: Dialogue, messages: list[ChatCompletionMessage]) -> bool:
+        account = self.__sync_context_account(dialog)
+        if account is None:
+            return await self.__api.is_messages_within_token_limit_async(messages, self.model,
+                                                                         self.__token_limit_tolerance)
         else:
-            print(f"Token overflow - {len(messages)} message(s).")
-            if self.__token_limit_exceed_handler is not None:
-                result = await self.__token_limit_exceed_handler(dialog, messages)
-            else:
-                raise TokenLimitExceedError()
+            return account.total_tokens < self.__api.get_token_limit(self.model) - self.__token_limit_tolerance
+
+    def count_context_tokens(self, dialog: Dialogue) -> int | None:
+        """
+        :return: Tokens of the context that would be sent for the dialogue, including tool schemas, or None if the
+        API cannot count tokens message by message.
+        """
+        account = self.__sync_context_account(dialog)
+        return account.total_tokens if account is not None else None
+
+    def find_fitting_dialog_start(self, dialog: Dialogue) -> int | None:
+        """
+        :return: The index of the oldest turn to keep so that the context fits in the model's window with the
+        tolerance, or None if the API cannot count tokens message by message.
+        """
+        account = self.__sync_context_account(dialog)
+        if account is None:
+            return None
+        # Summarized turns are not sent in any case.
+        return len(dialog) - account.num_turns + account.find_trim_start(self.__get_context_budget())
+
+    @staticmethod
+    def __count_chars(messages: list[ChatCompletionMessage]) -> int:
+        return sum([len(message.content or "") for message in messages])
+
+    def __calibrate_prompt_estimate(self, messages: list[ChatCompletionMessage], prompt_tokens: int | None):
+        num_chars = self.__count_chars(messages)
+        if prompt_tokens is not None and num_chars > 0:
+            self.__prompt_tokens_per_char = prompt_tokens / num_chars
+
+    def __needs_token_count(self, messages: list[ChatCompletionMessage]) -> bool:
+        if not self.__optimistic_send:
+            return True
+        limit = self.__api.get_token_limit(self.model)
+        if limit is None:
+            return False
+        estimated_tokens = self.__count_chars(messages) * self.__prompt_tokens_per_char
+        return estimated_tokens >= limit * self.__optimistic_send_window_fraction
+
+    async def __check_token_limit(self, dialog: Dialogue, messages: list[ChatCompletionMessage]) -> bool:
+        if self.__needs_token_count(messages):
+            return await self.__is_within_token_limit(dialog, messages)
+        else:
+            return True
+
+    async def __handle_token_limit_rejected(self, dialog: Dialogue, messages: list[ChatCompletionMessage]
+                                            ) -> tuple[ChatCompletionResult, list[ChatCompletionMessage]]:
+        # Sent optimistically and rejected by the provider: only now count, so that the handler trims on cached counts
+        # and the next turns are counted before sending.
+        context_tokens = self.count_context_tokens(dialog)
+        self.__calibrate_prompt_estimate(messages, context_tokens if context_tokens is not None
+                                         else await self.__api.count_token_in_messages_async(messages, self.model))
+        return await self.__handle_token_limit_exceeded(dialog, messages)
+
+    def __on_result(self, messages: list[ChatCompletionMessage], result: ChatCompletionResult):
+        if self.__optimistic_send and not result.cached:
+            self.__calibrate_prompt_estimate(messages, result.prompt_tokens)
+
+    async def __handle_token_limit_exceeded(self, dialog: Dialogue, messages: list[ChatCompletionMessage]
+                                            ) -> tuple[ChatCompletionResult, list[ChatCompletionMessage]]:
+        """
+        :return: The result, and the messages it answers, which a trimming handler shortens
+        """
+        print(f"Token overflow - {len(messages)} message(s).")
+        if isinstance(self.__token_limit_exceed_handler, ContextTrimmingHandler):
+            account = self.__sync_context_account(dialog)
+            if account is None:
+                raise TokenLimitExceedError("The API cannot count tokens per message to trim the dialogue.")
+            summary, turns = self.__get_prompt_turns(dialog)
+            trimmed_turns = self.__token_limit_exceed_handler.trim(turns, account, self.__get_context_budget())
+            if trimmed_turns is None:
+                raise TokenLimitExceedError("The dialogue does not fit in the context window even when trimmed.")
+            if self.verbose:
+                print(f"Trimmed the dialogue from {len(turns)} to {len(trimmed_turns)} turn(s).")
+            messages = self.__build_prompt(summary, trimmed_turns)
+            result = await self.__api.run_chat_completion(self.model, messages, self.__params.dict(),
+                                                          coalesce=self.__coalesce_requests)
+            self.__on_result(messages, result)
+            return result, messages
+        elif self.__token_limit_exceed_handler is not None:
+            return await self.__token_limit_exceed_handler(dialog, messages), messages
+        else:
+            raise TokenLimitExceedError()
 
-        base_metadata = {"chatcompletion": {
+    @staticmethod
+    def __make_base_metadata(result: ChatCompletionResult) -> dict:
+        return {"chatcompletion": {
             "provider": result.provider,
             "model": result.model,
             "usage": {"prompt_tokens": result.prompt_tokens, "completion_tokens": result.completion_tokens,
-                      "total_tokens": result.total_tokens}
+                      "total_tokens": result.total_tokens},
+            "queue_time": result.queue_time,
+            "cached": result.cached,
+            "coalesced": result.coalesced
         }}
 
+    async def __call_functions(self, result: ChatCompletionResult) -> list[ChatCompletionMessage]:
+        function_messages = [result.message]
+        for tool_call in result.message.tool_calls:
+            function_name = tool_call.function.name
+            function_args = json.loads(tool_call.function.arguments)
+
+            if self.verbose: print(f"Call function - {function_name} ({function_args})")
+
+            with trace_span("tool_call", function=function_name):
+                function_call_result = await self.function_handler(function_name, function_args)
+            function_turn = ChatCompletionMessage(content=function_call_result, role=ChatCompletionMessageRole.TOOL,
+                                                  name=function_name, tool_call_id=tool_call.id)
+            function_messages.append(function_turn)
+        return function_messages
+
+    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+        with trace_span("prompt_assembly"):
+            if self.__memory is not None:
+                self.__memory.update(dialog)
+            messages = self.__build_messages(dialog)
+
+        result: ChatCompletionResult
+        with trace_span("token_counting"):
+            within_token_limit = await self.__check_token_limit(dialog, messages)
+        if within_token_limit:
+            try:
+                result = await self.__api.run_chat_completion(self.model, messages, self.__params.dict(),
+                                                              coalesce=self.__coalesce_requests)
+                self.__on_result(messages, result)
+            except TokenLimitExceedError:
+                if not self.__optimistic_send:
+                    raise
+                result, messages = await self.__handle_token_limit_rejected(dialog, messages)
+        else:
+            result, messages = await self.__handle_token_limit_exceeded(dialog, messages)
+
+        base_metadata = self.__make_base_metadata(result)
+
         if result.finish_reason == ChatCompletionFinishReason.Stop:
             response_text = result.message.content
             return response_text, base_metadata
         elif result.finish_reason == ChatCompletionFinishReason.Tool:
 
-            function_messages = [result.message]
-            for tool_call in result.message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
+            function_messages = await self.__call_functions(result)
 
-                if self.verbose: print(f"Call function - {function_name} ({function_args})")
+            new_result = await self.__api.run_chat_completion(self.model, messages + function_messages, self.__params.dict(),
+                                                              coalesce=self.__coalesce_requests)
 
-                function_call_result = await self.function_handler(function_name, function_args)
-                function_turn = ChatCompletionMessage(content=function_call_result, role=ChatCompletionMessageRole.TOOL,
-                                                      name=function_name, tool_call_id=tool_call.id)
-                function_messages.append(function_turn)
-
-            new_result = await self.__api.run_chat_completion(self.model, messages + function_messages, self.__params.dict())
+            if new_result.queue_time is not None:
+                base_metadata["chatcompletion"]["queue_time"] = (result.queue_time or 0) + new_result.queue_time
 
             if new_result.finish_reason == ChatCompletionFinishReason.Stop:
                 response_text = new_result.message.content
@@ -260,6 +574,72 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
         else:
             raise Exception(f"ChatCompletion error - {result.finish_reason}")
 
+    async def _get_response_stream_impl(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        with trace_span("prompt_assembly"):
+            if self.__memory is not None:
+                self.__memory.update(dialog)
+            messages = self.__build_messages(dialog)
+
+        result: ChatCompletionResult | None = None
+        handled_result: ChatCompletionResult | None = None
+        with trace_span("token_counting"):
+            within_token_limit = await self.__check_token_limit(dialog, messages)
+        if within_token_limit:
+            try:
+                async for chunk in self.__api.run_chat_completion_stream(self.model, messages, self.__params.dict()):
+                    if chunk.result is not None:
+                        result = chunk.result
+                        self.__on_result(messages, result)
+                    elif chunk.content_delta is not None:
+                        yield ResponseStreamChunk(delta=chunk.content_delta)
+            except TokenLimitExceedError:
+                # Providers reject an overlong prompt before streaming any content.
+                if not self.__optimistic_send:
+                    raise
+                handled_result, messages = await self.__handle_token_limit_rejected(dialog, messages)
+        else:
+            handled_result, messages = await self.__handle_token_limit_exceeded(dialog, messages)
+
+        if handled_result is not None:
+            result = handled_result
+            if result.message.content is not None:
+                yield ResponseStreamChunk(delta=result.message.content)
+        elif result is None:
+            raise Exception("ChatCompletion error - the stream ended without a result")
+
+        base_metadata = self.__make_base_metadata(result)
+
+        if result.finish_reason == ChatCompletionFinishReason.Stop:
+            yield ResponseStreamChunk(message=result.message.content, metadata=base_metadata)
+        elif result.finish_reason == ChatCompletionFinishReason.Tool:
+
+            function_messages = await self.__call_functions(result)
+
+            new_result: ChatCompletionResult | None = None
+            async for chunk in self.__api.run_chat_completion_stream(self.model, messages + function_messages,
+                                                                     self.__params.dict()):
+                if chunk.result is not None:
+                    new_result = chunk.result
+                elif chunk.content_delta is not None:
+                    yield ResponseStreamChunk(delta=chunk.content_delta)
+
+            if new_result is None:
+                raise Exception("ChatCompletion error - the stream after the tool calls ended without a result")
+
+            if new_result.queue_time is not None:
+                base_metadata["chatcompletion"]["queue_time"] = (result.queue_time or 0) + new_result.queue_time
+
+            if new_result.finish_reason == ChatCompletionFinishReason.Stop:
+                yield ResponseStreamChunk(message=new_result.message.content,
+                                          metadata=dict_utils.set_nested_value(base_metadata,
+                                                                               ["chatcompletion", "function_messages"],
+                                                                               function_messages))
+            else:
+                print("Shouldn't reach here")
+
+        else:
+            raise Exception(f"ChatCompletion error - {result.finish_reason}")
+
     def write_to_json(self, parcel: dict):
         parcel["model"] = self.model
         parcel["params"] = self.__params.dict()
@@ -267,6 +647,9 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
         parcel["base_instruction"] = self.__base_instruction
         parcel["instruction_parameters"] = self.__instruction_parameters
         parcel["verbose"] = self.verbose
+        if self.__memory is not None:
+            parcel["memory"] = dict()
+            self.__memory.write_to_json(parcel["memory"])
 
     def restore_from_json(self, parcel: dict):
         self.model = parcel["model"]
@@ -275,4 +658,6 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
         self.__base_instruction = parcel["base_instruction"]
         self.__instruction_parameters = parcel["instruction_parameters"]
         self.verbose = parcel["verbose"]
+        if self.__memory is not None and "memory" in parcel:
+            self.__memory.restore_from_json(parcel["memory"])
         self.__resolve_instruction()
@@ -1,7 +1,15 @@
+import asyncio
 from abc import ABC
-from typing import Callable
+from contextlib import aclosing
+from contextvars import copy_context
+from time import perf_counter
+from typing import Callable, AsyncIterator
 
+from chatlib.llm.deadline import DeadlineExceededError, iterate_with_deadline
+from chatlib.llm.scheduler import scheduling_context, set_scheduling_context, RequestPriority
 from chatlib.utils.dict_utils import set_nested_value
+from chatlib.utils.metrics import session_turns, session_writer_latency
+from chatlib.utils.tracing import trace_span, start_span, set_current_span
 from .response_generator import ResponseGenerator
 from .session_writer import SessionWriterBase, session_writer
 from .types import Dialogue, DialogueTurn
@@ -42,7 +50,9 @@ class ChatSessionBase(ABC):
     def save(self) -> bool:
         if self._session_writer is not None:
             session_info = self._to_info_dict()
+            start = perf_counter()
             self._session_writer.write_session_info(self.id, session_info)
+            self.__observe_writer_latency("write_session_info", start)
             return True
         else:
             return False
@@ -60,40 +70,114 @@ class ChatSessionBase(ABC):
     def dialog(self):
         return self._dialog.copy()
 
+    def __observe_writer_latency(self, operation: str, start: float):
+        session_writer_latency.labels(type(self._session_writer).__name__, operation).observe(perf_counter() - start)
+
     def _push_new_turn(self, turn: DialogueTurn):
         self._dialog.append(turn)
-        if self._session_writer is not None:
-            self._session_writer.write_turn(self.id, turn)
-        self.save()
+        session_turns.labels(type(self).__name__, "user" if turn.is_user else "system").inc()
+        with trace_span("persistence"):
+            if self._session_writer is not None:
+                start = perf_counter()
+                self._session_writer.write_turn(self.id, turn)
+                self.__observe_writer_latency("write_turn", start)
+            self.save()
 
     def _pop_last_turn(self) -> DialogueTurn | None:
         if len(self._dialog) > 0:
             pop = self._dialog.pop()
             if self._session_writer is not None:
-                self._session_writer.delete_turn(self.id, pop.id)
+                with trace_span("persistence"):
+                    start = perf_counter()
+                    self._session_writer.delete_turn(self.id, pop.id)
+                    self.__observe_writer_latency("delete_turn", start)
             return pop
 
 
 class TurnTakingChatSession(ChatSessionBase):
 
-    async def initialize(self) -> DialogueTurn:
+    async def initialize(self, timeout: float | None = None) -> DialogueTurn:
         self._dialog.clear()
-        initial_message, metadata, elapsed = await self._response_generator.get_response(self._dialog)
+        with scheduling_context(RequestPriority.Interactive, self.id):
+            initial_message, metadata, elapsed = await self._response_generator.get_response(self._dialog,
+                                                                                             timeout=timeout)
         system_turn = DialogueTurn(message=initial_message, is_user=False, processing_time=elapsed, metadata=metadata)
         self._push_new_turn(system_turn)
         return system_turn
 
-    async def push_user_message(self, user_turn: DialogueTurn) -> DialogueTurn:
-        self._push_new_turn(user_turn)
-        system_message, metadata, elapsed = await self._response_generator.get_response(self._dialog)
+    async def push_user_message(self, user_turn: DialogueTurn, timeout: float | None = None) -> DialogueTurn:
+        """
+        :param timeout: Seconds within which the system turn must be generated. If the turn is cancelled or runs out of
+        time, the user turn is withdrawn so that the session is left as before the call.
+        """
+        with trace_span("turn", session=self.id) as span:
+            self._push_new_turn(user_turn)
+            try:
+                with scheduling_context(RequestPriority.Interactive, self.id):
+                    system_message, metadata, elapsed = await self._response_generator.get_response(self._dialog,
+                                                                                                     timeout=timeout)
+            except (DeadlineExceededError, asyncio.CancelledError):
+                self._pop_last_turn()
+                raise
+            # Covers the persistence of the user turn as well as the response.
+            metadata = set_nested_value(metadata, "timings", span.get_stage_timings())
         system_turn = DialogueTurn(message=system_message, is_user=False, processing_time=elapsed, metadata=metadata)
         self._push_new_turn(system_turn)
         return system_turn
 
-    async def regenerate_last_system_message(self) -> DialogueTurn | None:
+    async def push_user_message_stream(self, user_turn: DialogueTurn,
+                                       timeout: float | None = None) -> AsyncIterator[str | DialogueTurn]:
+        """
+        Streaming variant of push_user_message.
+        :param user_turn: A user turn to push
+        :param timeout: Seconds within which the system turn must be completed
+        :return: Yields message deltas as they arrive, then the persisted system turn.
+        """
+        completed = False
+        span = start_span("turn", session=self.id, stream=True)
+        # The turn span and the scheduling context are set only in the context the stream runs in, not in the
+        # consumer's between deltas.
+        context = copy_context()
+        context.run(set_current_span, span)
+        context.run(set_scheduling_context, RequestPriority.Interactive, self.id)
+        try:
+            context.run(self._push_new_turn, user_turn)
+            try:
+                async with aclosing(iterate_with_deadline(
+                        self._response_generator.get_response_stream(self._dialog, timeout=timeout),
+                        context)) as chunks:
+                    async for chunk in chunks:
+                        if chunk.is_final:
+                            system_turn = DialogueTurn(message=chunk.message, is_user=False,
+                                                       processing_time=chunk.elapsed,
+                                                       metadata=set_nested_value(chunk.metadata, "timings",
+                                                                                 span.get_stage_timings()))
+                            context.run(self._push_new_turn, system_turn)
+                            completed = True
+                            yield system_turn
+                        else:
+                            yield chunk.delta
+            except (DeadlineExceededError, asyncio.CancelledError, GeneratorExit):
+                # Deltas delivered so far are discarded along with the user turn.
+                if not completed:
+                    context.run(self._pop_last_turn)
+                raise
+        except BaseException as e:
+            span.end(e)
+            raise
+        span.end()
+
+    async def regenerate_last_system_message(self, timeout: float | None = None) -> DialogueTurn | None:
         if len(self.dialog) > 0 and self.dialog[len(self.dialog) - 1].is_user is False:
             popped_system_turn = self._pop_last_turn()
-            system_message, metadata, elapsed = await self._response_generator.get_response(self._dialog, dry=True)
+            try:
+                with scheduling_context(RequestPriority.Interactive, self.id):
+                    system_message, metadata, elapsed = await self._response_generator.get_response(self._dialog,
+                                                                                                     dry=True,
+                                                                                                     timeout=timeout)
+            except (DeadlineExceededError, asyncio.CancelledError):
+                self._push_new_turn(popped_system_turn)
+                raise
             metadata = set_nested_value(metadata, "regenerated", True)
             metadata = set_nested_value(metadata, "original_turn", popped_system_turn.__dict__)
             new_system_turn = DialogueTurn(message=system_message, is_user=False, processing_time=elapsed, metadata=metadata)
@@ -141,7 +225,8 @@ class MultiAgentChatSession(ChatSessionBase):
 
     async def generate_conversation(self,
                                     max_turns: int,
-                                    on_message: Callable[[DialogueTurn], None]
+                                    on_message: Callable[[DialogueTurn], None],
+                                    turn_timeout: float | None = None
                                     ) -> Dialogue:
         self.dialog.clear()
         self.__is_running = True
@@ -150,7 +235,9 @@ class MultiAgentChatSession(ChatSessionBase):
         turn_count = 0
         while self.__is_stop_requested == False and max_turns > turn_count:
             turn_count += 1
-            system_message, payload, elapsed = await self._response_generator.get_response(self.dialog)
+            with scheduling_context(RequestPriority.Background, self.id):
+                system_message, payload, elapsed = await self._response_generator.get_response(self.dialog,
+                                                                                               timeout=turn_timeout)
             system_turn = DialogueTurn(message=system_message, is_user=False, processing_time=elapsed, metadata=payload)
             self._push_new_turn(system_turn)
             on_message(system_turn)
@@ -158,7 +245,9 @@ class MultiAgentChatSession(ChatSessionBase):
             role_reverted_dialog = [DialogueTurn(message=turn.message, is_user=turn.is_user is False) for turn in
                                     self.dialog]
 
-            user_message, payload, elapsed = await self.__user_generator.get_response(role_reverted_dialog)
+            with scheduling_context(RequestPriority.Background, self.id):
+                user_message, payload, elapsed = await self.__user_generator.get_response(role_reverted_dialog,
+                                                                                          timeout=turn_timeout)
 
             user_turn = DialogueTurn(message=user_message, is_user=True, processing_time=elapsed, metadata=payload)
             self._push_new_turn(user_turn)
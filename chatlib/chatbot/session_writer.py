@@ -1,7 +1,9 @@
 import json
+import os
 import shutil
 from abc import ABC, abstractmethod
 from os import path, getcwd, makedirs
+from typing import Callable
 
 import jsonlines
 
@@ -65,9 +67,19 @@ class SessionFileWriter(SessionWriterBase):
     def exists(self, session_id: str) -> bool:
         return path.exists(self.__get_session_info_file_path(session_id))
 
+    @staticmethod
+    def __replace_file(file_path: str, write: Callable[[str], None]):
+        # Write to a temporary file first, so that an interrupted write never leaves a truncated file behind.
+        temp_path = file_path + ".tmp"
+        write(temp_path)
+        os.replace(temp_path, file_path)
+
     def write_session_info(self, session_id, session_info: dict):
-        with open(self.__get_session_info_file_path(session_id, True), "w", encoding='utf-8') as f:
-            json.dump(session_info, f, indent=2)
+        def write(file_path: str):
+            with open(file_path, "w", encoding='utf-8') as f:
+                json.dump(session_info, f, indent=2)
+
+        self.__replace_file(self.__get_session_info_file_path(session_id, True), write)
 
     def read_session_info(self, session_id) -> dict:
         with open(self.__get_session_info_file_path(session_id), 'r', encoding='utf-8') as f:
@@ -101,8 +113,11 @@ class SessionFileWriter(SessionWriterBase):
     def write_dialogue(self, session_id: str, dialog: Dialogue):
         fp = self.__get_dialogue_file_path(session_id)
         if path.exists(fp):
-            with jsonlines.open(fp, "w") as writer:
-                writer.write_all([turn.__dict__ for turn in dialog])
+            def write(file_path: str):
+                with jsonlines.open(file_path, "w") as writer:
+                    writer.write_all([turn.__dict__ for turn in dialog])
+
+            self.__replace_file(fp, write)
 
     def clear_data(self, session_id) -> bool:
         dir_path = SessionFileWriter.__get_dialogue_directory_path(session_id)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from time import monotonic
+
+from pydantic import BaseModel, ConfigDict
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionResult
+
+
+class BatchJobStatus(StrEnum):
+    Validating = "validating"
+    InProgress = "in_progress"
+    Finalizing = "finalizing"
+    Completed = "completed"
+    Failed = "failed"
+    Expired = "expired"
+    Cancelling = "cancelling"
+    Cancelled = "cancelled"
+
+    @property
+    def is_terminal(self) -> bool:
+        return self in {BatchJobStatus.Completed, BatchJobStatus.Failed, BatchJobStatus.Expired,
+                        BatchJobStatus.Cancelled}
+
+
+class ChatCompletionBatchRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    custom_id: str
+    model: str
+    messages: list[ChatCompletionMessage]
+    params: dict
+
+
+class ChatCompletionBatchResult(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    custom_id: str
+    result: ChatCompletionResult | None = None
+    error: str | None = None
+
+
+class BatchJobFailedError(Exception):
+    def __init__(self, job_id: str, status: BatchJobStatus):
+        super().__init__(f"Batch job {job_id} ended with status {status}.")
+        self.job_id = job_id
+        self.status = status
+
+
+def make_batch_jsonl(requests: list[ChatCompletionBatchRequest], endpoint: str = "/v1/chat/completions") -> str:
+    return "\n".join([json.dumps({
+        "custom_id": request.custom_id,
+        "method": "POST",
+        "url": endpoint,
+        "body": {"model": request.model, "messages": [message.dict() for message in request.messages],
+                 **request.params}
+    }, ensure_ascii=False) for request in requests]) + "\n"
+
+
+class ChatCompletionBatchAPI(ABC):
+    """
+    Offline batch jobs of chat completion requests. Providers process them asynchronously, typically within hours and
+    at a discount, which suits bulk labelling rather than live sessions.
+    """
+
+    @abstractmethod
+    async def submit(self, requests: list[ChatCompletionBatchRequest]) -> str:
+        """
+        :return: The id of the created job
+        """
+        pass
+
+    @abstractmethod
+    async def get_status(self, job_id: str) -> BatchJobStatus:
+        pass
+
+    @abstractmethod
+    async def get_results(self, job_id: str) -> list[ChatCompletionBatchResult]:
+        pass
+
+    @abstractmethod
+    async def cancel(self, job_id: str):
+        pass
+
+    async def aclose(self):
+        pass
+
+    async def run(self, requests: list[ChatCompletionBatchRequest], poll_interval: float = 30,
+                  timeout: float | None = None) -> dict[str, ChatCompletionBatchResult]:
+        """
+        Submit the requests as one job and wait for it to finish.
+        :param timeout: Seconds to wait before cancelling the job
+        :return: Results by custom id. Requests that the job did not answer (e.g., expired) get an error result.
+        """
+        job_id = await self.submit(requests)
+        started_at = monotonic()
+        while True:
+            status = await self.get_status(job_id)
+            if status.is_terminal:
+                break
+
+            if timeout is not None and monotonic() - started_at > timeout:
+                await self.cancel(job_id)
+                raise TimeoutError(f"Batch job {job_id} did not finish in {timeout} seconds.")
+
+            await asyncio.sleep(poll_interval)
+
+        if status not in {BatchJobStatus.Completed, BatchJobStatus.Expired}:
+            raise BatchJobFailedError(job_id, status)
+
+        # An expired job still returns the requests completed in time.
+        results = {result.custom_id: result for result in await self.get_results(job_id)}
+        for request in requests:
+            if request.custom_id not in results:
+                results[request.custom_id] = ChatCompletionBatchResult(custom_id=request.custom_id,
+                                                                       error=f"No result in job {job_id} ({status}).")
+        return results
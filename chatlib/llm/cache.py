@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from os import path, makedirs, getcwd
+from time import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionResult
+
+
+def make_request_key(provider: str, model: str, messages: list['ChatCompletionMessage'], params: dict) -> str:
+    """
+    A stable content hash of a chat completion request.
+    """
+    payload = json.dumps(dict(provider=provider, model=model,
+                              messages=[message.model_dump(mode="json", exclude_none=True) for message in messages],
+                              params=params), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_deterministic_request(params: dict) -> bool:
+    # Without an explicit zero temperature, providers sample with their default temperature.
+    return params.get("temperature") == 0 and (params.get("n") or 1) == 1
+
+
+class ChatCompletionCacheTier(ABC):
+
+    @abstractmethod
+    async def get(self, key: str) -> 'ChatCompletionResult | None':
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, result: 'ChatCompletionResult'):
+        pass
+
+    @abstractmethod
+    async def clear(self):
+        pass
+
+
+class MemoryCacheTier(ChatCompletionCacheTier):
+
+    def __init__(self, max_entries: int = 1024, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__entries: OrderedDict[str, tuple[float, 'ChatCompletionResult']] = OrderedDict()
+
+    async def get(self, key: str) -> 'ChatCompletionResult | None':
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+
+        created_at, result = entry
+        if self.ttl is not None and time() - created_at > self.ttl:
+            del self.__entries[key]
+            return None
+
+        self.__entries.move_to_end(key)
+        return result
+
+    async def set(self, key: str, result: 'ChatCompletionResult'):
+        self.__entries[key] = (time(), result)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    async def clear(self):
+        self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+class SQLiteCacheTier(ChatCompletionCacheTier):
+    """
+    A persistent tier in a local SQLite file. Least recently used entries are evicted once the stored results exceed
+    max_size_bytes. Disk access runs on a worker thread.
+    """
+
+    def __init__(self, file_path: str | None = None, max_size_bytes: int = 256 * 1024 * 1024, ttl: float | None = None):
+        self.file_path = file_path or path.join(getcwd(), "data/cache/chat_completion.sqlite3")
+        self.max_size_bytes = max_size_bytes
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__connection: sqlite3.Connection | None = None
+
+    def __get_connection(self) -> sqlite3.Connection:
+        if self.__connection is None:
+            dir_path = path.dirname(self.file_path)
+            if len(dir_path) > 0 and not path.exists(dir_path):
+                makedirs(dir_path)
+            self.__connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self.__connection.execute("""CREATE TABLE IF NOT EXISTS chat_completion_cache (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,
+                created_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS chat_completion_cache_accessed_at ON chat_completion_cache (accessed_at)")
+            self.__connection.commit()
+        return self.__connection
+
+    def __get_sync(self, key: str) -> str | None:
+        with self.__lock:
+            connection = self.__get_connection()
+            row = connection.execute("SELECT value, created_at FROM chat_completion_cache WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            now = time()
+            if self.ttl is not None and now - created_at > self.ttl:
+                connection.execute("DELETE FROM chat_completion_cache WHERE key = ?", (key,))
+                connection.commit()
+                return None
+
+            connection.execute("UPDATE chat_completion_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            connection.commit()
+            return value
+
+    def __set_sync(self, key: str, value: str):
+        with self.__lock:
+            connection = self.__get_connection()
+            now = time()
+            connection.execute("INSERT OR REPLACE INTO chat_completion_cache VALUES (?, ?, ?, ?, ?)",
+                               (key, value, len(value.encode("utf-8")), now, now))
+
+            total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM chat_completion_cache").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                rows = connection.execute("SELECT key, size FROM chat_completion_cache ORDER BY accessed_at").fetchall()
+                evicted = []
+                for evict_key, size in rows:
+                    if total_size <= self.max_size_bytes:
+                        break
+                    evicted.append((evict_key,))
+                    total_size -= size
+                connection.executemany("DELETE FROM chat_completion_cache WHERE key = ?", evicted)
+
+            if self.ttl is not None:
+                connection.execute("DELETE FROM chat_completion_cache WHERE created_at < ?", (now - self.ttl,))
+
+            connection.commit()
+
+    def __clear_sync(self):
+        with self.__lock:
+            connection = self.__get_connection()
+            connection.execute("DELETE FROM chat_completion_cache")
+            connection.commit()
+
+    async def get(self, key: str) -> 'ChatCompletionResult | None':
+        from chatlib.llm.chat_completion_api import ChatCompletionResult
+
+        value = await asyncio.to_thread(self.__get_sync, key)
+        return ChatCompletionResult.model_validate_json(value) if value is not None else None
+
+    async def set(self, key: str, result: 'ChatCompletionResult'):
+        await asyncio.to_thread(self.__set_sync, key, result.model_dump_json())
+
+    async def clear(self):
+        await asyncio.to_thread(self.__clear_sync)
+
+    def close(self):
+        with self.__lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+
+@dataclass
+class ChatCompletionCacheStats:
+    hits: int = 0
+    misses: int = 0
+    bypasses: int = 0
+    hits_by_tier: dict[int, int] = field(default_factory=dict)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0
+
+
+class ChatCompletionCache:
+    """
+    A tiered cache of chat completion results, looked up in order. A hit in a lower tier is copied to the upper ones.
+    Requests with non-deterministic sampling parameters bypass the cache unless cache_nondeterministic is set.
+    """
+
+    def __init__(self, tiers: list[ChatCompletionCacheTier] | None = None, cache_nondeterministic: bool = False):
+        self.tiers = tiers if tiers is not None else [MemoryCacheTier()]
+        self.cache_nondeterministic = cache_nondeterministic
+        self.stats = ChatCompletionCacheStats()
+
+    def make_key(self, provider: str, model: str, messages: list['ChatCompletionMessage'],
+                 params: dict) -> str | None:
+        """
+        :return: The cache key of the request, or None if the request bypasses the cache.
+        """
+        if not self.cache_nondeterministic and not is_deterministic_request(params):
+            self.stats.bypasses += 1
+            return None
+        return make_request_key(provider, model, messages, params)
+
+    async def get(self, key: str) -> 'ChatCompletionResult | None':
+        for i, tier in enumerate(self.tiers):
+            result = await tier.get(key)
+            if result is not None:
+                for upper_tier in self.tiers[:i]:
+                    await upper_tier.set(key, result)
+                self.stats.hits += 1
+                self.stats.hits_by_tier[i] = self.stats.hits_by_tier.get(i, 0) + 1
+                return result
+
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, result: 'ChatCompletionResult'):
+        for tier in self.tiers:
+            await tier.set(key, result)
+
+    async def clear(self):
+        for tier in self.tiers:
+            await tier.clear()
@@ -1,12 +1,27 @@
+import asyncio
 from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from enum import StrEnum
-from functools import cache
-from typing import Optional
+from time import monotonic
+from typing import Optional, AsyncIterator
 
 from pydantic import BaseModel, ConfigDict, Field
 
+from chatlib.llm.cache import ChatCompletionCache, make_request_key
+from chatlib.llm.deadline import get_remaining_time, check_deadline, get_deadline, DeadlineExceededError
+from chatlib.llm.hedging import HedgingPolicy
+from chatlib.llm.rate_limit import RateLimiter, rate_limiter, RateLimitAdmission
+from chatlib.llm.scheduler import RequestScheduler, request_scheduler
+from chatlib.llm.tokenizer import tokenizer_service
+from chatlib.llm.single_flight import SingleFlight
+from chatlib.llm.retry import RetryPolicy, ExponentialBackoffRetryPolicy, CircuitBreakerRegistry, \
+    circuit_breaker_registry, CircuitBreaker
 from chatlib.utils.integration import IntegrationService
+from chatlib.utils.metrics import chat_completion_requests, chat_completion_retries, chat_completion_tokens, \
+    chat_completion_provider_latency, chat_completion_queue_wait, chat_completion_cache_lookups, \
+    chat_completion_hedges, chat_completion_hedge_wins
+from chatlib.utils.tracing import trace_span, start_span
 
 
 class ChatCompletionMessageRole(StrEnum):
@@ -30,6 +45,33 @@ class ChatCompletionToolCall:
     type: str = "function"
 
 
+@dataclass(frozen=True)
+class ChatCompletionToolCallDelta:
+    index: int
+    id: str | None = None
+    function_name: str | None = None
+    function_arguments: str | None = None
+    type: str | None = None
+
+
+def merge_tool_call_deltas(deltas: list[ChatCompletionToolCallDelta]) -> list[ChatCompletionToolCall]:
+    merged: dict[int, dict] = dict()
+    for delta in deltas:
+        entry = merged.setdefault(delta.index, dict(id="", name="", arguments="", type="function"))
+        if delta.id is not None:
+            entry["id"] = delta.id
+        if delta.function_name is not None:
+            entry["name"] += delta.function_name
+        if delta.function_arguments is not None:
+            entry["arguments"] += delta.function_arguments
+        if delta.type is not None:
+            entry["type"] = delta.type
+
+    return [ChatCompletionToolCall(index=index, id=entry["id"], type=entry["type"],
+                                   function=ChatCompletionFunction(name=entry["name"], arguments=entry["arguments"]))
+            for index, entry in sorted(merged.items())]
+
+
 class ChatCompletionMessage(BaseModel):
     model_config = ConfigDict(frozen=True)
 
@@ -40,8 +82,8 @@ class ChatCompletionMessage(BaseModel):
     tool_call_id: Optional[str] = None
     tool_calls: list[ChatCompletionToolCall] | None = None
 
-    @cache
     def dict(self) -> dict:
+        # Not cached: functools.cache hashes the message, which fails once tool_calls (a list) is set.
         return super().dict(exclude_none=True)
 
 
@@ -65,15 +107,54 @@ class ChatCompletionResult(BaseModel):
     prompt_tokens: int | None = None
     total_tokens: int | None = None
 
+    # Milliseconds spent waiting for the scheduler and the rate limiter, summed over retries.
+    queue_time: int | None = None
+
+    # True if the result was served from a response cache; the usage was billed by the original request.
+    cached: bool = False
+
+    # True if the result was shared from an identical request made concurrently by another caller.
+    coalesced: bool = False
+
+
+class ChatCompletionChunk(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    content_delta: str | None = None
+    tool_call_deltas: list[ChatCompletionToolCallDelta] | None = None
+
+    # Only the last chunk of a stream carries the finished result.
+    result: ChatCompletionResult | None = None
+
 
 class TokenLimitExceedError(Exception):
     pass
 
 
+# Phrases with which providers reject prompts that do not fit in the context window.
+CONTEXT_LENGTH_ERROR_PATTERNS = ["context_length_exceeded", "maximum context length", "context length",
+                                 "context window", "prompt is too long", "too many tokens", "input is too long",
+                                 "exceeds the maximum number of tokens"]
+
+
+def is_context_length_error_message(message: str | None) -> bool:
+    return message is not None and any([pattern in message.lower() for pattern in CONTEXT_LENGTH_ERROR_PATTERNS])
+
+
 @dataclass(frozen=True)
 class ChatCompletionRetryRequestedException(Exception):
     caused_by: Exception | None = None
 
+    # Seconds the provider asked to wait (Retry-After), if any.
+    retry_after: float | None = None
+
+
+@dataclass
+class _ChatCompletionAdmission:
+    rate_limit: RateLimitAdmission | None
+    queue_time: float
+    reconciled: bool = False
+
 
 class ChatCompletionAPIGlobalConfig(BaseModel):
     verbose: bool | None = False
@@ -83,10 +164,262 @@ class ChatCompletionAPI(IntegrationService, ABC):
 
     def __init__(self):
         self.__config = ChatCompletionAPIGlobalConfig(verbose=False)
+        self.__retry_policy: RetryPolicy = ExponentialBackoffRetryPolicy()
+        self.__circuit_breakers: CircuitBreakerRegistry | None = circuit_breaker_registry
+        self.__rate_limiter: RateLimiter | None = rate_limiter
+        self.__scheduler: RequestScheduler | None = request_scheduler
+        self.__response_cache: ChatCompletionCache | None = None
+        # Per instance: instances of a provider may differ in credentials, endpoints or retry and hedging settings.
+        self.__single_flight: SingleFlight[ChatCompletionResult] = SingleFlight()
+        self.__hedging_policy: HedgingPolicy | None = None
 
     def config(self) -> ChatCompletionAPIGlobalConfig:
         return self.__config
 
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self.__retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, policy: RetryPolicy):
+        self.__retry_policy = policy
+
+    @property
+    def circuit_breakers(self) -> CircuitBreakerRegistry | None:
+        return self.__circuit_breakers
+
+    @circuit_breakers.setter
+    def circuit_breakers(self, registry: CircuitBreakerRegistry | None):
+        """
+        :param registry: A registry of per-provider/model circuit breakers. Set None to disable circuit breaking.
+        """
+        self.__circuit_breakers = registry
+
+    @property
+    def rate_limiter(self) -> RateLimiter | None:
+        return self.__rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, limiter: RateLimiter | None):
+        """
+        :param limiter: A limiter holding RPM/TPM limits per provider and model. Set None to disable rate limiting.
+        """
+        self.__rate_limiter = limiter
+
+    @property
+    def scheduler(self) -> RequestScheduler | None:
+        return self.__scheduler
+
+    @scheduler.setter
+    def scheduler(self, scheduler: RequestScheduler | None):
+        """
+        :param scheduler: A scheduler bounding concurrent requests per provider. Set None to disable scheduling.
+        """
+        self.__scheduler = scheduler
+
+    @property
+    def response_cache(self) -> ChatCompletionCache | None:
+        return self.__response_cache
+
+    @response_cache.setter
+    def response_cache(self, cache: ChatCompletionCache | None):
+        """
+        :param cache: A cache of results for identical deterministic requests. None (default) disables caching.
+        """
+        self.__response_cache = cache
+
+    @property
+    def single_flight(self) -> SingleFlight[ChatCompletionResult]:
+        return self.__single_flight
+
+    @single_flight.setter
+    def single_flight(self, single_flight: SingleFlight[ChatCompletionResult]):
+        """
+        :param single_flight: The group within which requests made with coalesce=True are coalesced. Each instance has
+        its own by default. Share a group only among instances with the same credentials and settings, as a request
+        may receive the result or error of another instance's call.
+        """
+        self.__single_flight = single_flight
+
+    @property
+    def hedging_policy(self) -> HedgingPolicy | None:
+        return self.__hedging_policy
+
+    @hedging_policy.setter
+    def hedging_policy(self, policy: HedgingPolicy | None):
+        """
+        :param policy: A policy duplicating slow run_chat_completion calls. None (default) disables hedging.
+        """
+        self.__hedging_policy = policy
+
+    def __get_cache_key(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> str | None:
+        if self.__response_cache is None:
+            return None
+        return self.__response_cache.make_key(self.provider_name(), model, messages, params)
+
+    @staticmethod
+    def __mark_cached(result: ChatCompletionResult) -> ChatCompletionResult:
+        return result.model_copy(update=dict(cached=True, queue_time=0))
+
+    async def _estimate_prompt_tokens(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        try:
+            count = await self.count_token_in_messages_async(messages, model)
+        except Exception:
+            count = None
+
+        if count is None or count <= 0:
+            # Providers without a tokenizer: roughly four characters per token.
+            return sum([len(message.content or "") for message in messages]) // 4 + 1
+        else:
+            return count
+
+    @asynccontextmanager
+    async def __admit(self, model: str, messages: list[ChatCompletionMessage],
+                      params: dict) -> AsyncIterator['_ChatCompletionAdmission']:
+        # Scheduler slot first, then rate limit, so that queued requests do not hold rate-limit capacity.
+        queue_span = start_span("queue")
+        try:
+            queue_time = await self.__scheduler.acquire(self.provider_name()) if self.__scheduler is not None else 0
+        except BaseException as e:
+            queue_span.end(e)
+            raise
+        admission = None
+        try:
+            rate_limit_admission = None
+            if self.__rate_limiter is not None:
+                if self.__rate_limiter.requires_token_estimate(self.provider_name(), model):
+                    estimated_tokens = await self._estimate_prompt_tokens(messages, model) + (params.get("max_tokens") or 0)
+                else:
+                    estimated_tokens = 0
+                rate_limit_admission = await self.__rate_limiter.acquire(self.provider_name(), model, estimated_tokens)
+
+            if rate_limit_admission is not None:
+                queue_time += rate_limit_admission.wait_time
+            queue_span.end()
+            chat_completion_queue_wait.labels(self.provider_name()).observe(queue_time)
+
+            admission = _ChatCompletionAdmission(rate_limit_admission, queue_time)
+            yield admission
+        except BaseException as e:
+            queue_span.end(e)
+            if admission is not None and not admission.reconciled:
+                # Cancelled or out of time before the result arrived: give the reserved tokens back.
+                self.__reconcile_rate_limit(admission, None)
+            raise
+        finally:
+            if self.__scheduler is not None:
+                self.__scheduler.release(self.provider_name())
+
+    def __reconcile_rate_limit(self, admission: '_ChatCompletionAdmission', result: ChatCompletionResult | None):
+        admission.reconciled = True
+        if admission.rate_limit is not None:
+            if result is None:
+                self.__rate_limiter.reconcile(admission.rate_limit, 0)
+            elif result.total_tokens is not None:
+                self.__rate_limiter.reconcile(admission.rate_limit, result.total_tokens)
+
+    def __on_attempt_failed(self, model: str, error: Exception, breaker: CircuitBreaker | None, trial: int,
+                            trial_count: int, retryable: bool = True) -> ChatCompletionRetryRequestedException:
+        """
+        :return: The retry request if the call should be retried. Otherwise, raises the error to propagate.
+        """
+        try:
+            return self.__get_retry_request(error, breaker, trial, trial_count, retryable)
+        except BaseException:
+            chat_completion_requests.labels(self.provider_name(), model, "error").inc()
+            raise
+
+    def __get_retry_request(self, error: Exception, breaker: CircuitBreaker | None, trial: int, trial_count: int,
+                            retryable: bool) -> ChatCompletionRetryRequestedException:
+        if self._is_context_length_error(error):
+            # The provider answered; the prompt does not fit and retrying it as is cannot help.
+            if breaker is not None:
+                breaker.record_success()
+            raise TokenLimitExceedError(str(error)) from error
+
+        retry_request = self._classify_retryable_error(error)
+        if retry_request is None:
+            # The provider answered; the request itself was at fault.
+            if breaker is not None:
+                breaker.record_success()
+            raise error
+
+        if breaker is not None:
+            breaker.record_failure()
+
+        if not retryable or trial >= trial_count:
+            raise retry_request.caused_by or retry_request
+
+        return retry_request
+
+    def _get_circuit_breaker(self, model: str) -> CircuitBreaker | None:
+        return self.__circuit_breakers.get(self.provider_name(), model) if self.__circuit_breakers is not None else None
+
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        """
+        Decide whether an error raised by the provider is transient.
+        Override to map provider-specific exceptions (rate limits, overloads, timeouts).
+        :param error: An exception raised by _run_chat_completion_impl
+        :return: A retry request, or None if the error should propagate immediately.
+        """
+        if isinstance(error, ChatCompletionRetryRequestedException):
+            return error
+        else:
+            return None
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        """
+        Override to recognize the provider's rejection of a prompt longer than the context window.
+        Such errors are raised as TokenLimitExceedError without retrying.
+        """
+        return False
+
+    def _on_chat_completion_result(self, model: str, messages: list[ChatCompletionMessage],
+                                   result: ChatCompletionResult):
+        """
+        Called with every result received from the provider, e.g., to calibrate token estimation with its usage.
+        """
+        pass
+
+    def __record_result(self, model: str, result: ChatCompletionResult):
+        chat_completion_requests.labels(self.provider_name(), model, "success").inc()
+        if result.prompt_tokens is not None:
+            chat_completion_tokens.labels(self.provider_name(), model, "in").inc(result.prompt_tokens)
+        if result.completion_tokens is not None:
+            chat_completion_tokens.labels(self.provider_name(), model, "out").inc(result.completion_tokens)
+
+    def _get_request_timeout_kwargs(self) -> dict:
+        """
+        :return: Keyword arguments bounding a provider call by the active deadline, e.g., dict(timeout=3.2).
+        """
+        remaining = get_remaining_time()
+        return dict(timeout=max(remaining, 0.001)) if remaining is not None else dict()
+
+    async def __wait_before_retry(self, model: str, trial: int, retry_request: ChatCompletionRetryRequestedException):
+        delay = self.__retry_policy.get_delay(trial, retry_request.retry_after)
+        deadline = get_deadline()
+        if deadline is not None and delay >= deadline.remaining:
+            # The retry could not answer in time anyway.
+            chat_completion_requests.labels(self.provider_name(), model, "error").inc()
+            raise DeadlineExceededError(deadline.budget, retry_request.caused_by)
+        chat_completion_retries.labels(self.provider_name(), model).inc()
+        if self.config().verbose:
+            print(f"Retry chat completion of {self.provider_name()} in {delay:.2f} sec - {retry_request.caused_by}")
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        """
+        Release long-lived resources such as pooled HTTP connections. The API object may be used again afterwards.
+        """
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
     @abstractmethod
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
@@ -99,25 +432,246 @@ class ChatCompletionAPI(IntegrationService, ABC):
 
     async def run_chat_completion(self, model: str, messages: list[ChatCompletionMessage],
                                   params: dict,
-                                  trial_count: int = 5) -> ChatCompletionResult | None:
+                                  trial_count: int = 5,
+                                  coalesce: bool = False) -> ChatCompletionResult:
+        """
+        :param coalesce: If True, concurrent identical requests share one provider call. The call runs with the
+        deadline and scheduling context of the request that started it; a request that joins it stops waiting when
+        cancelled, but does not shorten or reprioritize it.
+        """
         self.assert_authorize()
+
+        cache_key = self.__get_cache_key(model, messages, params)
+        if cache_key is not None:
+            cached_result = await self.__response_cache.get(cache_key)
+            chat_completion_cache_lookups.labels(self.provider_name(), "miss" if cached_result is None else "hit").inc()
+            if cached_result is not None:
+                return self.__mark_cached(cached_result)
+
+        if coalesce:
+            flight_key = cache_key or make_request_key(self.provider_name(), model, messages, params)
+            result, shared = await self.__single_flight.run(
+                flight_key, lambda: self.__run_chat_completion_hedged(model, messages, params, trial_count, cache_key))
+            return result.model_copy(update=dict(coalesced=True, queue_time=0)) if shared else result
+        else:
+            return await self.__run_chat_completion_hedged(model, messages, params, trial_count, cache_key)
+
+    async def __run_chat_completion_hedged(self, model: str, messages: list[ChatCompletionMessage],
+                                           params: dict, trial_count: int,
+                                           cache_key: str | None) -> ChatCompletionResult:
+        policy = self.__hedging_policy
+        if policy is None:
+            return await self.__run_chat_completion_with_retries(model, messages, params, trial_count, cache_key)
+
+        delay = policy.get_delay(self.provider_name(), model)
+        policy.get_stats(self.provider_name(), model).requests += 1
+
+        started_at = monotonic()
+        primary = asyncio.ensure_future(
+            self.__run_chat_completion_with_retries(model, messages, params, trial_count, cache_key))
+        tasks = {primary}
+        try:
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+
+            if not primary.done() and delay is not None:
+                stats = policy.get_stats(self.provider_name(), model)
+                stats.hedged += 1
+                chat_completion_hedges.labels(self.provider_name(), model).inc()
+                stats.extra_tokens += await self._estimate_prompt_tokens(messages, model)
+
+                if policy.alternate is not None:
+                    hedge_api, hedge_model = policy.alternate
+                    hedge_started_at = monotonic()
+                    hedge = asyncio.ensure_future(hedge_api.run_chat_completion(hedge_model, messages, params,
+                                                                                trial_count))
+                else:
+                    hedge_api, hedge_model, hedge_started_at = self, model, monotonic()
+                    hedge = asyncio.ensure_future(
+                        self.__run_chat_completion_with_retries(model, messages, params, trial_count, cache_key))
+                tasks.add(hedge)
+
+                # The first successful answer wins. An error is raised only if both fail.
+                while True:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    succeeded = [task for task in done if task.exception() is None]
+                    if len(succeeded) > 0:
+                        winner = hedge if hedge in succeeded else primary
+                        break
+                    elif len(done) == len(tasks):
+                        return primary.result()
+                    tasks = tasks - done
+
+                if winner is hedge:
+                    stats.hedge_wins += 1
+                    chat_completion_hedge_wins.labels(self.provider_name(), model).inc()
+                    policy.latency_tracker.record(hedge_api.provider_name(), hedge_model,
+                                                  monotonic() - hedge_started_at)
+                    return hedge.result()
+
+            result = await primary
+            policy.latency_tracker.record(self.provider_name(), model, monotonic() - started_at)
+            return result
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def __run_chat_completion_with_retries(self, model: str, messages: list[ChatCompletionMessage],
+                                                 params: dict, trial_count: int,
+                                                 cache_key: str | None) -> ChatCompletionResult:
+        breaker = self._get_circuit_breaker(model)
         trial = 0
-        result = None
-        while trial <= trial_count and result is None:
-            try:
-                if self.config().verbose:
-                    print(f"Run chat completion on {model} with messages:", messages)
-
-                result = await self._run_chat_completion_impl(model, messages, params)
-            except ChatCompletionRetryRequestedException as e:
-                result = None
+        queue_time = 0
+        while True:
+            check_deadline()
+            if breaker is not None:
+                breaker.before_call()
+
+            async with self.__admit(model, messages, params) as admission:
+                queue_time += admission.queue_time
+                try:
+                    if self.config().verbose:
+                        print(f"Run chat completion on {model} with messages:", messages)
+
+                    with trace_span("provider_call", provider=self.provider_name(), model=model,
+                                    attempt=trial) as call_span:
+                        try:
+                            result = await self._run_chat_completion_impl(model, messages, params)
+                        finally:
+                            chat_completion_provider_latency.labels(self.provider_name(), model).observe(
+                                call_span.duration)
+                    self.__reconcile_rate_limit(admission, result)
+                except Exception as e:
+                    self.__reconcile_rate_limit(admission, None)
+                    retry_request = self.__on_attempt_failed(model, e, breaker, trial, trial_count)
+                    result = None
+
+            if result is None:
+                # Back off outside the admission so the slot is free while waiting.
+                await self.__wait_before_retry(model, trial, retry_request)
                 trial += 1
+                continue
+
+            if breaker is not None:
+                breaker.record_success()
+            self.__record_result(model, result)
+            self._on_chat_completion_result(model, messages, result)
+            if cache_key is not None:
+                await self.__response_cache.set(cache_key, result)
+            return result.model_copy(update=dict(queue_time=int(queue_time * 1000)))
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        # Fallback for providers without a streaming endpoint: the whole message arrives as a single delta.
+        result = await self._run_chat_completion_impl(model, messages, params)
+        if result.message.content is not None:
+            yield ChatCompletionChunk(content_delta=result.message.content)
+        yield ChatCompletionChunk(result=result)
+
+    async def run_chat_completion_stream(self, model: str, messages: list[ChatCompletionMessage],
+                                         params: dict,
+                                         trial_count: int = 5) -> AsyncIterator[ChatCompletionChunk]:
+        self.assert_authorize()
 
-                if self.config().verbose:
-                    print(f"Retry chat completion of {self.provider_name} - {e.caused_by}")
+        cache_key = self.__get_cache_key(model, messages, params)
+        if cache_key is not None:
+            cached_result = await self.__response_cache.get(cache_key)
+            chat_completion_cache_lookups.labels(self.provider_name(), "miss" if cached_result is None else "hit").inc()
+            if cached_result is not None:
+                if cached_result.message.content is not None:
+                    yield ChatCompletionChunk(content_delta=cached_result.message.content)
+                yield ChatCompletionChunk(result=self.__mark_cached(cached_result))
+                return
+
+        breaker = self._get_circuit_breaker(model)
+        trial = 0
+        queue_time = 0
+        final_result = None
+        while True:
+            check_deadline()
+            if breaker is not None:
+                breaker.before_call()
+
+            retry_request = None
+            async with self.__admit(model, messages, params) as admission:
+                queue_time += admission.queue_time
+                emitted = False
+                # Not made current: the span would otherwise leak to the consumer between yields.
+                call_span = start_span("provider_call", provider=self.provider_name(), model=model, attempt=trial,
+                                       stream=True)
+                try:
+                    if self.config().verbose:
+                        print(f"Run streaming chat completion on {model} with messages:", messages)
+
+                    async for chunk in self._run_chat_completion_stream_impl(model, messages, params):
+                        emitted = True
+                        if chunk.result is not None:
+                            final_result = chunk.result
+                            self.__reconcile_rate_limit(admission, chunk.result)
+                            chunk = ChatCompletionChunk(
+                                result=chunk.result.model_copy(update=dict(queue_time=int(queue_time * 1000))))
+                        yield chunk
+                except Exception as e:
+                    call_span.end(e)
+                    if not emitted:
+                        self.__reconcile_rate_limit(admission, None)
+                    # A retry is safe only while nothing has been delivered to the caller.
+                    retry_request = self.__on_attempt_failed(model, e, breaker, trial, trial_count,
+                                                              retryable=not emitted)
+                finally:
+                    call_span.end()
+                    chat_completion_provider_latency.labels(self.provider_name(), model).observe(call_span.duration)
+
+            if retry_request is not None:
+                await self.__wait_before_retry(model, trial, retry_request)
+                trial += 1
+                continue
 
-        return result
+            if breaker is not None:
+                breaker.record_success()
+            if final_result is not None:
+                self.__record_result(model, final_result)
+                self._on_chat_completion_result(model, messages, final_result)
+            if cache_key is not None and final_result is not None:
+                await self.__response_cache.set(cache_key, final_result)
+            return
 
     @abstractmethod
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
         pass
+
+    async def count_token_in_messages_async(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        """
+        count_token_in_messages that runs on the tokenizer worker pool for long prompts, off the event loop.
+        """
+        if tokenizer_service.should_offload(sum([len(message.content or "") for message in messages])):
+            return await tokenizer_service.run_in_pool(self.count_token_in_messages, messages, model)
+        else:
+            return self.count_token_in_messages(messages, model)
+
+    async def is_messages_within_token_limit_async(self, messages: list[ChatCompletionMessage], model: str,
+                                                   tolerance: int = 120) -> bool:
+        if tokenizer_service.should_offload(sum([len(message.content or "") for message in messages])):
+            return await tokenizer_service.run_in_pool(self.is_messages_within_token_limit, messages, model, tolerance)
+        else:
+            return self.is_messages_within_token_limit(messages, model, tolerance)
+
+    def get_token_limit(self, model: str) -> int | None:
+        """
+        :return: The context window of the model in tokens, or None if the provider does not support counting tokens
+        message by message. Callers then fall back to is_messages_within_token_limit.
+        """
+        return None
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        """
+        :return: Tokens that a single message adds to a prompt
+        """
+        return self.count_token_in_messages([message], model) - self.get_token_overhead(model)
+
+    def get_token_overhead(self, model: str) -> int:
+        """
+        :return: Tokens counted for a prompt regardless of its messages
+        """
+        return self.count_token_in_messages([], model)
@@ -0,0 +1,59 @@
+import importlib.util
+from typing import TypeVar, Generic, Callable, Awaitable
+
+import httpx
+from pydantic import BaseModel, ConfigDict
+
+ClientType = TypeVar('ClientType')
+
+
+class HttpClientPoolConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float | None = 30.0
+    http2: bool = True
+    timeout: float | None = 600.0
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def is_http2_available(self) -> bool:
+        # HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it.
+        return self.http2 and importlib.util.find_spec("h2") is not None
+
+    def create_async_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(limits=self.limits(), http2=self.is_http2_available(), timeout=self.timeout)
+
+    def create_client(self) -> httpx.Client:
+        return httpx.Client(limits=self.limits(), http2=self.is_http2_available(), timeout=self.timeout)
+
+
+class ManagedClientPool(Generic[ClientType]):
+    """
+    Keeps one long-lived SDK client per credential so that connections and TLS sessions survive across requests.
+    """
+
+    def __init__(self, factory: Callable[[str], ClientType], closer: Callable[[ClientType], Awaitable[None] | None]):
+        self.__factory = factory
+        self.__closer = closer
+        self.__clients: dict[str, ClientType] = dict()
+
+    def get(self, key: str) -> ClientType:
+        if key not in self.__clients:
+            self.__clients[key] = self.__factory(key)
+        return self.__clients[key]
+
+    def __len__(self) -> int:
+        return len(self.__clients)
+
+    async def aclose(self):
+        clients = list(self.__clients.values())
+        self.__clients.clear()
+        for client in clients:
+            closing = self.__closer(client)
+            if closing is not None:
+                await closing
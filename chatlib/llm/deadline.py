@@ -0,0 +1,152 @@
+import asyncio
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar, Context
+from dataclasses import dataclass
+from time import monotonic
+from typing import Iterator, AsyncIterator, AsyncGenerator, Coroutine, Any, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(TimeoutError):
+    def __init__(self, budget: float | None = None, caused_by: Exception | None = None):
+        super().__init__(f"Deadline of {budget:.2f} seconds exceeded." if budget is not None else "Deadline exceeded.")
+        self.budget = budget
+        self.caused_by = caused_by
+
+
+@dataclass(frozen=True)
+class Deadline:
+    expires_at: float
+    budget: float
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return monotonic() >= self.expires_at
+
+
+_deadline: ContextVar[Deadline | None] = ContextVar("chatlib_deadline", default=None)
+
+
+def get_deadline() -> Deadline | None:
+    return _deadline.get()
+
+
+def get_remaining_time() -> float | None:
+    """
+    :return: Seconds left until the active deadline, or None if there is none.
+    """
+    deadline = _deadline.get()
+    return deadline.remaining if deadline is not None else None
+
+
+def check_deadline():
+    deadline = _deadline.get()
+    if deadline is not None and deadline.expired:
+        raise DeadlineExceededError(deadline.budget)
+
+
+def set_deadline(timeout: float | None) -> Deadline | None:
+    """
+    Set a deadline in the current context without a block to scope it, e.g., in a context made for
+    iterate_with_deadline. A nested deadline cannot outlive the enclosing one.
+    :param timeout: Seconds from now. None keeps the enclosing deadline, if any.
+    :return: The deadline in effect
+    """
+    current = _deadline.get()
+    if timeout is None or (current is not None and current.expires_at <= monotonic() + timeout):
+        return current
+    deadline = Deadline(expires_at=monotonic() + timeout, budget=timeout)
+    _deadline.set(deadline)
+    return deadline
+
+
+@contextmanager
+def deadline_context(timeout: float | None) -> Iterator[Deadline | None]:
+    """
+    Set a deadline for the work done inside this block. A nested deadline cannot outlive the enclosing one.
+    :param timeout: Seconds from now. None keeps the enclosing deadline, if any.
+    """
+    current = _deadline.get()
+    if timeout is None or (current is not None and current.expires_at <= monotonic() + timeout):
+        yield current
+        return
+
+    token = _deadline.set(Deadline(expires_at=monotonic() + timeout, budget=timeout))
+    try:
+        yield _deadline.get()
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            pass
+
+
+@asynccontextmanager
+async def enforce_deadline(timeout: float | None) -> AsyncIterator[Deadline | None]:
+    """
+    Like deadline_context, but also cancels the block when the deadline passes, raising DeadlineExceededError.
+    """
+    with deadline_context(timeout) as deadline:
+        if deadline is None:
+            yield None
+            return
+
+        try:
+            async with asyncio.timeout_at(asyncio.get_running_loop().time() + deadline.remaining):
+                yield deadline
+        except TimeoutError as e:
+            if isinstance(e, DeadlineExceededError) or not deadline.expired:
+                raise
+            raise DeadlineExceededError(deadline.budget, e) from e
+
+
+async def run_with_deadline(coroutine: Coroutine[Any, Any, T], context: Context) -> T:
+    """
+    Run the coroutine as a task in the context, cancelling it with DeadlineExceededError once the deadline of the
+    context passes. The caller's task is not cancelled, unlike with enforce_deadline.
+    """
+    deadline = context.run(get_deadline)
+    task = asyncio.create_task(coroutine, context=context)
+    try:
+        return await asyncio.wait_for(task, deadline.remaining if deadline is not None else None)
+    except TimeoutError as e:
+        if deadline is None or isinstance(e, DeadlineExceededError) or not deadline.expired:
+            raise
+        raise DeadlineExceededError(deadline.budget, e) from e
+
+
+_END_OF_ITERATION = object()
+
+
+async def _next_or_end(iterator: AsyncIterator):
+    # A task cannot end with StopAsyncIteration cleanly, so the end travels as a value.
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _END_OF_ITERATION
+
+
+async def _close(generator: AsyncGenerator):
+    await generator.aclose()
+
+
+async def iterate_with_deadline(generator: AsyncGenerator[T, None], context: Context) -> AsyncIterator[T]:
+    """
+    Iterate the async generator in the context, step by step, bounding each step by the deadline of the context.
+    Unlike enforce_deadline across yields, nothing stays in effect while the consumer holds an item: its own awaits are
+    never cancelled by the deadline, and context variables set by or for the generator do not leak to it.
+    The time the consumer takes still counts toward the deadline.
+    """
+    try:
+        while True:
+            item = await run_with_deadline(_next_or_end(generator), context)
+            if item is _END_OF_ITERATION:
+                return
+            yield item
+    finally:
+        await asyncio.create_task(_close(generator), context=context)
@@ -0,0 +1,89 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from chatlib.llm.chat_completion_api import ChatCompletionAPI
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the most recent successful calls per provider and model.
+    """
+
+    def __init__(self, window_size: int = 200):
+        self.window_size = window_size
+        self.__latencies: dict[tuple[str, str], deque[float]] = dict()
+
+    def record(self, provider: str, model: str, latency: float):
+        key = (provider, model)
+        if key not in self.__latencies:
+            self.__latencies[key] = deque(maxlen=self.window_size)
+        self.__latencies[key].append(latency)
+
+    def get_sample_count(self, provider: str, model: str) -> int:
+        return len(self.__latencies.get((provider, model), ()))
+
+    def get_percentile(self, provider: str, model: str, quantile: float) -> float | None:
+        latencies = self.__latencies.get((provider, model))
+        if latencies is None or len(latencies) == 0:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+@dataclass
+class HedgingStats:
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+
+    # Tokens billed for duplicates, estimated by the prompt tokens of each hedged request.
+    extra_tokens: int = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests > 0 else 0
+
+    @property
+    def win_rate(self) -> float:
+        return self.hedge_wins / self.hedged if self.hedged > 0 else 0
+
+
+class HedgingPolicy:
+    """
+    Sends a duplicate of a request that has not answered within the observed latency quantile of its model, and takes
+    whichever answers first.
+    :param quantile: The latency quantile after which a request is hedged
+    :param min_samples: Samples required before the quantile is trusted. Until then, default_delay is used.
+    :param default_delay: Seconds before hedging while too few samples are observed. None disables hedging meanwhile.
+    :param min_delay: A lower bound of the hedging delay, so that fast models are not hedged on jitter
+    :param alternate: An API and model to send the duplicate to. None sends it to the same API and model.
+    """
+
+    def __init__(self, quantile: float = 0.95, min_samples: int = 20, default_delay: float | None = None,
+                 min_delay: float = 0.5, alternate: tuple['ChatCompletionAPI', str] | None = None,
+                 latency_tracker: LatencyTracker | None = None):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.alternate = alternate
+        self.latency_tracker = latency_tracker or LatencyTracker()
+        self.__stats: dict[tuple[str, str], HedgingStats] = dict()
+
+    def get_delay(self, provider: str, model: str) -> float | None:
+        """
+        :return: Seconds to wait before hedging, or None not to hedge
+        """
+        if self.latency_tracker.get_sample_count(provider, model) < self.min_samples:
+            delay = self.default_delay
+        else:
+            delay = self.latency_tracker.get_percentile(provider, model, self.quantile)
+        return max(delay, self.min_delay) if delay is not None else None
+
+    def get_stats(self, provider: str, model: str) -> HedgingStats:
+        return self.__stats.setdefault((provider, model), HedgingStats())
+
+    def get_all_stats(self) -> dict[tuple[str, str], HedgingStats]:
+        return dict(self.__stats)
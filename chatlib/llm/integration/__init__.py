@@ -1,6 +1,48 @@
-from .anthropic_api import AnthropicChatCompletionAPI, AnthropicModel
-from .azure_llama2_api import AzureLlama2ChatCompletionAPI
-from .cohere_api import CohereModel, CohereChatAPI
-from .gemini_api import GeminiAPI
-from .openai_api import ChatGPTModel, GPTChatCompletionAPI
-from .together_api import TogetherAPI, TogetherAIModel
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+from .registry import provider_registry, ProviderRegistry, ProviderNotFoundError, ENTRY_POINT_GROUP
+
+if TYPE_CHECKING:
+    from .anthropic_api import AnthropicChatCompletionAPI, AnthropicModel
+    from .azure_llama2_api import AzureLlama2ChatCompletionAPI
+    from .cohere_api import CohereModel, CohereChatAPI
+    from .gemini_api import GeminiAPI
+    from .mock_api import MockChatCompletionAPI, ConstantLatency, UniformLatency, LogNormalLatency
+    from .openai_api import ChatGPTModel, GPTChatCompletionAPI, GPTBatchAPI
+    from .together_api import TogetherAPI, TogetherAIModel
+
+# Each provider module pulls in its SDK, so it is imported only when one of its names is first accessed.
+_LAZY_ATTRIBUTES = {
+    "AnthropicChatCompletionAPI": ".anthropic_api",
+    "AnthropicModel": ".anthropic_api",
+    "AzureLlama2ChatCompletionAPI": ".azure_llama2_api",
+    "CohereModel": ".cohere_api",
+    "CohereChatAPI": ".cohere_api",
+    "GeminiAPI": ".gemini_api",
+    "MockChatCompletionAPI": ".mock_api",
+    "ConstantLatency": ".mock_api",
+    "UniformLatency": ".mock_api",
+    "LogNormalLatency": ".mock_api",
+    "ChatGPTModel": ".openai_api",
+    "GPTChatCompletionAPI": ".openai_api",
+    "GPTBatchAPI": ".openai_api",
+    "TogetherAPI": ".together_api",
+    "TogetherAIModel": ".together_api",
+}
+
+__all__ = ["provider_registry", "ProviderRegistry", "ProviderNotFoundError", "ENTRY_POINT_GROUP",
+           *_LAZY_ATTRIBUTES.keys()]
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRIBUTES.keys()))
@@ -1,11 +1,15 @@
 from enum import StrEnum
 from functools import cache
-from typing import Any, Literal
+from typing import Any, Literal, AsyncIterator
 
-from anthropic import Client, Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import Client, Anthropic, AsyncAnthropic, HUMAN_PROMPT, AI_PROMPT, RateLimitError, InternalServerError, \
+    APIConnectionError, BadRequestError
 
+from chatlib.llm.client_pool import HttpClientPoolConfig, ManagedClientPool
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
-    ChatCompletionMessageRole, ChatCompletionFinishReason
+    ChatCompletionMessageRole, ChatCompletionFinishReason, ChatCompletionChunk, ChatCompletionRetryRequestedException, \
+    is_context_length_error_message
+from chatlib.llm.retry import get_retry_after_from_error
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec, \
     APIAuthorizationVariableSpecPresets
 
@@ -67,15 +71,50 @@ class AnthropicChatCompletionAPI(ChatCompletionAPI):
     def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
         return True
 
+    def __init__(self, http_client_config: HttpClientPoolConfig | None = None, base_url: str | None = None):
+        super().__init__()
+        self.__http_client_config = http_client_config or HttpClientPoolConfig()
+        # The synchronous client is only used for local token counting and never performs a request.
+        self.__clients: ManagedClientPool[Client] = ManagedClientPool(
+            lambda api_key: Anthropic(api_key=api_key, base_url=base_url),
+            lambda client: client.close()
+        )
+        self.__async_clients: ManagedClientPool[AsyncAnthropic] = ManagedClientPool(
+            # Retries are handled by ChatCompletionAPI's retry policy.
+            lambda api_key: AsyncAnthropic(api_key=api_key, base_url=base_url, max_retries=0,
+                                           http_client=self.__http_client_config.create_async_client()),
+            lambda client: client.close()
+        )
+
     @property
     def __client(self) -> Client:
-        return Anthropic(api_key=self.get_auth_variable_for_spec(self.__api_key_spec))
+        return self.__clients.get(self.get_auth_variable_for_spec(self.__api_key_spec))
 
+    @property
+    def __async_client(self) -> AsyncAnthropic:
+        return self.__async_clients.get(self.get_auth_variable_for_spec(self.__api_key_spec))
+
+    async def aclose(self):
+        await self.__clients.aclose()
+        await self.__async_clients.aclose()
+
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        # InternalServerError also covers 529 (overloaded).
+        if isinstance(error, (RateLimitError, InternalServerError, APIConnectionError)):
+            return ChatCompletionRetryRequestedException(error, get_retry_after_from_error(error))
+        else:
+            return super()._classify_retryable_error(error)
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        return isinstance(error, BadRequestError) and is_context_length_error_message(error.message)
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
         return self.count_token_in_messages(messages, model) <= 200000 - tolerance
 
+    def get_token_limit(self, model: str) -> int | None:
+        return 200000
+
     async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
                                         params: dict) -> ChatCompletionResult:
         if len(messages) > 0 and messages[0].role is ChatCompletionMessageRole.SYSTEM:
@@ -85,12 +124,13 @@ class AnthropicChatCompletionAPI(ChatCompletionAPI):
         else:
             system_prompt = None
 
-        completion_result = self.__client.beta.messages.create(model=model,
-                                                               system=system_prompt if system_prompt is not None else None,
-                                                               messages=[msg.dict() for msg in messages],
-                                                               max_tokens=1024,
-                                                               **params,
-                                                               )
+        completion_result = await self.__async_client.beta.messages.create(model=model,
+                                                                           **(dict(system=system_prompt) if system_prompt is not None else dict()),
+                                                                           messages=[msg.dict() for msg in messages],
+                                                                           max_tokens=1024,
+                                                                           **params,
+                                                                           **self._get_request_timeout_kwargs()
+                                                                           )
 
         return ChatCompletionResult(
             message=ChatCompletionMessage(content=completion_result.content[0].text, role=ChatCompletionMessageRole.ASSISTANT),
@@ -102,6 +142,37 @@ class AnthropicChatCompletionAPI(ChatCompletionAPI):
             total_tokens=completion_result.usage.input_tokens + completion_result.usage.output_tokens
         )
 
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        if len(messages) > 0 and messages[0].role is ChatCompletionMessageRole.SYSTEM:
+            system_prompt = messages[0].content
+            messages = messages[1:]
+        else:
+            system_prompt = None
+
+        async with self.__async_client.beta.messages.stream(model=model,
+                                                             **(dict(system=system_prompt) if system_prompt is not None else dict()),
+                                                             messages=[msg.dict() for msg in messages],
+                                                             max_tokens=1024,
+                                                             **params,
+                                                             **self._get_request_timeout_kwargs()
+                                                             ) as stream:
+            async for text in stream.text_stream:
+                yield ChatCompletionChunk(content_delta=text)
+
+            completion_result = await stream.get_final_message()
+
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content="".join([block.text for block in completion_result.content]),
+                                          role=ChatCompletionMessageRole.ASSISTANT),
+            finish_reason=convert_anthropic_stop_reason(completion_result.stop_reason) if completion_result.stop_reason is not None else ChatCompletionFinishReason.Stop,
+            model=model,
+            provider=self.provider_name(),
+            prompt_tokens=completion_result.usage.input_tokens,
+            completion_tokens=completion_result.usage.output_tokens,
+            total_tokens=completion_result.usage.input_tokens + completion_result.usage.output_tokens
+        ))
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
         self.assert_authorize()
         return self.__client.count_tokens(create_anthropic_prompt(messages))
@@ -1,18 +1,15 @@
 # https://learn.microsoft.com/en-us/azure/ai-studio/how-to/deploy-models-llama?tabs=azure-studio
-import json
-from asyncio import to_thread
 from enum import StrEnum
 from functools import cache
-from http import HTTPStatus
-from http.client import HTTPResponse
 from typing import Any
-from urllib import request, error, parse
-
-from transformers import AutoTokenizer
-
-from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, TokenLimitExceedError, \
-    ChatCompletionRetryRequestedException, \
-    ChatCompletionResult
+from urllib import parse
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionResult
+from chatlib.llm.integration.openai_compatible import OpenAICompatibleChatCompletionAPI, RETRYABLE_STATUS_CODES, \
+    OpenAICompatibleTransport
+from chatlib.llm.token_estimation import ModelTokenEstimators
+from chatlib.llm.token_count_cache import token_count_cache
+from chatlib.llm.tokenizer import tokenizer_service, Tokenizer
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec, \
     APIAuthorizationVariableSpecPresets
 
@@ -63,11 +60,14 @@ class AzureLlama2Environment:
         return {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + cls._key)}
 
 
+LLAMA2_TOKENIZER_NAME = "meta-llama/Llama-2-70b-chat-hf"
+
+
 class Llama2Model(StrEnum):
     Llama2_70b_chat = "Llama2_70b_chat"
 
 
-class AzureLlama2ChatCompletionAPI(ChatCompletionAPI):
+class AzureLlama2ChatCompletionAPI(OpenAICompatibleChatCompletionAPI):
     __host_spec = APIAuthorizationVariableSpecPresets.Host
     __key_spec = APIAuthorizationVariableSpecPresets.Key
 
@@ -86,54 +86,79 @@ class AzureLlama2ChatCompletionAPI(ChatCompletionAPI):
         AzureLlama2Environment.set_key(variables[cls.__key_spec])
         return True
 
-    @cache
-    def get_tokenizer(self):
-        tokenizer = AutoTokenizer.from_pretrained("meta-llama/Llama-2-70b-chat-hf")
-        return tokenizer
+    def __init__(self, transport: OpenAICompatibleTransport | None = None,
+                 token_estimators: ModelTokenEstimators | None = None):
+        """
+        :param token_estimators: Estimate token counts when the Llama2 tokenizer cannot be loaded, e.g., offline or
+        without access to the gated repository. They are fitted with the usage of completed requests.
+        """
+        super().__init__(transport)
+        self.__token_estimators = token_estimators or ModelTokenEstimators()
+        self.__tokenizer_unavailable = False
+
+    @property
+    def token_estimators(self) -> ModelTokenEstimators:
+        return self.__token_estimators
+
+    def get_tokenizer(self) -> Tokenizer:
+        return tokenizer_service.get_huggingface(LLAMA2_TOKENIZER_NAME)
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        return self.count_token_in_messages(messages, model) < 4096 + tolerance
+        return self.count_token_in_messages(messages, model) < 4096 - tolerance
+
+    def get_token_limit(self, model: str) -> int | None:
+        return 4096
 
-    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> Any:
-        req = request.Request(AzureLlama2Environment.get_chat_completions_endpoint(), str.encode(json.dumps({
+    def _get_endpoint(self) -> str:
+        return AzureLlama2Environment.get_chat_completions_endpoint()
+
+    def _get_request_headers(self) -> dict:
+        return AzureLlama2Environment.get_request_headers()
+
+    def _make_request_body(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> dict:
+        # The deployment is bound to a single model, so the model name is not sent.
+        return {
             "messages": [msg.dict() for msg in messages],
             **params
-        })), AzureLlama2Environment.get_request_headers(), method="POST")
-
-        try:
-            response: HTTPResponse = await to_thread(request.urlopen, url=req)
-            if response.status == HTTPStatus.OK:
-                json_response = json.loads(response.read())
-                return ChatCompletionResult(
-                    message=ChatCompletionMessage(**json_response["choices"][0]["message"]),
-                    finish_reason=json_response["choices"][0]["finish_reason"],
-                    provider=self.provider_name(),
-                    model=model,
-                    **json_response["usage"]
-                )
-            else:
-                raise ChatCompletionRetryRequestedException()
-        except (error.HTTPError, TokenLimitExceedError) as e:
-            raise ChatCompletionRetryRequestedException(e) from e
+        }
+
+    def _get_retryable_status_codes(self) -> set[int]:
+        # Azure deployments answer transient overloads with a variety of 4xx codes.
+        return RETRYABLE_STATUS_CODES | set(range(400, 500))
+
+    def _on_chat_completion_result(self, model: str, messages: list[ChatCompletionMessage],
+                                   result: ChatCompletionResult):
+        self.__token_estimators.observe_result(messages, model, result)
 
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        if not self.__tokenizer_unavailable:
+            try:
+                tokenizer = self.get_tokenizer()
+            except Exception as e:
+                print(f"Warning: failed to load the {LLAMA2_TOKENIZER_NAME} tokenizer. Estimating token counts - {e}")
+                self.__tokenizer_unavailable = True
+
+        if self.__tokenizer_unavailable:
+            return self.__token_estimators.count_upper_bound(messages, model)
+
         tokens_per_message = 3
         tokens_per_name = 1
 
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
+        def count_message(message: ChatCompletionMessage) -> int:
+            num_message_tokens = tokens_per_message
             for key, value in message.dict().items():
                 try:
-                    num_tokens += len(self.get_tokenizer().encode(value))
+                    num_message_tokens += len(tokenizer.encode(value))
                 except Exception as e:
-                    print(e)
-                    print(f"Error on token counting - {key}: {value}")
+                    if self.config().verbose:
+                        print(f"Error on token counting - {key}: {value} - {e}")
 
                 if key == "name":
-                    num_tokens += tokens_per_name
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+                    num_message_tokens += tokens_per_name
+            return num_message_tokens
 
-        print("Estimated token count: ", num_tokens)
+        num_tokens = sum([token_count_cache.get_or_count(LLAMA2_TOKENIZER_NAME, message, count_message)
+                          for message in messages])
+        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
         return num_tokens
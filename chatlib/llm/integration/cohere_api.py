@@ -1,11 +1,17 @@
 from enum import StrEnum
 from functools import cache
-from typing import Any
+from typing import Any, AsyncIterator
 
 from cohere import AsyncClient
+from cohere.error import CohereAPIError, CohereConnectionError
+from cohere.responses.chat import StreamEvent
 
+from chatlib.llm.client_pool import HttpClientPoolConfig, ManagedClientPool
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
-    ChatCompletionMessageRole, ChatCompletionFinishReason
+    ChatCompletionMessageRole, ChatCompletionFinishReason, ChatCompletionChunk, ChatCompletionRetryRequestedException, \
+    is_context_length_error_message
+from chatlib.llm.retry import get_retry_after_from_error
+from chatlib.llm.token_estimation import ModelTokenEstimators
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec, \
     APIAuthorizationVariableSpecPresets
 
@@ -36,6 +42,11 @@ def _convert_to_cohere_message(message: ChatCompletionMessage) -> dict:
     }
 
 
+COHERE_TOKEN_LIMITS = {
+    CohereModel.Command: 4096,
+    CohereModel.CommandNightly: 4096
+}
+
 # https://docs.cohere.com/reference/chat
 
 class CohereChatAPI(ChatCompletionAPI):
@@ -53,16 +64,61 @@ class CohereChatAPI(ChatCompletionAPI):
     def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
         return True
 
+    def __init__(self, http_client_config: HttpClientPoolConfig | None = None,
+                 token_estimators: ModelTokenEstimators | None = None):
+        """
+        :param token_estimators: Estimate token counts locally, as Cohere does not publish its tokenizer for the chat
+        models. They are fitted with the usage of completed requests.
+        """
+        super().__init__()
+        self.__token_estimators = token_estimators or ModelTokenEstimators()
+        self.__http_client_config = http_client_config or HttpClientPoolConfig()
+        # The Cohere SDK manages its own aiohttp session, so only the concurrency limit and timeout carry over.
+        self.__clients: ManagedClientPool[AsyncClient] = ManagedClientPool(
+            lambda api_key: AsyncClient(api_key=api_key, num_workers=self.__http_client_config.max_connections,
+                                        timeout=self.__http_client_config.timeout or 300),
+            lambda client: client.close()
+        )
+
     @property
     def __client(self) -> AsyncClient:
-        return AsyncClient(api_key=self.get_auth_variable_for_spec(self.__api_key_spec))
+        return self.__clients.get(self.get_auth_variable_for_spec(self.__api_key_spec))
+
+    async def aclose(self):
+        await self.__clients.aclose()
+
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        if isinstance(error, CohereConnectionError) or (
+                isinstance(error, CohereAPIError) and error.http_status is not None and (
+                error.http_status == 429 or error.http_status >= 500)):
+            return ChatCompletionRetryRequestedException(error, get_retry_after_from_error(error))
+        else:
+            return super()._classify_retryable_error(error)
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        return isinstance(error, CohereAPIError) and error.http_status == 400 and is_context_length_error_message(
+            error.message)
+
+    @property
+    def token_estimators(self) -> ModelTokenEstimators:
+        return self.__token_estimators
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        return True
+        limit = self.get_token_limit(model)
+        return limit is None or self.count_token_in_messages(messages, model) < limit - tolerance
+
+    def get_token_limit(self, model: str) -> int | None:
+        return COHERE_TOKEN_LIMITS.get(model)
+
+    def _on_chat_completion_result(self, model: str, messages: list[ChatCompletionMessage],
+                                   result: ChatCompletionResult):
+        self.__token_estimators.observe_result(messages, model, result)
 
     async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
                                         params: dict) -> ChatCompletionResult:
+        # The Cohere SDK sets its timeout per client session, not per request, so _get_request_timeout_kwargs does not
+        # apply and the deadline stops the call only by cancelling it.
         response = await self.__client.chat(chat_history=[_convert_to_cohere_message(msg) for msg in messages[:-1]],
                                             message=messages[-1].content,
                                             model=model,
@@ -79,7 +135,34 @@ class CohereChatAPI(ChatCompletionAPI):
             total_tokens=response.token_count['total_tokens']
         )
 
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        # No request timeout either; see _run_chat_completion_impl.
+        response = await self.__client.chat(chat_history=[_convert_to_cohere_message(msg) for msg in messages[:-1]],
+                                            message=messages[-1].content,
+                                            model=model,
+                                            stream=True,
+                                            **params
+                                            )
+
+        content = ""
+        async for event in response:
+            if event.event_type == StreamEvent.TEXT_GENERATION:
+                content += event.text
+                yield ChatCompletionChunk(content_delta=event.text)
+
+        token_count = response.token_count or dict()
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content=content, role=ChatCompletionMessageRole.ASSISTANT),
+            finish_reason=ChatCompletionFinishReason.Length if response.finish_reason == "MAX_TOKENS" else ChatCompletionFinishReason.Stop,
+            provider=self.provider_name(),
+            model=model,
+            prompt_tokens=token_count.get('prompt_tokens'),
+            completion_tokens=token_count.get('response_tokens'),
+            total_tokens=token_count.get('total_tokens')
+        ))
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        pass
+        return self.__token_estimators.count_upper_bound(messages, model)
 
     __api_key_spec = APIAuthorizationVariableSpecPresets.ApiKey
@@ -1,12 +1,17 @@
 from enum import StrEnum
 from functools import cache
-from typing import Any
+from typing import Any, AsyncIterator
 
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests, ServiceUnavailable, InternalServerError, \
+    DeadlineExceeded, InvalidArgument
 from google.ai.generativelanguage_v1 import Candidate
 from google.generativeai.types import GenerateContentResponse
 
-from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionMessageRole
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionMessageRole, \
+    ChatCompletionChunk, ChatCompletionFinishReason, ChatCompletionRetryRequestedException, \
+    is_context_length_error_message
+from chatlib.llm.token_estimation import TokenEstimator
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec, \
     APIAuthorizationVariableSpecPresets
 from chatlib.llm.chat_completion_api import ChatCompletionResult
@@ -86,19 +91,49 @@ class GeminiAPI(ChatCompletionAPI):
 
     def __init__(self,
                  safety_settings: list[dict] | None = None,
-                 injected_initial_system_message: str = "Okay I will diligently follow that instruction."):
+                 injected_initial_system_message: str = "Okay I will diligently follow that instruction.",
+                 token_estimator: TokenEstimator | None = None,
+                 token_safety_margin: float = 0.1):
+        """
+        :param token_estimator: Estimates token counts locally. It is calibrated with every remote count.
+        :param token_safety_margin: Relative margin around the token limit within which the limit check asks the
+        remote count_tokens instead of trusting the local estimate
+        """
         super().__init__()
         self.__injected_initial_system_message = injected_initial_system_message
         self.__safety_settings = safety_settings or _SAFETY_SETTINGS_BLOCK_NONE
+        self.__token_estimator = token_estimator or TokenEstimator()
+        self.__token_safety_margin = token_safety_margin
+
+    @property
+    def token_estimator(self) -> TokenEstimator:
+        return self.__token_estimator
 
     @cache
     def model(self) -> genai.GenerativeModel:
         return genai.GenerativeModel('gemini-pro')
 
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        if isinstance(error, (ResourceExhausted, TooManyRequests, ServiceUnavailable, InternalServerError,
+                              DeadlineExceeded)):
+            return ChatCompletionRetryRequestedException(error)
+        else:
+            return super()._classify_retryable_error(error)
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        return isinstance(error, InvalidArgument) and is_context_length_error_message(error.message)
+
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        self.assert_authorize()
-        return self.count_token_in_messages(messages, model) < GEMINI_PRO_TOKEN_LIMIT - tolerance
+        threshold = GEMINI_PRO_TOKEN_LIMIT - tolerance
+        estimate = self.__token_estimator.estimate(self.__convert_messages(list(messages)))
+        if estimate.upper_bound * (1 + self.__token_safety_margin) < threshold:
+            return True
+        elif estimate.lower_bound * (1 - self.__token_safety_margin) >= threshold:
+            return False
+        else:
+            # Too close to the limit to trust the estimate.
+            return self.count_token_in_messages_remote(messages) < threshold
 
     def __convert_messages(self, messages: list[ChatCompletionMessage]) -> list[ChatCompletionMessage]:
         # Tweak system instruction
@@ -124,6 +159,8 @@ class GeminiAPI(ChatCompletionAPI):
         injected_messages = self.__convert_messages(messages)
 
         converted_messages = convert_to_gemini_messages(injected_messages)
+        # google-generativeai 0.3 takes no per-request timeout, so _get_request_timeout_kwargs does not apply and the
+        # deadline stops the call only by cancelling it.
         response: GenerateContentResponse = await self.model().generate_content_async(
             contents=converted_messages,
             generation_config=params,
@@ -141,10 +178,45 @@ class GeminiAPI(ChatCompletionAPI):
                 model=model
             )
 
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        injected_messages = self.__convert_messages(messages)
+
+        converted_messages = convert_to_gemini_messages(injected_messages)
+        # No request timeout either; see _run_chat_completion_impl.
+        response = await self.model().generate_content_async(
+            contents=converted_messages,
+            generation_config=params,
+            safety_settings=self.__safety_settings,
+            stream=True
+        )
+
+        content = ""
+        async for chunk in response:
+            if len(chunk.candidates) > 0 and len(chunk.candidates[0].content.parts) > 0:
+                delta = chunk.candidates[0].content.parts[0].text
+                content += delta
+                yield ChatCompletionChunk(content_delta=delta)
+
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content=content, role=ChatCompletionMessageRole.ASSISTANT),
+            finish_reason=ChatCompletionFinishReason.Stop,
+            provider=self.provider_name(),
+            model=model
+        ))
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        """
+        A local estimate. Use count_token_in_messages_remote for the exact count.
+        """
+        return self.__token_estimator.estimate(self.__convert_messages(list(messages))).tokens
+
+    def count_token_in_messages_remote(self, messages: list[ChatCompletionMessage]) -> int:
         self.assert_authorize()
-        injected_messages = self.__convert_messages(messages)
+        injected_messages = self.__convert_messages(list(messages))
 
         converted_messages = convert_to_gemini_messages(injected_messages)
 
-        return self.model().count_tokens(converted_messages).total_tokens
+        num_tokens = self.model().count_tokens(converted_messages).total_tokens
+        self.__token_estimator.observe(injected_messages, num_tokens)
+        return num_tokens
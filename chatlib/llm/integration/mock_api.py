@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, AsyncIterator, Callable, Protocol
+
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
+    ChatCompletionMessageRole, ChatCompletionFinishReason, ChatCompletionChunk, ChatCompletionRetryRequestedException, \
+    ChatCompletionToolCall, ChatCompletionFunction, ChatCompletionToolCallDelta
+from chatlib.utils.integration import APIAuthorizationVariableSpec
+
+
+class LatencyDistribution(Protocol):
+    def sample(self, rng: random.Random) -> float:
+        """
+        :return: Seconds
+        """
+        ...
+
+
+@dataclass(frozen=True)
+class ConstantLatency:
+    seconds: float = 0
+
+    def sample(self, rng: random.Random) -> float:
+        return self.seconds
+
+
+@dataclass(frozen=True)
+class UniformLatency:
+    low: float
+    high: float
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.uniform(self.low, self.high)
+
+
+@dataclass(frozen=True)
+class LogNormalLatency:
+    """
+    Long-tailed like real provider latencies. Half of the samples fall below the median.
+    """
+    median: float
+    sigma: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.lognormvariate(math.log(self.median), self.sigma)
+
+
+class MockServerError(Exception):
+    pass
+
+
+class MockRateLimitError(Exception):
+    def __init__(self, retry_after: float | None):
+        super().__init__(f"Rate limit exceeded. Retry after {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class MockContextLengthError(Exception):
+    pass
+
+
+@dataclass
+class MockChatCompletionStats:
+    calls: int = 0
+    server_errors: int = 0
+    rate_limited: int = 0
+    tool_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+_SYNTHETIC_WORDS = ["the", "a", "you", "that", "is", "to", "and", "it", "of", "feel", "think", "day", "today", "really",
+                    "how", "about", "what", "good", "more", "tell", "me", "sounds", "great", "I", "see", "why", "so"]
+
+MockResponse = str | ChatCompletionMessage
+
+
+class MockChatCompletionAPI(ChatCompletionAPI):
+    """
+    An in-process provider with scripted or synthetic responses, for load tests and capacity planning without network
+    calls or token costs. Latency, usage, errors, rate limits and tool calls are drawn from a random generator seeded
+    per request, so the same seed and messages reproduce the same outcome regardless of the concurrency. Scripted
+    responses are the exception: a list is served in the order requests arrive, which varies under concurrency.
+    Tokens are counted as whitespace-separated words.
+
+    :param responses: Scripted responses, cycled through in the order of the calls, or a function that makes one from
+    the messages. Use a function for responses that do not depend on the concurrency.
+    If None, synthetic responses of completion_tokens words are generated.
+    :param latency: Time until the whole response is ready. Streaming spreads it over the tokens, after time_to_first_token.
+    :param error_rate: Probability of a retryable server error
+    :param rate_limit_rate: Probability of a 429, raised with rate_limit_retry_after
+    :param tool_call_rate: Probability of calling one of the tools in the request params instead of answering
+    :param token_limit: Prompts longer than this are rejected as a context length error
+    :param max_tracked_prompts: Distinct prompts whose attempts are counted, least recently used first out. A prompt
+    dropped from the count draws its first outcome again when repeated.
+    """
+
+    @classmethod
+    @cache
+    def provider_name(cls) -> str:
+        return "Mock"
+
+    @classmethod
+    def get_auth_variable_specs(cls) -> list[APIAuthorizationVariableSpec]:
+        return []
+
+    @classmethod
+    def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
+        return True
+
+    def __init__(self,
+                 responses: list[MockResponse] | Callable[[list[ChatCompletionMessage]], MockResponse] | None = None,
+                 latency: LatencyDistribution | None = None,
+                 time_to_first_token: LatencyDistribution | None = None,
+                 completion_tokens: tuple[int, int] = (20, 80),
+                 error_rate: float = 0,
+                 rate_limit_rate: float = 0,
+                 rate_limit_retry_after: float | None = 1,
+                 tool_call_rate: float = 0,
+                 token_limit: int | None = None,
+                 tokens_per_message: int = 4,
+                 max_tracked_prompts: int = 10000,
+                 seed: int = 0):
+        super().__init__()
+        self.__responses = responses
+        self.__latency = latency or ConstantLatency()
+        self.__time_to_first_token = time_to_first_token
+        self.__completion_tokens = completion_tokens
+        self.__error_rate = error_rate
+        self.__rate_limit_rate = rate_limit_rate
+        self.__rate_limit_retry_after = rate_limit_retry_after
+        self.__tool_call_rate = tool_call_rate
+        self.__token_limit = token_limit
+        self.__tokens_per_message = tokens_per_message
+        self.__max_tracked_prompts = max_tracked_prompts
+        self.__seed = seed
+
+        self.__script_index = 0
+        # Repeated requests with the same messages (retries, regenerations) draw a different outcome each time.
+        self.__attempts: OrderedDict[str, int] = OrderedDict()
+
+        self.stats = MockChatCompletionStats()
+
+    def __make_rng(self, model: str, messages: list[ChatCompletionMessage]) -> random.Random:
+        digest = hashlib.sha256("\n".join([model] + [f"{m.role}:{m.content}" for m in messages]).encode("utf-8")).hexdigest()
+        attempt = self.__attempts.get(digest, 0)
+        self.__attempts[digest] = attempt + 1
+        self.__attempts.move_to_end(digest)
+        while len(self.__attempts) > self.__max_tracked_prompts:
+            self.__attempts.popitem(last=False)
+        return random.Random(f"{self.__seed}:{digest}:{attempt}")
+
+    @staticmethod
+    def __count_words(text: str | None) -> int:
+        return len(text.split()) if text is not None else 0
+
+    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        return sum([self.__tokens_per_message + self.__count_words(message.content) for message in messages]) + 3
+
+    def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
+                                       tolerance: int = 120) -> bool:
+        return self.__token_limit is None or self.count_token_in_messages(messages, model) < self.__token_limit - tolerance
+
+    def get_token_limit(self, model: str) -> int | None:
+        return self.__token_limit
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        return isinstance(error, MockContextLengthError)
+
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        if isinstance(error, MockRateLimitError):
+            return ChatCompletionRetryRequestedException(error, error.retry_after)
+        elif isinstance(error, MockServerError):
+            return ChatCompletionRetryRequestedException(error)
+        else:
+            return super()._classify_retryable_error(error)
+
+    def __next_scripted_response(self, messages: list[ChatCompletionMessage]) -> MockResponse:
+        if callable(self.__responses):
+            return self.__responses(messages)
+        response = self.__responses[self.__script_index % len(self.__responses)]
+        self.__script_index += 1
+        return response
+
+    def __make_tool_call(self, rng: random.Random, tools: list[dict]) -> ChatCompletionToolCall:
+        tool = rng.choice(tools)
+        function = tool.get("function", tool)
+        arguments = dict()
+        for name, prop in ((function.get("parameters") or dict()).get("properties") or dict()).items():
+            if prop.get("enum"):
+                arguments[name] = rng.choice(prop["enum"])
+            elif prop.get("type") in ("integer", "number"):
+                arguments[name] = rng.randint(0, 100)
+            elif prop.get("type") == "boolean":
+                arguments[name] = rng.random() < 0.5
+            else:
+                arguments[name] = rng.choice(_SYNTHETIC_WORDS)
+        return ChatCompletionToolCall(index=0, id=f"call_mock_{rng.getrandbits(32):08x}",
+                                      function=ChatCompletionFunction(name=function["name"],
+                                                                      arguments=json.dumps(arguments)))
+
+    def __draw(self, model: str, messages: list[ChatCompletionMessage],
+               params: dict) -> tuple[random.Random, ChatCompletionResult]:
+        """
+        Decide the outcome of a request. Raises the injected errors.
+        """
+        rng = self.__make_rng(model, messages)
+        self.stats.calls += 1
+
+        prompt_tokens = self.count_token_in_messages(messages, model)
+        if self.__token_limit is not None and prompt_tokens > self.__token_limit:
+            raise MockContextLengthError(
+                f"This model's maximum context length is {self.__token_limit} tokens. "
+                f"However, your messages resulted in {prompt_tokens} tokens.")
+
+        outcome = rng.random()
+        if outcome < self.__rate_limit_rate:
+            self.stats.rate_limited += 1
+            raise MockRateLimitError(self.__rate_limit_retry_after)
+        elif outcome < self.__rate_limit_rate + self.__error_rate:
+            self.stats.server_errors += 1
+            raise MockServerError("The mock server had an error while processing your request.")
+
+        tools = params.get("tools")
+        answering_tool = len(messages) > 0 and messages[-1].role == ChatCompletionMessageRole.TOOL
+        if tools and not answering_tool and rng.random() < self.__tool_call_rate:
+            self.stats.tool_calls += 1
+            message = ChatCompletionMessage(content=None, role=ChatCompletionMessageRole.ASSISTANT,
+                                            tool_calls=[self.__make_tool_call(rng, tools)])
+            finish_reason = ChatCompletionFinishReason.Tool
+        else:
+            if self.__responses is not None:
+                response = self.__next_scripted_response(messages)
+                message = response if isinstance(response, ChatCompletionMessage) \
+                    else ChatCompletionMessage(content=response, role=ChatCompletionMessageRole.ASSISTANT)
+            else:
+                num_words = rng.randint(*self.__completion_tokens)
+                message = ChatCompletionMessage(content=" ".join([rng.choice(_SYNTHETIC_WORDS) for _ in range(num_words)]),
+                                                role=ChatCompletionMessageRole.ASSISTANT)
+            finish_reason = ChatCompletionFinishReason.Tool if message.tool_calls else ChatCompletionFinishReason.Stop
+
+        completion_tokens = self.__count_words(message.content) + (
+            sum([self.__count_words(call.function.arguments) + 3 for call in message.tool_calls])
+            if message.tool_calls else 0)
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.completion_tokens += completion_tokens
+
+        return rng, ChatCompletionResult(message=message, finish_reason=finish_reason,
+                                         provider=self.provider_name(), model=model,
+                                         prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                         total_tokens=prompt_tokens + completion_tokens)
+
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                        params: dict) -> ChatCompletionResult:
+        rng, result = self.__draw(model, messages, params)
+        await asyncio.sleep(self.__latency.sample(rng))
+        return result
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        rng, result = self.__draw(model, messages, params)
+        total_latency = self.__latency.sample(rng)
+        first_token_latency = self.__time_to_first_token.sample(rng) if self.__time_to_first_token is not None \
+            else total_latency
+        await asyncio.sleep(first_token_latency)
+
+        if result.message.tool_calls:
+            yield ChatCompletionChunk(tool_call_deltas=[
+                ChatCompletionToolCallDelta(index=call.index, id=call.id, function_name=call.function.name,
+                                            function_arguments=call.function.arguments, type=call.type)
+                for call in result.message.tool_calls])
+        elif result.message.content:
+            words = result.message.content.split(" ")
+            inter_token_latency = max(0.0, total_latency - first_token_latency) / len(words)
+            for i, word in enumerate(words):
+                if i > 0 and inter_token_latency > 0:
+                    await asyncio.sleep(inter_token_latency)
+                yield ChatCompletionChunk(content_delta=word if i == 0 else " " + word)
+
+        yield ChatCompletionChunk(result=result)
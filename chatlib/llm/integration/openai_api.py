@@ -1,12 +1,21 @@
+import json
 from enum import StrEnum
 from functools import cache
-from typing import Any
+from typing import Any, AsyncIterator
 
-import tiktoken
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, RateLimitError, InternalServerError, APIConnectionError, BadRequestError
 
+from chatlib.llm.batch import ChatCompletionBatchAPI, ChatCompletionBatchRequest, ChatCompletionBatchResult, \
+    BatchJobStatus, make_batch_jsonl
+from chatlib.llm.client_pool import HttpClientPoolConfig, ManagedClientPool
 from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionAPI, ChatCompletionResult, \
-    ChatCompletionFinishReason
+    ChatCompletionFinishReason, ChatCompletionChunk, ChatCompletionToolCallDelta, ChatCompletionMessageRole, \
+    merge_tool_call_deltas, ChatCompletionRetryRequestedException, is_context_length_error_message
+from chatlib.llm.integration.openai_compatible import convert_openai_compatible_response
+from chatlib.llm.retry import get_retry_after_from_error
+from chatlib.llm.token_count_cache import token_count_cache
+from chatlib.llm.tokenizer import tokenizer_service, Tokenizer
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec, \
     APIAuthorizationVariableSpecPresets
 
@@ -59,20 +68,47 @@ class GPTChatCompletionAPI(ChatCompletionAPI):
     def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
         return True
 
+    def __init__(self, http_client_config: HttpClientPoolConfig | None = None, base_url: str | None = None):
+        super().__init__()
+        self.__http_client_config = http_client_config or HttpClientPoolConfig()
+        self.__clients: ManagedClientPool[AsyncOpenAI] = ManagedClientPool(
+            # Retries are handled by ChatCompletionAPI's retry policy.
+            lambda api_key: AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                                        http_client=self.__http_client_config.create_async_client()),
+            lambda client: client.close()
+        )
+
     @property
     def __client(self) -> AsyncOpenAI:
-        return AsyncOpenAI(api_key=self.get_auth_variable_for_spec(self.__api_key_spec))
+        return self.__clients.get(self.get_auth_variable_for_spec(self.__api_key_spec))
+
+    async def aclose(self):
+        await self.__clients.aclose()
+
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        if isinstance(error, (RateLimitError, InternalServerError, APIConnectionError)):
+            return ChatCompletionRetryRequestedException(error, get_retry_after_from_error(error))
+        else:
+            return super()._classify_retryable_error(error)
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        return isinstance(error, BadRequestError) and (
+                error.code == "context_length_exceeded" or is_context_length_error_message(error.message))
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
         return self.count_token_in_messages(messages, model) < get_token_limit(model) - tolerance
 
+    def get_token_limit(self, model: str) -> int | None:
+        return get_token_limit(model)
+
     async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
                                         params: dict) -> ChatCompletionResult:
         result = await self.__client.chat.completions.create(
             model=model,
             messages=[message.dict() for message in messages],
-            **params
+            **params,
+            **self._get_request_timeout_kwargs()
         )
         converted_result = ChatCompletionResult(
             message=ChatCompletionMessage(**result.choices[0].message.dict()),
@@ -84,6 +120,64 @@ class GPTChatCompletionAPI(ChatCompletionAPI):
 
         return converted_result
 
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        stream = await self.__client.chat.completions.create(
+            model=model,
+            messages=[message.dict() for message in messages],
+            stream=True,
+            **params,
+            **self._get_request_timeout_kwargs()
+        )
+
+        content = ""
+        tool_call_deltas: list[ChatCompletionToolCallDelta] = []
+        finish_reason = None
+        result_model = model
+        async for chunk in stream:
+            result_model = chunk.model or result_model
+            if len(chunk.choices) == 0:
+                continue
+
+            choice = chunk.choices[0]
+            if choice.finish_reason is not None:
+                finish_reason = choice.finish_reason
+
+            deltas = [ChatCompletionToolCallDelta(index=call.index, id=call.id, type=call.type,
+                                                  function_name=call.function.name if call.function is not None else None,
+                                                  function_arguments=call.function.arguments if call.function is not None else None)
+                      for call in choice.delta.tool_calls] if choice.delta.tool_calls is not None else None
+            if deltas is not None:
+                tool_call_deltas.extend(deltas)
+
+            if choice.delta.content is not None:
+                content += choice.delta.content
+
+            if choice.delta.content is not None or deltas is not None:
+                yield ChatCompletionChunk(content_delta=choice.delta.content, tool_call_deltas=deltas)
+
+        tool_calls = merge_tool_call_deltas(tool_call_deltas) if len(tool_call_deltas) > 0 else None
+
+        # The streaming endpoint does not report usage, so it is computed locally, tool calls included.
+        encoder = get_encoder_for_model(model)
+        prompt_tokens = self.count_token_in_messages(messages, model)
+        completion_tokens = len(encoder.encode(content))
+        if tool_calls is not None:
+            completion_tokens += sum([len(encoder.encode(call.function.name))
+                                      + len(encoder.encode(call.function.arguments)) for call in tool_calls])
+
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content=content if len(content) > 0 else None,
+                                          role=ChatCompletionMessageRole.ASSISTANT,
+                                          tool_calls=tool_calls),
+            finish_reason=ChatCompletionFinishReason(finish_reason or ChatCompletionFinishReason.Stop),
+            provider=self.provider_name(),
+            model=result_model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        ))
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
         encoding = get_encoder_for_model(model)
 
@@ -116,24 +210,102 @@ class GPTChatCompletionAPI(ChatCompletionAPI):
                 f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
             )
 
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
+        def count_message(message: ChatCompletionMessage) -> int:
+            num_message_tokens = tokens_per_message
             for key, value in message.dict().items():
                 try:
-                    num_tokens += len(encoding.encode(value))
+                    num_message_tokens += len(encoding.encode(value))
                 except:
                     print(f"Error on token counting - {key}: {value}")
 
                 if key == "name":
-                    num_tokens += tokens_per_name
+                    num_message_tokens += tokens_per_name
+            return num_message_tokens
+
+        # Messages already counted in earlier turns are looked up instead of being re-encoded.
+        cache_key = f"{encoding.name}/{tokens_per_message}/{tokens_per_name}"
+        num_tokens = sum([token_count_cache.get_or_count(cache_key, message, count_message) for message in messages])
         num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
         return num_tokens
 
 
-def get_encoder_for_model(model: ChatGPTModel | str) -> Any:
-    try:
-        return tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        return tiktoken.get_encoding("cl100k_base")
+class GPTBatchAPI(ChatCompletionBatchAPI):
+    """
+    Chat completion jobs on the OpenAI Batch API: the requests are uploaded as a JSONL file, and the job's output
+    file is downloaded once it completes. Authorized with the same API key as GPTChatCompletionAPI.
+    """
+
+    def __init__(self, base_url: str = "https://api.openai.com/v1", http_client_config: HttpClientPoolConfig | None = None,
+                 completion_window: str = "24h"):
+        self.__base_url = base_url.rstrip("/")
+        self.__http_client_config = http_client_config or HttpClientPoolConfig()
+        self.__completion_window = completion_window
+        self.__client: httpx.AsyncClient | None = None
+
+    @property
+    def __http_client(self) -> httpx.AsyncClient:
+        if self.__client is None:
+            self.__client = self.__http_client_config.create_async_client()
+        return self.__client
+
+    def __get_headers(self) -> dict:
+        GPTChatCompletionAPI.assert_authorize()
+        api_key = GPTChatCompletionAPI.get_auth_variable_for_spec(APIAuthorizationVariableSpecPresets.ApiKey)
+        return {"Authorization": f"Bearer {api_key}"}
+
+    async def __request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = await self.__http_client.request(method, self.__base_url + path, headers=self.__get_headers(),
+                                                    **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def submit(self, requests: list[ChatCompletionBatchRequest]) -> str:
+        file = (await self.__request("POST", "/files", data={"purpose": "batch"},
+                                     files={"file": ("batch.jsonl", make_batch_jsonl(requests).encode("utf-8"),
+                                                     "application/jsonl")})).json()
+        job = (await self.__request("POST", "/batches", json={
+            "input_file_id": file["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": self.__completion_window
+        })).json()
+        return job["id"]
+
+    async def get_status(self, job_id: str) -> BatchJobStatus:
+        job = (await self.__request("GET", f"/batches/{job_id}")).json()
+        return BatchJobStatus(job["status"])
+
+    async def __get_file_lines(self, file_id: str | None) -> list[dict]:
+        if file_id is None:
+            return []
+        content = (await self.__request("GET", f"/files/{file_id}/content")).text
+        return [json.loads(line) for line in content.splitlines() if len(line.strip()) > 0]
+
+    async def get_results(self, job_id: str) -> list[ChatCompletionBatchResult]:
+        job = (await self.__request("GET", f"/batches/{job_id}")).json()
+
+        results = []
+        for line in await self.__get_file_lines(job.get("output_file_id")) + await self.__get_file_lines(
+                job.get("error_file_id")):
+            response = line.get("response") or dict()
+            if response.get("status_code") == 200:
+                body = response["body"]
+                results.append(ChatCompletionBatchResult(
+                    custom_id=line["custom_id"],
+                    result=convert_openai_compatible_response(body, GPTChatCompletionAPI.provider_name(),
+                                                              body.get("model"))))
+            else:
+                results.append(ChatCompletionBatchResult(custom_id=line["custom_id"],
+                                                         error=json.dumps(line.get("error") or response.get("body"))))
+        return results
+
+    async def cancel(self, job_id: str):
+        await self.__request("POST", f"/batches/{job_id}/cancel")
+
+    async def aclose(self):
+        if self.__client is not None:
+            await self.__client.aclose()
+            self.__client = None
+
+
+def get_encoder_for_model(model: ChatGPTModel | str) -> Tokenizer:
+    return tokenizer_service.get_tiktoken(model)
@@ -0,0 +1,216 @@
+import json
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+from urllib import parse
+
+import httpx
+
+from chatlib.llm.chat_completion_api import ChatCompletionChunk, ChatCompletionToolCallDelta, ChatCompletionResult, \
+    ChatCompletionMessage, ChatCompletionMessageRole, ChatCompletionFinishReason, merge_tool_call_deltas, \
+    ChatCompletionAPI, ChatCompletionRetryRequestedException, is_context_length_error_message
+from chatlib.llm.client_pool import HttpClientPoolConfig, ManagedClientPool
+from chatlib.llm.retry import parse_retry_after
+
+# Shared transport for REST providers that expose an OpenAI-compatible /v1/chat/completions endpoint.
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def _convert_finish_reason(reason: str | None) -> ChatCompletionFinishReason:
+    return ChatCompletionFinishReason(reason) if reason in set(ChatCompletionFinishReason) \
+        else ChatCompletionFinishReason.Stop
+
+
+def convert_openai_compatible_response(json_response: dict, provider: str, model: str) -> ChatCompletionResult:
+    return ChatCompletionResult(
+        message=ChatCompletionMessage(**json_response["choices"][0]["message"]),
+        finish_reason=_convert_finish_reason(json_response["choices"][0].get("finish_reason")),
+        provider=provider,
+        model=json_response.get("model") or model,
+        **(json_response.get("usage") or dict())
+    )
+
+
+class OpenAICompatibleTransport:
+    """
+    Owns one pooled keep-alive HTTP client per host, so that limits and timeouts apply per host.
+    """
+
+    def __init__(self, default_config: HttpClientPoolConfig | None = None,
+                 host_configs: dict[str, HttpClientPoolConfig] | None = None):
+        self.__default_config = default_config or HttpClientPoolConfig()
+        self.__host_configs: dict[str, HttpClientPoolConfig] = dict(host_configs or dict())
+        self.__clients: ManagedClientPool[httpx.AsyncClient] = ManagedClientPool(
+            lambda host: self.get_host_config(host).create_async_client(),
+            lambda client: client.aclose()
+        )
+
+    def get_host_config(self, host: str) -> HttpClientPoolConfig:
+        return self.__host_configs.get(host, self.__default_config)
+
+    def configure_host(self, host: str, config: HttpClientPoolConfig):
+        self.__host_configs[host] = config
+
+    def client_for_url(self, url: str) -> httpx.AsyncClient:
+        return self.__clients.get(parse.urlsplit(url).netloc)
+
+    async def post_chat_completion(self, url: str, headers: dict, body: dict,
+                                   retryable_status_codes: set[int] = RETRYABLE_STATUS_CODES,
+                                   timeout: float | None = None) -> dict:
+        response = await self.client_for_url(url).post(url, json=body, headers=headers,
+                                                       **(dict(timeout=timeout) if timeout is not None else dict()))
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            if response.status_code in retryable_status_codes:
+                raise ChatCompletionRetryRequestedException(e, parse_retry_after(response.headers)) from e
+            else:
+                raise e
+        return response.json()
+
+    async def stream_chat_completion(self, url: str, headers: dict, body: dict, provider: str, model: str,
+                                     retryable_status_codes: set[int] = RETRYABLE_STATUS_CODES,
+                                     timeout: float | None = None) -> AsyncIterator[ChatCompletionChunk]:
+        content = ""
+        tool_call_deltas: list[ChatCompletionToolCallDelta] = []
+        finish_reason = None
+        usage = None
+
+        async with self.client_for_url(url).stream("POST", url, json={**body, "stream": True}, headers=headers,
+                                                   **(dict(timeout=timeout) if timeout is not None else dict())) as response:
+            if response.is_error:
+                await response.aread()
+                try:
+                    response.raise_for_status()
+                except httpx.HTTPStatusError as e:
+                    if response.status_code in retryable_status_codes:
+                        raise ChatCompletionRetryRequestedException(e, parse_retry_after(response.headers)) from e
+                    else:
+                        raise e
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+
+                event = json.loads(data)
+                usage = event.get("usage") or usage
+                model = event.get("model") or model
+                if len(event.get("choices") or []) == 0:
+                    continue
+
+                choice = event["choices"][0]
+                finish_reason = choice.get("finish_reason") or finish_reason
+                delta = choice.get("delta") or dict()
+
+                deltas = [ChatCompletionToolCallDelta(index=call.get("index", 0), id=call.get("id"), type=call.get("type"),
+                                                      function_name=(call.get("function") or dict()).get("name"),
+                                                      function_arguments=(call.get("function") or dict()).get("arguments"))
+                          for call in delta["tool_calls"]] if delta.get("tool_calls") is not None else None
+                if deltas is not None:
+                    tool_call_deltas.extend(deltas)
+
+                if delta.get("content") is not None:
+                    content += delta["content"]
+
+                if delta.get("content") is not None or deltas is not None:
+                    yield ChatCompletionChunk(content_delta=delta.get("content"), tool_call_deltas=deltas)
+
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content=content if len(content) > 0 else None,
+                                          role=ChatCompletionMessageRole.ASSISTANT,
+                                          tool_calls=merge_tool_call_deltas(tool_call_deltas) if len(
+                                              tool_call_deltas) > 0 else None),
+            finish_reason=_convert_finish_reason(finish_reason),
+            provider=provider,
+            model=model,
+            **(usage or dict())
+        ))
+
+    async def aclose(self):
+        await self.__clients.aclose()
+
+
+openai_compatible_transport = OpenAICompatibleTransport()
+
+
+async def close_openai_compatible_transport():
+    """
+    Close the pooled clients of the shared transport, e.g., at application shutdown. Requests in flight on it fail;
+    later requests open new clients.
+    """
+    await openai_compatible_transport.aclose()
+
+
+class OpenAICompatibleChatCompletionAPI(ChatCompletionAPI, ABC):
+    """
+    Base class for providers served through an OpenAI-compatible REST endpoint. A new host only needs to provide
+    its endpoint, request headers and authorization specs.
+
+    aclose does not close the transport, which is shared with other instances or owned by whoever passed it in.
+    Close the shared one with close_openai_compatible_transport.
+    """
+
+    def __init__(self, transport: OpenAICompatibleTransport | None = None):
+        super().__init__()
+        self.__transport = transport or openai_compatible_transport
+
+    @property
+    def transport(self) -> OpenAICompatibleTransport:
+        return self.__transport
+
+    @abstractmethod
+    def _get_endpoint(self) -> str:
+        pass
+
+    @abstractmethod
+    def _get_request_headers(self) -> dict:
+        pass
+
+    def _make_request_body(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> dict:
+        return {
+            "model": model,
+            "messages": [msg.dict() for msg in messages],
+            **params
+        }
+
+    def _get_retryable_status_codes(self) -> set[int]:
+        return RETRYABLE_STATUS_CODES
+
+    def _is_context_length_error(self, error: Exception) -> bool:
+        if isinstance(error, ChatCompletionRetryRequestedException):
+            # Hosts that retry on any 4xx wrap the status error.
+            error = error.caused_by
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code in (400, 413, 422):
+            try:
+                return is_context_length_error_message(error.response.text)
+            except httpx.ResponseNotRead:
+                return False
+        return False
+
+    def _classify_retryable_error(self, error: Exception) -> ChatCompletionRetryRequestedException | None:
+        # Connection failures and timeouts never reached the provider.
+        if isinstance(error, httpx.TransportError):
+            return ChatCompletionRetryRequestedException(error)
+        else:
+            return super()._classify_retryable_error(error)
+
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                        params: dict) -> ChatCompletionResult:
+        json_response = await self.__transport.post_chat_completion(self._get_endpoint(), self._get_request_headers(),
+                                                                    self._make_request_body(model, messages, params),
+                                                                    self._get_retryable_status_codes(),
+                                                                    **self._get_request_timeout_kwargs())
+        return convert_openai_compatible_response(json_response, self.provider_name(), model)
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        async for chunk in self.__transport.stream_chat_completion(self._get_endpoint(), self._get_request_headers(),
+                                                                   self._make_request_body(model, messages, params),
+                                                                   self.provider_name(), model,
+                                                                   self._get_retryable_status_codes(),
+                                                                   **self._get_request_timeout_kwargs()):
+            yield chunk
@@ -0,0 +1,73 @@
+from importlib import import_module
+from importlib.metadata import entry_points
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from chatlib.llm.chat_completion_api import ChatCompletionAPI
+
+# Third-party packages register providers under this group, e.g., in pyproject.toml:
+#
+# [tool.poetry.plugins."chatlib.providers"]
+# "my-provider" = "my_package.my_module:MyChatCompletionAPI"
+ENTRY_POINT_GROUP = "chatlib.providers"
+
+# Provider modules are imported only when a provider is first resolved, as their SDKs are slow to import.
+_BUILTIN_PROVIDERS: dict[str, str] = {
+    "openai": "chatlib.llm.integration.openai_api:GPTChatCompletionAPI",
+    "anthropic": "chatlib.llm.integration.anthropic_api:AnthropicChatCompletionAPI",
+    "google": "chatlib.llm.integration.gemini_api:GeminiAPI",
+    "cohere": "chatlib.llm.integration.cohere_api:CohereChatAPI",
+    "together": "chatlib.llm.integration.together_api:TogetherAPI",
+    "azure-llama2": "chatlib.llm.integration.azure_llama2_api:AzureLlama2ChatCompletionAPI",
+    "mock": "chatlib.llm.integration.mock_api:MockChatCompletionAPI",
+}
+
+
+class ProviderNotFoundError(KeyError):
+    pass
+
+
+class ProviderRegistry:
+    """
+    Resolves chat completion providers by name. Each provider is registered as an import path and loaded on first use.
+    """
+
+    def __init__(self, providers: dict[str, str] | None = None):
+        self.__targets: dict[str, 'str | type[ChatCompletionAPI]'] = dict(providers or {})
+        self.__entry_points_loaded = False
+
+    def __load_entry_points(self):
+        if not self.__entry_points_loaded:
+            self.__entry_points_loaded = True
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                # Explicit registrations take precedence over installed plugins.
+                self.__targets.setdefault(entry_point.name, entry_point.value)
+
+    def register(self, name: str, target: 'str | type[ChatCompletionAPI]'):
+        """
+        :param target: The class itself, or its import path formatted as "package.module:ClassName"
+        """
+        self.__targets[name] = target
+
+    def get_names(self) -> list[str]:
+        self.__load_entry_points()
+        return list(self.__targets.keys())
+
+    def get_class(self, name: str) -> 'type[ChatCompletionAPI]':
+        if name not in self.__targets:
+            self.__load_entry_points()
+        target = self.__targets.get(name)
+        if target is None:
+            raise ProviderNotFoundError(f"No chat completion provider is registered as {name}.")
+
+        if isinstance(target, str):
+            module_name, class_name = target.split(":")
+            target = getattr(import_module(module_name), class_name)
+            self.__targets[name] = target
+        return target
+
+    def create(self, name: str, **kwargs) -> 'ChatCompletionAPI':
+        return self.get_class(name)(**kwargs)
+
+
+provider_registry = ProviderRegistry(_BUILTIN_PROVIDERS)
@@ -1,12 +1,10 @@
-import json
-from asyncio import to_thread
 from enum import StrEnum
 from functools import cache
 from typing import Any
 
-import requests
-
-from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, ChatCompletionFinishReason
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionResult
+from chatlib.llm.integration.openai_compatible import OpenAICompatibleChatCompletionAPI, OpenAICompatibleTransport
+from chatlib.llm.token_estimation import ModelTokenEstimators
 from chatlib.utils.integration import APIAuthorizationVariableSpec, \
     APIAuthorizationVariableSpecPresets
 
@@ -16,7 +14,13 @@ class TogetherAIModel(StrEnum):
     Vicuna13B1_5 = "lmsys/vicuna-13b-v1.5"
 
 
-class TogetherAPI(ChatCompletionAPI):
+TOGETHER_TOKEN_LIMITS = {
+    TogetherAIModel.Mixtral8x7BInstruct: 32768,
+    TogetherAIModel.Vicuna13B1_5: 4096
+}
+
+
+class TogetherAPI(OpenAICompatibleChatCompletionAPI):
     __ENDPOINT = "https://api.together.xyz/v1/chat/completions"
 
     __api_key_spec = APIAuthorizationVariableSpecPresets.ApiKey
@@ -34,37 +38,46 @@ class TogetherAPI(ChatCompletionAPI):
     def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
         return True
 
-    def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
-                                       tolerance: int = 120) -> bool:
-        return True
+    def __init__(self, transport: OpenAICompatibleTransport | None = None,
+                 token_estimators: ModelTokenEstimators | None = None):
+        """
+        :param token_estimators: Estimate token counts locally for the hosted models, fitted with the usage of
+        completed requests
+        """
+        super().__init__(transport)
+        self.__token_estimators = token_estimators or ModelTokenEstimators()
 
-    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> Any:
-        body = {
-            "model": model,
-            "n": 1,
-            "stream": False,
-            "messages": [msg.dict() for msg in messages]
-        }
+    @property
+    def token_estimators(self) -> ModelTokenEstimators:
+        return self.__token_estimators
 
-        headers = {
+    def _get_endpoint(self) -> str:
+        return self.__ENDPOINT
+
+    def _get_request_headers(self) -> dict:
+        return {
             "accept": "application/json",
             "content-type": "application/json",
             "Authorization": f"Bearer {self.get_auth_variable_for_spec(self.__api_key_spec)}"
         }
 
-        response = await to_thread(requests.post, url=self.__ENDPOINT, json=body, headers=headers, data=None)
-        if response.status_code == 200:
-            json_response = json.loads(response.text)
-            print(json_response)
-            return ChatCompletionResult(
-                message=ChatCompletionMessage(**json_response["choices"][0]["message"]),
-                finish_reason=ChatCompletionFinishReason.Stop,
-                provider=self.provider_name(),
-                model=json_response["model"],
-                **json_response["usage"]
-            )
-        else:
-            raise Exception(response.status_code, response.reason)
+    def _make_request_body(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> dict:
+        return {
+            "n": 1,
+            **super()._make_request_body(model, messages, params)
+        }
+
+    def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
+                                       tolerance: int = 120) -> bool:
+        limit = self.get_token_limit(model)
+        return limit is None or self.count_token_in_messages(messages, model) < limit - tolerance
+
+    def get_token_limit(self, model: str) -> int | None:
+        return TOGETHER_TOKEN_LIMITS.get(model)
+
+    def _on_chat_completion_result(self, model: str, messages: list[ChatCompletionMessage],
+                                   result: ChatCompletionResult):
+        self.__token_estimators.observe_result(messages, model, result)
 
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        return 0
+        return self.__token_estimators.count_upper_bound(messages, model)
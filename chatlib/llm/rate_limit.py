@@ -0,0 +1,187 @@
+import asyncio
+from dataclasses import dataclass
+from time import monotonic
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class RateLimit(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    requests_per_minute: float | None = Field(None, gt=0)
+    tokens_per_minute: float | None = Field(None, gt=0)
+
+
+class TokenBucket:
+    """
+    A bucket that refills continuously up to its capacity. The level may go negative when a request turns out to cost
+    more than estimated; subsequent admissions then wait until the debt is paid back.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.__level = capacity
+        self.__updated_at = monotonic()
+
+    def __refill(self):
+        now = monotonic()
+        self.__level = min(self.capacity, self.__level + (now - self.__updated_at) * self.refill_per_second)
+        self.__updated_at = now
+
+    @property
+    def level(self) -> float:
+        self.__refill()
+        return self.__level
+
+    def get_wait_time(self, amount: float) -> float:
+        # A request larger than the whole bucket is admitted once the bucket is full.
+        required = min(amount, self.capacity)
+        level = self.level
+        return 0 if level >= required else (required - level) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self.__refill()
+        self.__level -= amount
+
+    def refund(self, amount: float):
+        self.__refill()
+        self.__level = min(self.capacity, self.__level + amount)
+
+
+@dataclass
+class RateLimitStats:
+    admissions: int = 0
+    delayed_admissions: int = 0
+    total_wait_time: float = 0
+    max_wait_time: float = 0
+
+    @property
+    def mean_wait_time(self) -> float:
+        return self.total_wait_time / self.admissions if self.admissions > 0 else 0
+
+
+@dataclass(frozen=True)
+class RateLimitAdmission:
+    provider: str
+    model: str
+    estimated_tokens: int
+    wait_time: float
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets per provider and model. Callers wait asynchronously, in arrival
+    order, until both buckets have capacity.
+    A limit registered without a model applies to each model of the provider separately.
+    """
+
+    def __init__(self):
+        self.__limits: dict[tuple[str, str | None], RateLimit] = dict()
+        self.__buckets: dict[tuple[str, str], tuple[TokenBucket | None, TokenBucket | None]] = dict()
+        # Locks are bound to the event loop they are first contended on, so each is kept along with its loop.
+        self.__locks: dict[tuple[str, str], tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = dict()
+        self.__stats: dict[tuple[str, str], RateLimitStats] = dict()
+
+    def set_limit(self, provider: str, limit: RateLimit | None, model: str | None = None):
+        if limit is None:
+            self.__limits.pop((provider, model), None)
+        else:
+            self.__limits[(provider, model)] = limit
+
+        # Rebuild buckets lazily with the new limit.
+        for key in [key for key in self.__buckets if key[0] == provider and (model is None or key[1] == model)]:
+            self.__buckets.pop(key)
+
+    def get_limit(self, provider: str, model: str) -> RateLimit | None:
+        return self.__limits.get((provider, model)) or self.__limits.get((provider, None))
+
+    def requires_token_estimate(self, provider: str, model: str) -> bool:
+        limit = self.get_limit(provider, model)
+        return limit is not None and limit.tokens_per_minute is not None
+
+    def __get_buckets(self, provider: str, model: str) -> tuple[TokenBucket | None, TokenBucket | None]:
+        key = (provider, model)
+        if key not in self.__buckets:
+            limit = self.get_limit(provider, model)
+            self.__buckets[key] = (
+                TokenBucket(limit.requests_per_minute, limit.requests_per_minute / 60)
+                if limit.requests_per_minute is not None else None,
+                TokenBucket(limit.tokens_per_minute, limit.tokens_per_minute / 60)
+                if limit.tokens_per_minute is not None else None
+            )
+        return self.__buckets[key]
+
+    def __get_lock(self, key: tuple[str, str]) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        entry = self.__locks.get(key)
+        if entry is None or entry[0] is not loop:
+            # Created on first use in each loop, e.g., after a previous asyncio.run has closed its loop.
+            entry = (loop, asyncio.Lock())
+            self.__locks[key] = entry
+        return entry[1]
+
+    def get_stats(self, provider: str, model: str) -> RateLimitStats:
+        return self.__stats.setdefault((provider, model), RateLimitStats())
+
+    def get_all_stats(self) -> dict[tuple[str, str], RateLimitStats]:
+        return dict(self.__stats)
+
+    async def acquire(self, provider: str, model: str, estimated_tokens: int = 0) -> RateLimitAdmission | None:
+        """
+        Wait until the request fits in both buckets, then consume from them.
+        :return: An admission to reconcile with the actual usage, or None if no limit is configured.
+        """
+        if self.get_limit(provider, model) is None:
+            return None
+
+        key = (provider, model)
+        lock = self.__get_lock(key)
+
+        start = monotonic()
+        async with lock:
+            while True:
+                request_bucket, token_bucket = self.__get_buckets(provider, model)
+                wait_time = max(request_bucket.get_wait_time(1) if request_bucket is not None else 0,
+                                token_bucket.get_wait_time(estimated_tokens) if token_bucket is not None else 0)
+                if wait_time <= 0:
+                    break
+                await asyncio.sleep(wait_time)
+
+            if request_bucket is not None:
+                request_bucket.consume(1)
+            if token_bucket is not None:
+                token_bucket.consume(estimated_tokens)
+
+        waited = monotonic() - start
+
+        stats = self.get_stats(provider, model)
+        stats.admissions += 1
+        stats.total_wait_time += waited
+        stats.max_wait_time = max(stats.max_wait_time, waited)
+        if waited > 0.001:
+            stats.delayed_admissions += 1
+
+        return RateLimitAdmission(provider=provider, model=model, estimated_tokens=estimated_tokens, wait_time=waited)
+
+    def reconcile(self, admission: RateLimitAdmission | None, actual_tokens: int | None):
+        """
+        Correct the token bucket once the provider reports the actual usage.
+        :param admission: The admission returned by acquire
+        :param actual_tokens: Tokens actually billed. Pass 0 for a request that failed before being processed.
+        """
+        if admission is None or actual_tokens is None or self.get_limit(admission.provider, admission.model) is None:
+            return
+
+        request_bucket, token_bucket = self.__get_buckets(admission.provider, admission.model)
+        if token_bucket is None:
+            return
+
+        difference = actual_tokens - admission.estimated_tokens
+        if difference > 0:
+            token_bucket.consume(difference)
+        elif difference < 0:
+            token_bucket.refund(-difference)
+
+
+rate_limiter = RateLimiter()
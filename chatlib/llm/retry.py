@@ -0,0 +1,162 @@
+import random
+from abc import ABC, abstractmethod
+from email.utils import parsedate_to_datetime
+from enum import StrEnum
+from time import monotonic, time
+from typing import Mapping
+
+
+def parse_retry_after(headers: Mapping[str, str] | None) -> float | None:
+    """
+    Read the delay requested by a 429/503 response, in seconds.
+    :param headers: Response headers
+    :return: The delay in seconds, or None if the response did not ask for one.
+    """
+    if headers is None:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time())
+            except (TypeError, ValueError):
+                pass
+
+    return None
+
+
+def get_retry_after_from_error(error: Exception | None) -> float | None:
+    # SDK and httpx status errors carry the originating httpx response.
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) if response is not None else getattr(error, "headers", None)
+    return parse_retry_after(headers)
+
+
+class RetryPolicy(ABC):
+
+    @abstractmethod
+    def get_delay(self, trial: int, retry_after: float | None = None) -> float:
+        """
+        :param trial: Zero-based index of the retry about to be made
+        :param retry_after: A delay requested by the provider, if any
+        :return: Seconds to wait before the retry
+        """
+        pass
+
+
+class ExponentialBackoffRetryPolicy(RetryPolicy):
+    """
+    Exponential backoff with full jitter. A provider-requested Retry-After delay takes precedence, up to max_delay.
+    """
+
+    def __init__(self, base_delay: float = 0.5, multiplier: float = 2.0, max_delay: float = 30.0, jitter: bool = True):
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_delay(self, trial: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        delay = min(self.base_delay * (self.multiplier ** trial), self.max_delay)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class NoDelayRetryPolicy(RetryPolicy):
+
+    def get_delay(self, trial: int, retry_after: float | None = None) -> float:
+        return 0
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, provider: str, model: str, retry_in: float):
+        super().__init__(f"Circuit for {provider} - {model} is open. Retry in {retry_in:.1f} seconds.")
+        self.provider = provider
+        self.model = model
+        self.retry_in = retry_in
+
+
+class CircuitState(StrEnum):
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Fails fast after consecutive retryable failures, and lets a single probe through once recovery_timeout has passed.
+    """
+
+    def __init__(self, provider: str, model: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.provider = provider
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self.__state = CircuitState.Closed
+        self.__consecutive_failures = 0
+        self.__opened_at: float | None = None
+        self.__probe_started_at: float | None = None
+
+    @property
+    def state(self) -> CircuitState:
+        return self.__state
+
+    def before_call(self):
+        now = monotonic()
+        if self.__state == CircuitState.Open:
+            if now - self.__opened_at >= self.recovery_timeout:
+                self.__state = CircuitState.HalfOpen
+                self.__probe_started_at = now
+                return
+            raise CircuitOpenError(self.provider, self.model, self.recovery_timeout - (now - self.__opened_at))
+        elif self.__state == CircuitState.HalfOpen:
+            # A probe that never reported back (e.g., cancelled) does not block the circuit forever.
+            if self.__probe_started_at is not None and now - self.__probe_started_at < self.recovery_timeout:
+                raise CircuitOpenError(self.provider, self.model,
+                                       self.recovery_timeout - (now - self.__probe_started_at))
+            self.__probe_started_at = now
+
+    def record_success(self):
+        self.__state = CircuitState.Closed
+        self.__consecutive_failures = 0
+        self.__opened_at = None
+        self.__probe_started_at = None
+
+    def record_failure(self):
+        self.__consecutive_failures += 1
+        if self.__state == CircuitState.HalfOpen or self.__consecutive_failures >= self.failure_threshold:
+            self.__state = CircuitState.Open
+            self.__opened_at = monotonic()
+            self.__probe_started_at = None
+
+
+class CircuitBreakerRegistry:
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.__breakers: dict[tuple[str, str], CircuitBreaker] = dict()
+
+    def get(self, provider: str, model: str) -> CircuitBreaker:
+        key = (provider, model)
+        if key not in self.__breakers:
+            self.__breakers[key] = CircuitBreaker(provider, model, self.failure_threshold, self.recovery_timeout)
+        return self.__breakers[key]
+
+    def clear(self):
+        self.__breakers.clear()
+
+
+circuit_breaker_registry = CircuitBreakerRegistry()
@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from itertools import count
+from time import monotonic
+from typing import Iterator
+
+
+class RequestPriority(IntEnum):
+    Interactive = 0
+    Background = 1
+    Batch = 2
+
+
+@dataclass(frozen=True)
+class SchedulingContext:
+    priority: RequestPriority = RequestPriority.Background
+    tenant: str = "default"
+    weight: float = 1.0
+
+
+_DEFAULT_SCHEDULING_CONTEXT = SchedulingContext()
+
+_scheduling_context: ContextVar[SchedulingContext | None] = ContextVar("chatlib_scheduling_context", default=None)
+
+
+def get_scheduling_context() -> SchedulingContext:
+    return _scheduling_context.get() or _DEFAULT_SCHEDULING_CONTEXT
+
+
+def set_scheduling_context(priority: RequestPriority, tenant: str, weight: float = 1.0) -> SchedulingContext:
+    """
+    Like scheduling_context, but without a block to scope it, e.g., in a context copied to run the steps of an async
+    generator.
+    """
+    context = SchedulingContext(priority=priority, tenant=tenant, weight=weight)
+    _scheduling_context.set(context)
+    return context
+
+
+@contextmanager
+def scheduling_context(priority: RequestPriority, tenant: str, weight: float = 1.0,
+                       override: bool = True) -> Iterator[SchedulingContext]:
+    """
+    Tag the chat completion requests made inside this block with a priority class and a tenant.
+    :param override: If False, an already active context (e.g., an interactive turn calling a mapper) is kept.
+    """
+    current = _scheduling_context.get()
+    if current is not None and not override:
+        yield current
+        return
+
+    context = SchedulingContext(priority=priority, tenant=tenant, weight=weight)
+    token = _scheduling_context.set(context)
+    try:
+        yield context
+    finally:
+        try:
+            _scheduling_context.reset(token)
+        except ValueError:
+            # An abandoned async generator may be finalized in another context, which is discarded anyway.
+            pass
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish_tag: float
+    sequence: int
+    future: asyncio.Future = field(compare=False)
+
+
+class _ProviderQueue:
+
+    def __init__(self, max_concurrency: int | None):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiters: dict[RequestPriority, list[_Waiter]] = {priority: [] for priority in RequestPriority}
+        self.virtual_time = 0.0
+        self.tenant_finish_tags: dict[str, float] = dict()
+
+    def has_free_slot(self) -> bool:
+        return self.max_concurrency is None or self.in_flight < self.max_concurrency
+
+    def has_waiters(self) -> bool:
+        return any(len(heap) > 0 for heap in self.waiters.values())
+
+    def pop_next(self) -> _Waiter | None:
+        for priority in RequestPriority:
+            heap = self.waiters[priority]
+            while len(heap) > 0:
+                waiter = heapq.heappop(heap)
+                if not waiter.future.done():
+                    return waiter
+        return None
+
+
+class RequestScheduler:
+    """
+    Bounds the number of in-flight requests per provider. Waiting requests are served strictly by priority class and,
+    within a class, by weighted fair queuing across tenants, so a tenant flooding the queue cannot starve the others.
+
+    :param default_max_concurrency: The cap of providers without one set by set_max_concurrency. None, the default,
+    leaves them unbounded, so requests never queue unless a cap is set.
+    """
+
+    def __init__(self, default_max_concurrency: int | None = None):
+        self.default_max_concurrency = default_max_concurrency
+        self.__max_concurrency: dict[str, int | None] = dict()
+        self.__queues: dict[str, _ProviderQueue] = dict()
+        self.__sequence = count()
+
+    def set_max_concurrency(self, provider: str, max_concurrency: int | None):
+        """
+        :param max_concurrency: In-flight requests allowed for the provider, or None for no cap
+        """
+        self.__max_concurrency[provider] = max_concurrency
+        if provider in self.__queues:
+            queue = self.__queues[provider]
+            queue.max_concurrency = max_concurrency
+            self.__dispatch(queue)
+
+    def __get_queue(self, provider: str) -> _ProviderQueue:
+        if provider not in self.__queues:
+            self.__queues[provider] = _ProviderQueue(self.__max_concurrency.get(provider, self.default_max_concurrency))
+        return self.__queues[provider]
+
+    def get_in_flight(self, provider: str) -> int:
+        return self.__get_queue(provider).in_flight
+
+    async def acquire(self, provider: str) -> float:
+        """
+        Wait for a slot for the provider. Every acquire must be paired with a release.
+        :return: Seconds spent in the queue
+        """
+        queue = self.__get_queue(provider)
+        if queue.has_free_slot() and not queue.has_waiters():
+            queue.in_flight += 1
+            return 0
+
+        context = get_scheduling_context()
+        finish_tag = max(queue.virtual_time, queue.tenant_finish_tags.get(context.tenant, 0)) + 1 / context.weight
+        queue.tenant_finish_tags[context.tenant] = finish_tag
+
+        waiter = _Waiter(finish_tag, next(self.__sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(queue.waiters[context.priority], waiter)
+
+        start = monotonic()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just before the cancellation; hand it over.
+                self.release(provider)
+            raise
+        return monotonic() - start
+
+    def release(self, provider: str):
+        queue = self.__get_queue(provider)
+        queue.in_flight -= 1
+        self.__dispatch(queue)
+
+    @staticmethod
+    def __dispatch(queue: _ProviderQueue):
+        while queue.has_free_slot():
+            waiter = queue.pop_next()
+            if waiter is None:
+                break
+            queue.virtual_time = max(queue.virtual_time, waiter.finish_tag)
+            queue.in_flight += 1
+            waiter.future.set_result(None)
+
+        if len(queue.tenant_finish_tags) > 1024:
+            # Tenants whose tags fell behind the virtual clock are indistinguishable from new ones.
+            queue.tenant_finish_tags = {tenant: tag for tenant, tag in queue.tenant_finish_tags.items()
+                                        if tag > queue.virtual_time}
+
+
+request_scheduler = RequestScheduler()
@@ -0,0 +1,63 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Generic, TypeVar, Callable, Awaitable
+
+T = TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    coalesced: int = 0
+
+
+class _Flight:
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent calls with the same key into one underlying call whose outcome, result or error, is shared by
+    every caller. A cancelled caller stops waiting without affecting the others; the underlying call is cancelled only
+    when no caller is left.
+    """
+
+    def __init__(self):
+        self.__flights: dict[str, _Flight] = dict()
+        self.stats = SingleFlightStats()
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self.__flights
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """
+        :param key: Calls with the same key are considered identical
+        :param call: Starts the underlying call. Invoked only when no identical call is in flight.
+        :return: The result, and whether it was shared from a call started by another caller
+        """
+        flight = self.__flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self.__flights[key] = flight
+            flight.task.add_done_callback(lambda task: self.__on_done(key, flight))
+            self.stats.calls += 1
+        else:
+            self.stats.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def __on_done(self, key: str, flight: _Flight):
+        if self.__flights.get(key) is flight:
+            del self.__flights[key]
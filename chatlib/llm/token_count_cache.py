@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage
+
+
+@dataclass
+class TokenCountCacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0
+
+
+class TokenCountCache:
+    """
+    A bounded LRU memo of per-message token counts, so that counting a growing dialogue only encodes the new messages.
+    Entries are keyed by the encoding, a hash of the content, the role and the name (plus tool call fields).
+    """
+
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self.__counts: OrderedDict[Hashable, int] = OrderedDict()
+        # Counting may run on the tokenizer worker pool as well as on the event loop.
+        self.__lock = threading.Lock()
+        self.stats = TokenCountCacheStats()
+
+    @staticmethod
+    def make_key(encoding: str, message: ChatCompletionMessage) -> Hashable:
+        content = message.content or ""
+        return (encoding, hash(content), len(content), message.role, message.name, message.tool_call_id,
+                tuple(message.tool_calls) if message.tool_calls is not None else None)
+
+    def get_or_count(self, encoding: str, message: ChatCompletionMessage,
+                     count: Callable[[ChatCompletionMessage], int]) -> int:
+        """
+        :param encoding: Identifies the tokenizer and the per-message overheads the count depends on
+        :param count: Counts the tokens of the message on a miss
+        """
+        key = self.make_key(encoding, message)
+        with self.__lock:
+            cached = self.__counts.get(key)
+            if cached is not None:
+                self.__counts.move_to_end(key)
+                self.stats.hits += 1
+                return cached
+            self.stats.misses += 1
+
+        num_tokens = count(message)
+        with self.__lock:
+            self.__counts[key] = num_tokens
+            if len(self.__counts) > self.max_entries:
+                self.__counts.popitem(last=False)
+        return num_tokens
+
+    def clear(self):
+        with self.__lock:
+            self.__counts.clear()
+
+    def __len__(self) -> int:
+        return len(self.__counts)
+
+
+token_count_cache = TokenCountCache()
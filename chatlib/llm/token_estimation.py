@@ -0,0 +1,115 @@
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionResult
+
+
+@dataclass(frozen=True)
+class TokenEstimate:
+    tokens: int
+    lower_bound: int
+    upper_bound: int
+
+
+class TokenEstimator:
+    """
+    Estimates the token count of messages locally from the length of their text, using a tokens-per-unit ratio fitted
+    online from counts reported by the provider. The error bound widens with the spread of the observed ratios.
+    :param count_bytes: If True, measures text in UTF-8 bytes, which tracks tokens more evenly across scripts than
+    characters do
+    :param initial_ratio: Tokens per unit assumed until min_samples observations are made
+    :param message_overhead: Tokens added per message for the role and delimiters
+    :param default_error: The relative error bound until min_samples observations are made
+    :param z: The number of standard deviations of the observed ratios covered by the error bound
+    """
+
+    def __init__(self, count_bytes: bool = True, initial_ratio: float = 0.25, message_overhead: int = 4,
+                 window_size: int = 200, min_samples: int = 5, default_error: float = 0.25, z: float = 3.0):
+        self.count_bytes = count_bytes
+        self.initial_ratio = initial_ratio
+        self.message_overhead = message_overhead
+        self.min_samples = min_samples
+        self.default_error = default_error
+        self.z = z
+
+        self.__ratios: deque[float] = deque(maxlen=window_size)
+        self.__lock = threading.Lock()
+
+    def get_text_length(self, messages: list[ChatCompletionMessage]) -> int:
+        if self.count_bytes:
+            return sum([len((message.content or "").encode("utf-8")) for message in messages])
+        else:
+            return sum([len(message.content or "") for message in messages])
+
+    @property
+    def sample_count(self) -> int:
+        return len(self.__ratios)
+
+    @property
+    def ratio(self) -> float:
+        with self.__lock:
+            if len(self.__ratios) < self.min_samples:
+                return self.initial_ratio
+            return sum(self.__ratios) / len(self.__ratios)
+
+    @property
+    def relative_error(self) -> float:
+        with self.__lock:
+            if len(self.__ratios) < self.min_samples:
+                return self.default_error
+            mean = sum(self.__ratios) / len(self.__ratios)
+            variance = sum([(ratio - mean) ** 2 for ratio in self.__ratios]) / (len(self.__ratios) - 1)
+            return self.z * math.sqrt(variance) / mean if mean > 0 else self.default_error
+
+    def estimate(self, messages: list[ChatCompletionMessage]) -> TokenEstimate:
+        overhead = self.message_overhead * len(messages)
+        text_tokens = self.get_text_length(messages) * self.ratio
+        error = self.relative_error
+        return TokenEstimate(tokens=overhead + round(text_tokens),
+                             lower_bound=overhead + math.floor(text_tokens * max(0.0, 1 - error)),
+                             upper_bound=overhead + math.ceil(text_tokens * (1 + error)))
+
+    def observe(self, messages: list[ChatCompletionMessage], actual_tokens: int):
+        """
+        Fit the ratio with a token count reported by the provider for the same messages.
+        """
+        length = self.get_text_length(messages)
+        if length > 0:
+            ratio = max(0, actual_tokens - self.message_overhead * len(messages)) / length
+            with self.__lock:
+                self.__ratios.append(ratio)
+
+    def reset(self):
+        with self.__lock:
+            self.__ratios.clear()
+
+
+class ModelTokenEstimators:
+    """
+    TokenEstimators per model, fitted with the prompt token usage of completed results. Counts are reported at the
+    upper error bound, so that limit checks built on them stay on the safe side.
+    :param estimator_kwargs: Arguments for the TokenEstimator of each model
+    """
+
+    def __init__(self, **estimator_kwargs):
+        self.__estimator_kwargs = estimator_kwargs
+        self.__estimators: dict[str, TokenEstimator] = dict()
+
+    def get(self, model: str) -> TokenEstimator:
+        estimator = self.__estimators.get(model)
+        if estimator is None:
+            estimator = TokenEstimator(**self.__estimator_kwargs)
+            self.__estimators[model] = estimator
+        return estimator
+
+    def count_upper_bound(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        return self.get(model).estimate(messages).upper_bound
+
+    def observe_result(self, messages: list[ChatCompletionMessage], model: str, result: ChatCompletionResult):
+        """
+        :param model: The requested model, which may differ from the model name the provider reports in the result
+        """
+        if result.prompt_tokens is not None and not result.cached:
+            self.get(model).observe(messages, result.prompt_tokens)
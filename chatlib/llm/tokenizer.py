@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar, Any
+
+T = TypeVar("T")
+
+
+class Tokenizer(ABC):
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        pass
+
+    @abstractmethod
+    def encode(self, text: str) -> list[int]:
+        pass
+
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        return [self.encode(text) for text in texts]
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        return [len(tokens) for tokens in self.encode_batch(texts)]
+
+
+class TiktokenTokenizer(Tokenizer):
+
+    def __init__(self, encoding: Any):
+        self.__encoding = encoding
+
+    @property
+    def name(self) -> str:
+        return self.__encoding.name
+
+    def encode(self, text: str) -> list[int]:
+        return self.__encoding.encode(text)
+
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        return self.__encoding.encode_batch(texts)
+
+
+class HuggingFaceTokenizer(Tokenizer):
+
+    def __init__(self, name: str, tokenizer: Any):
+        self.__name = name
+        self.__tokenizer = tokenizer
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    def encode(self, text: str) -> list[int]:
+        return self.__tokenizer.encode(text)
+
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        # Fast (Rust) tokenizers encode a batch in parallel.
+        return self.__tokenizer(texts)["input_ids"]
+
+
+class TokenizerService:
+    """
+    Process-wide registry of loaded tokenizers. Encoders are loaded once, optionally ahead of time with preload(), and
+    optionally from a local cache directory without network access. Large encoding jobs can be moved to a worker
+    thread pool so that they do not block the event loop.
+    :param cache_dir: A directory holding tiktoken BPE files and HuggingFace tokenizer files
+    :param offline: If True, HuggingFace tokenizers are only loaded from local files
+    :param offload_threshold: Characters from which count_async encodes on the worker pool
+    """
+
+    def __init__(self, cache_dir: str | None = None, offline: bool = False, max_workers: int = 2,
+                 offload_threshold: int = 20000):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.max_workers = max_workers
+        self.offload_threshold = offload_threshold
+
+        self.__tokenizers: dict[str, Tokenizer] = dict()
+        # Reentrant: a failed lookup falls back to loading another encoding.
+        self.__lock = threading.RLock()
+        self.__executor: ThreadPoolExecutor | None = None
+
+    def __get_or_load(self, key: str, load: Callable[[], Tokenizer]) -> Tokenizer:
+        tokenizer = self.__tokenizers.get(key)
+        if tokenizer is None:
+            with self.__lock:
+                tokenizer = self.__tokenizers.get(key)
+                if tokenizer is None:
+                    tokenizer = load()
+                    self.__tokenizers[key] = tokenizer
+        return tokenizer
+
+    def get_tiktoken(self, model: str) -> Tokenizer:
+        """
+        :param model: A model name, or an encoding name such as cl100k_base
+        """
+        def load() -> Tokenizer:
+            import tiktoken
+
+            if self.cache_dir is not None:
+                # tiktoken reads the cache location from the environment when loading an encoding.
+                os.environ["TIKTOKEN_CACHE_DIR"] = self.cache_dir
+
+            try:
+                return TiktokenTokenizer(tiktoken.encoding_for_model(model))
+            except KeyError:
+                try:
+                    return TiktokenTokenizer(tiktoken.get_encoding(model))
+                except ValueError:
+                    print("Warning: model not found. Using cl100k_base encoding.")
+                    return self.get_tiktoken("cl100k_base")
+
+        return self.__get_or_load(f"tiktoken:{model}", load)
+
+    def get_huggingface(self, name: str) -> Tokenizer:
+        def load() -> Tokenizer:
+            from transformers import AutoTokenizer
+
+            return HuggingFaceTokenizer(name, AutoTokenizer.from_pretrained(name, cache_dir=self.cache_dir,
+                                                                            local_files_only=self.offline,
+                                                                            use_fast=True))
+
+        return self.__get_or_load(f"huggingface:{name}", load)
+
+    def preload(self, tiktoken_models: list[str] | None = None, huggingface_names: list[str] | None = None):
+        """
+        Load tokenizers at startup rather than on the first request that needs them.
+        """
+        for model in tiktoken_models or []:
+            self.get_tiktoken(model)
+        for name in huggingface_names or []:
+            self.get_huggingface(name)
+
+    async def preload_async(self, tiktoken_models: list[str] | None = None,
+                            huggingface_names: list[str] | None = None):
+        await self.run_in_pool(self.preload, tiktoken_models, huggingface_names)
+
+    async def run_in_pool(self, func: Callable[..., T], *args) -> T:
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chatlib-tokenizer")
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, func, *args)
+
+    def should_offload(self, num_characters: int) -> bool:
+        return num_characters >= self.offload_threshold
+
+    async def count_batch_async(self, tokenizer: Tokenizer, texts: list[str]) -> list[int]:
+        if self.should_offload(sum([len(text) for text in texts])):
+            return await self.run_in_pool(tokenizer.count_batch, texts)
+        else:
+            return tokenizer.count_batch(texts)
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+
+tokenizer_service = TokenizerService()
@@ -11,7 +11,9 @@ from chatlib.chatbot import DialogueTurn, Dialogue, RegenerateRequestException,
 from chatlib.chatbot.generators import ChatGPTResponseGenerator
 from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionMessageRole
 from chatlib.llm.integration import ChatGPTModel
+from chatlib.llm.scheduler import scheduling_context, RequestPriority
 from chatlib.utils.jinja_utils import convert_to_jinja_template
+from chatlib.utils.metrics import mapper_runs, mapper_output_retries
 
 InputType = TypeVar('InputType')
 OutputType = TypeVar('OutputType')
@@ -119,16 +121,28 @@ class ChatGPTFewShotMapper(Mapper[InputType, OutputType, ChatFewShotParamsType],
         if params is not None and params.instruction_params is not None and isinstance(self.base_instruction, Template):
             self.__generator.base_instruction = self.base_instruction.render(**params.instruction_params)
 
-        resp, _, _ = await self.__generator.get_response(
-            [DialogueTurn(message=self._convert_input_to_message_content(input, params), is_user=True)])
-        # print(resp)
-
         try:
-            processed_resp = self._postprocess_chatgpt_output(resp, params)
-            return processed_resp
-        except RegenerateRequestException as ex:
-            print(f"Regeneration requested due to an error - {ex.reason}")
+            with scheduling_context(RequestPriority.Batch, f"mapper-{id(self)}", override=False):
+                resp, _, _ = await self.__generator.get_response(
+                    [DialogueTurn(message=self._convert_input_to_message_content(input, params), is_user=True)])
+            # print(resp)
+
+            try:
+                processed_resp = self._postprocess_chatgpt_output(resp, params)
+            except RegenerateRequestException as ex:
+                print(f"Regeneration requested due to an error - {ex.reason}")
+                mapper_output_retries.labels(type(self).__name__).inc()
+                regenerate = True
+            else:
+                regenerate = False
+        except Exception:
+            mapper_runs.labels(type(self).__name__, "error").inc()
+            raise
+
+        if regenerate:
             return await self.run(input, params)
+        mapper_runs.labels(type(self).__name__, "success").inc()
+        return processed_resp
 
 
 class ChatGPTDialogueSummarizer(ChatGPTFewShotMapper[Dialogue, dict, ChatDialogSummarizerParams]):
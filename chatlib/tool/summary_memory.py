@@ -0,0 +1,181 @@
+import asyncio
+import contextvars
+
+from chatlib.chatbot import Dialogue
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionMessageRole
+from chatlib.llm.scheduler import scheduling_context, RequestPriority
+from chatlib.tool.converter import str_to_str_noop
+from chatlib.tool.versatile_mapper import ChatCompletionFewShotMapperParams, DialogueSummarizer, MapperInputOutputPair
+from chatlib.utils.jinja_utils import convert_to_jinja_template
+
+
+class RollingSummaryParams(ChatCompletionFewShotMapperParams):
+    # Filled in by RollingSummaryMemory with the summary so far, for the instruction to extend.
+    previous_summary: str | None = None
+    max_summary_words: int = 250
+
+
+ROLLING_SUMMARY_INSTRUCTION = convert_to_jinja_template("""
+You are a helpful assistant that keeps a running summary of a long conversation between a user and an AI.
+{%- if previous_summary %}
+Here is the summary of the conversation so far:
+<summary>{{previous_summary}}</summary>
+
+Update the summary with the new part of the conversation given by the user. Keep what is still relevant from the summary.
+{%- else %}
+Summarize the conversation given by the user.
+{%- endif %}
+Preserve facts about the user, their feelings and concerns, and what was agreed on. Write in plain prose within {{max_summary_words}} words, and output only the summary.
+""")
+
+
+def generate_rolling_summary_instruction(dialogue: Dialogue, params: RollingSummaryParams | None) -> str:
+    return ROLLING_SUMMARY_INSTRUCTION.render(previous_summary=params.previous_summary if params is not None else None,
+                                              max_summary_words=params.max_summary_words if params is not None else 250)
+
+
+def create_rolling_summarizer(api: ChatCompletionAPI,
+                              user_alias: str | None = None,
+                              system_alias: str | None = None) -> DialogueSummarizer[str, RollingSummaryParams]:
+    """
+    :return: A summarizer that outputs plain text and extends params.previous_summary, for RollingSummaryMemory
+    """
+    return DialogueSummarizer(api, generate_rolling_summary_instruction, str_to_str_noop, str_to_str_noop,
+                              user_alias=user_alias, system_alias=system_alias)
+
+
+class RollingSummaryMemory:
+    """
+    Keeps the prompt of a long session bounded by folding older turns into a running summary, which
+    ChatCompletionResponseGenerator sends in place of them. Summaries are made in the background while the session goes
+    on, and each one covers only the turns added since the previous summary, along with that summary.
+
+    :param summarizer: Maps the new turns to an updated summary, given the current one in params.previous_summary.
+    See create_rolling_summarizer.
+    :param params: Params of the summarizer calls, e.g., the model
+    :param trigger_turns: Summarize once this many turns beyond the summary are older than the recent turns
+    :param keep_recent_turns: The latest turns, which are always sent as they are
+    :param max_turns_per_update: Turns summarized at once at most, which bounds the summarizer prompt when catching up
+    with a long restored dialogue
+    :param summary_message_template: The system message carrying the summary, formatted with {summary}
+    """
+
+    def __init__(self,
+                 summarizer: DialogueSummarizer[str, RollingSummaryParams],
+                 params: RollingSummaryParams,
+                 trigger_turns: int = 20,
+                 keep_recent_turns: int = 10,
+                 max_turns_per_update: int = 40,
+                 summary_message_template: str = "Summary of the conversation so far:\n{summary}",
+                 examples: list[MapperInputOutputPair[Dialogue, str]] | None = None,
+                 output_malformed_retry_count: int = 2):
+        self.__summarizer = summarizer
+        self.__params = params
+        self.__trigger_turns = trigger_turns
+        self.__keep_recent_turns = keep_recent_turns
+        self.__max_turns_per_update = max(max_turns_per_update, trigger_turns)
+        self.__summary_message_template = summary_message_template
+        self.__examples = examples
+        self.__output_malformed_retry_count = output_malformed_retry_count
+
+        self.__summary: str | None = None
+        # The summary covers the first __summarized_count turns, the last of which has the id below.
+        self.__summarized_count = 0
+        self.__last_summarized_id: str | None = None
+
+        self.__task: asyncio.Task | None = None
+        # A finished summary waits here until the next turn starts, so that a turn sees one summary throughout.
+        self.__pending: tuple[str, int, str] | None = None
+
+    @property
+    def summary(self) -> str | None:
+        return self.__summary
+
+    @property
+    def summarized_count(self) -> int:
+        return self.__summarized_count
+
+    @property
+    def is_summarizing(self) -> bool:
+        return self.__task is not None and not self.__task.done()
+
+    @staticmethod
+    def __is_valid_for(dialog: Dialogue, count: int, last_id: str | None) -> bool:
+        return count <= len(dialog) and (count == 0 or dialog[count - 1].id == last_id)
+
+    def get_prompt(self, dialog: Dialogue) -> tuple[str | None, Dialogue]:
+        """
+        :return: The summary, and the turns to send after it
+        """
+        if self.__summary is None or not self.__is_valid_for(dialog, self.__summarized_count, self.__last_summarized_id):
+            return None, dialog
+        return self.__summary, dialog[self.__summarized_count:]
+
+    def make_summary_message(self, summary: str) -> ChatCompletionMessage:
+        return ChatCompletionMessage(content=self.__summary_message_template.format(summary=summary),
+                                     role=ChatCompletionMessageRole.SYSTEM)
+
+    def update(self, dialog: Dialogue):
+        """
+        Adopt a summary finished since the last call, and start summarizing in the background if enough turns have
+        piled up. Called by the generator at the start of every turn.
+        """
+        if self.__pending is not None:
+            summary, count, last_id = self.__pending
+            self.__pending = None
+            if self.__is_valid_for(dialog, count, last_id):
+                self.__summary, self.__summarized_count, self.__last_summarized_id = summary, count, last_id
+
+        if self.__summary is not None and not self.__is_valid_for(dialog, self.__summarized_count,
+                                                                  self.__last_summarized_id):
+            # Summarized turns were edited or withdrawn; start over.
+            self.reset()
+
+        if self.is_summarizing:
+            return
+
+        end = min(len(dialog) - self.__keep_recent_turns, self.__summarized_count + self.__max_turns_per_update)
+        if end - self.__summarized_count >= self.__trigger_turns:
+            # In a fresh context: the summary is not part of the turn, so it inherits neither its deadline nor its trace.
+            self.__task = asyncio.create_task(
+                self.__summarize(dialog[self.__summarized_count:end], self.__summary, self.__summarized_count),
+                context=contextvars.Context())
+
+    async def __summarize(self, turns: Dialogue, previous_summary: str | None, base_count: int):
+        try:
+            with scheduling_context(RequestPriority.Background, f"memory-{id(self)}"):
+                summary = await self.__summarizer.run(self.__examples, turns,
+                                                      self.__params.model_copy(
+                                                          update=dict(previous_summary=previous_summary)),
+                                                      self.__output_malformed_retry_count)
+            self.__pending = (summary.strip(), base_count + len(turns), turns[-1].id)
+        except Exception as e:
+            # The turns are summarized again at the next turn.
+            print(f"Error while summarizing the dialogue - {e}")
+
+    async def wait(self):
+        """
+        Wait for the summary in progress, if any, e.g., before saving or closing a session.
+        """
+        if self.__task is not None and not self.__task.done():
+            await asyncio.wait([self.__task])
+
+    def reset(self):
+        if self.__task is not None and not self.__task.done():
+            self.__task.cancel()
+        self.__task = None
+        self.__pending = None
+        self.__summary = None
+        self.__summarized_count = 0
+        self.__last_summarized_id = None
+
+    def write_to_json(self, parcel: dict):
+        parcel["summary"] = self.__summary
+        parcel["summarized_count"] = self.__summarized_count
+        parcel["last_summarized_id"] = self.__last_summarized_id
+
+    def restore_from_json(self, parcel: dict):
+        self.reset()
+        self.__summary = parcel.get("summary")
+        self.__summarized_count = parcel.get("summarized_count", 0)
+        self.__last_summarized_id = parcel.get("last_summarized_id")
@@ -5,9 +5,12 @@ from typing import TypeVar, Generic, Callable, Any
 from pydantic import BaseModel, ConfigDict
 
 from chatlib.chatbot import ChatCompletionParams, Dialogue, DialogueTurn
+from chatlib.llm.batch import ChatCompletionBatchAPI, ChatCompletionBatchRequest
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionMessageRole, \
     ChatCompletionFinishReason
+from chatlib.llm.scheduler import scheduling_context, RequestPriority
 from chatlib.tool.converter import str_to_str_noop
+from chatlib.utils.metrics import mapper_runs, mapper_output_retries
 from chatlib.utils.jinja_utils import convert_to_jinja_template
 
 
@@ -61,12 +64,8 @@ class ChatCompletionFewShotMapper(Generic[InputType, OutputType, ParamsType]):
     def api(self) -> ChatCompletionAPI:
         return self.__api
 
-    async def run(self,
-                  examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
-                  input: InputType,
-                  params: ParamsType,
-                  output_malformed_retry_count: int = 5
-                  ) -> OutputType:
+    def __build_messages(self, examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                         input: InputType, params: ParamsType) -> list[ChatCompletionMessage]:
         if examples is not None:  # TODO cache example messages
             converter = self.__example_str_converter or self.__input_str_converter
             example_messages = list(chain.from_iterable([[
@@ -90,33 +89,115 @@ class ChatCompletionFewShotMapper(Generic[InputType, OutputType, ParamsType]):
 
         messages.append(ChatCompletionMessage(content=self.__input_str_converter(input, params),
                                               role=ChatCompletionMessageRole.USER))
+        return messages
+
+    def __convert_output(self, input: InputType, content: str, params: ParamsType) -> OutputType:
+        output = self.__str_output_converter(content, params)
+        if self.__output_validator is not None and self.__output_validator(input, output) is not True:
+            raise ValueError("Output validation failed.")
+        return output
+
+    async def run(self,
+                  examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                  input: InputType,
+                  params: ParamsType,
+                  output_malformed_retry_count: int = 5
+                  ) -> OutputType:
+        messages = self.__build_messages(examples, input, params)
+        mapper_name = type(self).__name__
 
+        left_retry_count = output_malformed_retry_count
+        try:
+            while True:
+                # Mapper jobs yield to live sessions unless they run inside one.
+                with scheduling_context(RequestPriority.Batch, f"mapper-{id(self)}", override=False):
+                    chat_response = await self.__api.run_chat_completion(params.model, messages, params.api_params.dict())
+
+                if chat_response.finish_reason == ChatCompletionFinishReason.Stop:
+                    try:
+                        output = self.__convert_output(input, chat_response.message.content, params)
+                        mapper_runs.labels(mapper_name, "success").inc()
+                        return output
+                    except Exception as e:  # If converting fails
+                        if left_retry_count > 0:
+                            print(
+                                f"Output converting failed. retry count left: {left_retry_count}, Content: \"{chat_response.message.content}\"")
+                            print(f"Error: {e}")
+                            left_retry_count -= 1
+                            mapper_output_retries.labels(mapper_name).inc()
+                            continue
+                        else:
+                            raise Exception(
+                                "Output malformed for conversion. Consumed all retry count. PLease check your instruction.")
+                else:
+                    raise Exception(chat_response.finish_reason)
+        except Exception:
+            mapper_runs.labels(mapper_name, "error").inc()
+            raise
+
+    async def run_batch(self,
+                        batch_api: ChatCompletionBatchAPI,
+                        examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                        inputs: list[InputType],
+                        params: ParamsType,
+                        output_malformed_retry_count: int = 5,
+                        poll_interval: float = 30,
+                        timeout: float | None = None
+                        ) -> list[OutputType]:
+        """
+        Map many inputs at once through a provider batch job instead of one request per input.
+        Outputs that fail conversion or validation are re-queued into a follow-up job.
+        :param batch_api: A batch API of the provider, e.g., GPTBatchAPI
+        :param timeout: Seconds to wait for each job
+        :return: Outputs in the order of inputs
+        :raises MapperBatchFailedError: If some inputs are still malformed after all retries
+        """
+        messages_list = [self.__build_messages(examples, input, params) for input in inputs]
+
+        outputs: dict[int, OutputType] = dict()
+        errors: dict[int, Exception] = dict()
+        pending = list(range(len(inputs)))
         left_retry_count = output_malformed_retry_count
         while True:
-            chat_response = await self.__api.run_chat_completion(params.model, messages, params.api_params.dict())
-
-            if chat_response.finish_reason == ChatCompletionFinishReason.Stop:
+            results = await batch_api.run([ChatCompletionBatchRequest(custom_id=str(i), model=params.model,
+                                                                      messages=messages_list[i],
+                                                                      params=params.api_params.dict())
+                                           for i in pending], poll_interval, timeout)
+            failed = []
+            for i in pending:
+                batch_result = results[str(i)]
                 try:
-                    output = self.__str_output_converter(chat_response.message.content, params)
-                    if self.__output_validator is not None:
-                        if self.__output_validator(input, output) is True:
-                            return output
-                        else:
-                            raise ValueError("Output validation failed.")
-                    else:
-                        return output
-                except Exception as e:  # If converting fails
-                    if left_retry_count > 0:
-                        print(
-                            f"Output converting failed. retry count left: {left_retry_count}, Content: \"{chat_response.message.content}\"")
-                        print(f"Error: {e}")
-                        left_retry_count -= 1
-                        continue
-                    else:
-                        raise Exception(
-                            "Output malformed for conversion. Consumed all retry count. PLease check your instruction.")
+                    if batch_result.result is None:
+                        raise Exception(batch_result.error)
+                    elif batch_result.result.finish_reason != ChatCompletionFinishReason.Stop:
+                        raise Exception(batch_result.result.finish_reason)
+
+                    outputs[i] = self.__convert_output(inputs[i], batch_result.result.message.content, params)
+                    errors.pop(i, None)
+                except Exception as e:
+                    errors[i] = e
+                    failed.append(i)
+
+            if len(failed) == 0:
+                mapper_runs.labels(type(self).__name__, "success").inc(len(inputs))
+                return [outputs[i] for i in range(len(inputs))]
+            elif left_retry_count > 0:
+                print(f"{len(failed)} of {len(pending)} outputs failed. Re-queue them. retry count left: {left_retry_count}")
+                left_retry_count -= 1
+                mapper_output_retries.labels(type(self).__name__).inc(len(failed))
+                pending = failed
             else:
-                raise Exception(chat_response.finish_reason)
+                mapper_runs.labels(type(self).__name__, "success").inc(len(inputs) - len(errors))
+                mapper_runs.labels(type(self).__name__, "error").inc(len(errors))
+                raise MapperBatchFailedError([outputs.get(i) for i in range(len(inputs))], errors)
+
+
+class MapperBatchFailedError(Exception):
+    def __init__(self, outputs: list, errors: dict[int, Exception]):
+        super().__init__(f"{len(errors)} of {len(outputs)} outputs are malformed after consuming all retry count.")
+        # Outputs in the order of inputs; None for the failed ones.
+        self.outputs = outputs
+        self.errors = errors
 
 
 DEFAULT_USER_ALIAS = "User"
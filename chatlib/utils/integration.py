@@ -7,7 +7,6 @@ from os import path, getcwd
 from typing import Any, Optional
 
 from dotenv import find_dotenv, set_key
-from questionary import prompt
 from stringcase import constcase
 
 from chatlib.global_config import GlobalConfig
@@ -136,6 +135,8 @@ class IntegrationService(ABC):
                 "validate": make_non_empty_string_validator(spec.validation_error_message if spec.validation_error_message is not None else f"Please enter a valid {spec.human_readable_type_name}.")
             })
 
+        # Interactive prompts are only needed when credentials are missing; questionary is slow to import.
+        from questionary import prompt
         answers = prompt(questions)
 
         env_file = find_dotenv(usecwd=True)
@@ -0,0 +1,314 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import math
+import os
+import tempfile
+from bisect import bisect_left
+from time import time
+
+# Recording is a dictionary lookup and an addition, without locks. Chatlib runs on a single event loop; increments from
+# several threads at once may occasionally be lost, which is acceptable for monitoring.
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int | float = 1):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # The last slot counts the observations above the largest bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric(ABC):
+    type_name: str
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._children: dict[tuple[str, ...], _CounterChild | _HistogramChild] = dict()
+
+    @abstractmethod
+    def _make_child(self):
+        pass
+
+    def labels(self, *values: str):
+        """
+        :param values: Label values in the order of label_names
+        :return: The series of the given label values. Hold on to it to skip the lookup in hot paths.
+        """
+        try:
+            return self._children[values]
+        except KeyError:
+            return self.__add_child(values)
+
+    def __add_child(self, values: tuple):
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, but got {values}.")
+        return self._children.setdefault(tuple(str(value) for value in values), self._make_child())
+
+    def clear(self):
+        self._children.clear()
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _make_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, *values: str, amount: int | float = 1):
+        self.labels(*values).value += amount
+
+    def to_dict(self) -> dict:
+        return {"type": self.type_name, "help": self.help, "labels": list(self.label_names),
+                "samples": [dict(labels=dict(zip(self.label_names, values)), value=child.value)
+                            for values, child in list(self._children.items())]}
+
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(bucket for bucket in buckets if not math.isinf(bucket)))
+
+    def _make_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float, *values: str):
+        self.labels(*values).observe(value)
+
+    def to_dict(self) -> dict:
+        samples = []
+        for values, child in list(self._children.items()):
+            samples.append(dict(labels=dict(zip(self.label_names, values)), count=child.count, sum=child.sum,
+                                buckets=dict(zip([str(bound) for bound in self.buckets] + ["+Inf"],
+                                                 _accumulate(child.counts)))))
+        return {"type": self.type_name, "help": self.help, "labels": list(self.label_names), "samples": samples}
+
+
+def _accumulate(counts: list[int]) -> list[int]:
+    cumulative = []
+    total = 0
+    for count in counts:
+        total += count
+        cumulative.append(total)
+    return cumulative
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(pairs: list[tuple[str, str]]) -> str:
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join([f"{name}=\"{_escape_label_value(value)}\"" for name, value in pairs]) + "}"
+
+
+def _format_value(value: int | float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        elif value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and histograms, exported as a Prometheus text snapshot or a JSON dump.
+    """
+
+    def __init__(self):
+        self.__metrics: dict[str, Counter | Histogram] = dict()
+
+    def __register(self, metric: Counter | Histogram) -> Counter | Histogram:
+        existing = self.__metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError(f"Metric {metric.name} is already registered with a different type or labels.")
+            return existing
+        self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        """
+        :return: The counter of the name, created if not registered yet.
+        """
+        return self.__register(Counter(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        """
+        :return: The histogram of the name, created if not registered yet.
+        """
+        return self.__register(Histogram(name, help, label_names, buckets))
+
+    def get(self, name: str) -> Counter | Histogram | None:
+        return self.__metrics.get(name)
+
+    def reset(self):
+        """
+        Drop all recorded values, keeping the metrics registered.
+        """
+        for metric in self.__metrics.values():
+            metric.clear()
+
+    def snapshot(self) -> dict:
+        return {"timestamp": time(), "metrics": {name: metric.to_dict() for name, metric in self.__metrics.items()}}
+
+    def to_prometheus_text(self) -> str:
+        """
+        :return: The current values in the Prometheus text exposition format (version 0.0.4)
+        """
+        lines = []
+        for metric in self.__metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for values, child in list(metric._children.items()):
+                pairs = list(zip(metric.label_names, values))
+                if isinstance(metric, Counter):
+                    lines.append(f"{metric.name}{_format_labels(pairs)} {_format_value(child.value)}")
+                else:
+                    for bound, count in zip(list(metric.buckets) + [math.inf], _accumulate(child.counts)):
+                        lines.append(
+                            f"{metric.name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} {count}")
+                    lines.append(f"{metric.name}_sum{_format_labels(pairs)} {_format_value(child.sum)}")
+                    lines.append(f"{metric.name}_count{_format_labels(pairs)} {child.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        """
+        Write the snapshot as JSON, replacing the file atomically so that readers never see a partial dump.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def start_periodic_json_dump(self, path: str, interval: float = 60) -> asyncio.Task:
+        """
+        Dump the snapshot to a file every interval seconds on the running event loop, and once more when cancelled.
+        :return: The dumping task. Cancel it to stop.
+        """
+
+        async def dump():
+            try:
+                while True:
+                    await asyncio.sleep(interval)
+                    self.__write_json_safely(path)
+            finally:
+                self.__write_json_safely(path)
+
+        return asyncio.create_task(dump())
+
+    def __write_json_safely(self, path: str):
+        try:
+            self.write_json(path)
+        except Exception as e:
+            print(f"Error while dumping metrics to {path} - {e}")
+
+
+metrics_registry = MetricsRegistry()
+
+
+def get_prometheus_text() -> str:
+    """
+    :return: A Prometheus text snapshot of the built-in metrics registry, e.g., to serve from a /metrics endpoint.
+    """
+    return metrics_registry.to_prometheus_text()
+
+
+# Built-in metrics ##############################################################
+
+chat_completion_requests = metrics_registry.counter(
+    "chatlib_chat_completion_requests_total",
+    "Chat completion requests sent to providers, after retries, by outcome (success or error).",
+    ("provider", "model", "outcome"))
+
+chat_completion_retries = metrics_registry.counter(
+    "chatlib_chat_completion_retries_total",
+    "Provider calls retried after a transient error.",
+    ("provider", "model"))
+
+chat_completion_tokens = metrics_registry.counter(
+    "chatlib_chat_completion_tokens_total",
+    "Tokens billed by providers, by direction (in for prompts, out for completions).",
+    ("provider", "model", "direction"))
+
+chat_completion_provider_latency = metrics_registry.histogram(
+    "chatlib_chat_completion_provider_latency_seconds",
+    "Duration of each provider call attempt, until the whole response is received.",
+    ("provider", "model"))
+
+chat_completion_queue_wait = metrics_registry.histogram(
+    "chatlib_chat_completion_queue_wait_seconds",
+    "Time spent waiting for the request scheduler and rate limiter before a provider call.",
+    ("provider",))
+
+chat_completion_hedges = metrics_registry.counter(
+    "chatlib_chat_completion_hedges_total",
+    "Duplicate requests sent by the hedging policy for requests slower than the hedging delay.",
+    ("provider", "model"))
+
+chat_completion_hedge_wins = metrics_registry.counter(
+    "chatlib_chat_completion_hedge_wins_total",
+    "Hedged requests answered first by the duplicate.",
+    ("provider", "model"))
+
+chat_completion_cache_lookups = metrics_registry.counter(
+    "chatlib_chat_completion_cache_lookups_total",
+    "Response cache lookups, by result (hit or miss).",
+    ("provider", "result"))
+
+session_turns = metrics_registry.counter(
+    "chatlib_session_turns_total",
+    "Turns appended to chat sessions, by role (user or system).",
+    ("session", "role"))
+
+session_writer_latency = metrics_registry.histogram(
+    "chatlib_session_writer_latency_seconds",
+    "Duration of session writer operations.",
+    ("writer", "operation"),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+mapper_runs = metrics_registry.counter(
+    "chatlib_mapper_runs_total",
+    "Mapper runs, by outcome (success or error).",
+    ("mapper", "outcome"))
+
+mapper_output_retries = metrics_registry.counter(
+    "chatlib_mapper_output_retries_total",
+    "Mapper requests repeated because the output could not be converted.",
+    ("mapper",))
@@ -0,0 +1,171 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter, time_ns
+from typing import Any, Iterator
+
+
+class Span:
+    """
+    A timed stage of work. Spans started while another span is current become its children, so that a turn yields a
+    tree of stages such as prompt assembly, queueing and provider calls.
+    """
+
+    __slots__ = ("name", "attributes", "parent", "children", "error", "start_time_ns", "_start", "_end")
+
+    def __init__(self, name: str, parent: 'Span | None' = None, attributes: dict[str, Any] | None = None):
+        self.name = name
+        self.attributes = attributes or dict()
+        self.parent = parent
+        self.children: list[Span] = []
+        self.error: str | None = None
+        # Wall-clock start for exporters; durations come from the monotonic perf_counter.
+        self.start_time_ns = time_ns()
+        self._start = perf_counter()
+        self._end: float | None = None
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def is_ended(self) -> bool:
+        return self._end is not None
+
+    @property
+    def duration(self) -> float:
+        """
+        :return: Seconds, up to now if the span has not ended
+        """
+        return (self._end if self._end is not None else perf_counter()) - self._start
+
+    @property
+    def end_time_ns(self) -> int:
+        return self.start_time_ns + int(self.duration * 1e9)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, error: BaseException | None = None):
+        if self._end is None:
+            self._end = perf_counter()
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+            if self.parent is None:
+                _export(self)
+
+    def get_stage_timings(self) -> dict[str, float]:
+        """
+        :return: Milliseconds spent in each stage under this span, summed by stage name, along with the "total".
+        A stage nested in a stage of the same name (e.g., a generator delegating to another) is counted once.
+        """
+        timings: dict[str, float] = dict()
+
+        def visit(span: Span, enclosing: frozenset[str]):
+            for child in span.children:
+                if child.name not in enclosing:
+                    timings[child.name] = timings.get(child.name, 0) + child.duration * 1000
+                visit(child, enclosing | {child.name})
+
+        visit(self, frozenset([self.name]))
+        timings = {name: round(ms, 2) for name, ms in timings.items()}
+        timings["total"] = round(self.duration * 1000, 2)
+        return timings
+
+
+class SpanExporter(ABC):
+
+    @abstractmethod
+    def export(self, span: Span):
+        """
+        Called with each finished root span, whose children are finished as well.
+        """
+        pass
+
+
+_current_span: ContextVar[Span | None] = ContextVar("chatlib_current_span", default=None)
+
+_exporters: list[SpanExporter] = []
+
+
+def add_span_exporter(exporter: SpanExporter):
+    _exporters.append(exporter)
+
+
+def remove_span_exporter(exporter: SpanExporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+def _export(span: Span):
+    for exporter in _exporters:
+        try:
+            exporter.export(span)
+        except Exception as e:
+            print(f"Error while exporting span {span.name} - {e}")
+
+
+def get_current_span() -> Span | None:
+    return _current_span.get()
+
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    Start a child of the current span without making it current. End it with Span.end().
+    Use this where a context manager cannot enclose the work, e.g., across the yields of an async generator.
+    """
+    return Span(name, _current_span.get(), attributes)
+
+
+def set_current_span(span: Span | None):
+    """
+    Make the span current in this context without a block to scope it, e.g., in a context copied to run the steps of
+    an async generator, from which nothing leaks to the consumer.
+    """
+    _current_span.set(span)
+
+
+@contextmanager
+def trace_span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Time the work inside this block as a span, and make it the parent of spans started within it.
+    """
+    span = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.end(e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context, e.g., an async generator finalized after being abandoned.
+            pass
+        span.end()
+
+
+class OpenTelemetrySpanExporter(SpanExporter):
+    """
+    Re-emits finished span trees through an OpenTelemetry tracer. Requires the opentelemetry-api package, with an
+    SDK configured by the application.
+    """
+
+    def __init__(self, tracer: Any | None = None, instrumentation_name: str = "chatlib"):
+        from opentelemetry import trace
+
+        self.__trace = trace
+        self.__tracer = tracer or trace.get_tracer(instrumentation_name)
+
+    def export(self, span: Span):
+        self.__emit(span, None)
+
+    def __emit(self, span: Span, parent_context: Any):
+        otel_span = self.__tracer.start_span(span.name, context=parent_context, start_time=span.start_time_ns,
+                                             attributes={key: value for key, value in span.attributes.items()
+                                                         if isinstance(value, (str, bool, int, float))})
+        if span.error is not None:
+            otel_span.set_status(self.__trace.Status(self.__trace.StatusCode.ERROR, span.error))
+        context = self.__trace.set_span_in_context(otel_span, parent_context)
+        for child in span.children:
+            self.__emit(child, context)
+        otel_span.end(end_time=span.end_time_ns)
@@ -0,0 +1,38 @@
+import asyncio
+import os
+from time import perf_counter
+
+from benchmarks.stub_server import start_stub_server, get_base_url, ANTHROPIC_MESSAGE_RESPONSE
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionMessageRole
+from chatlib.llm.integration import AnthropicChatCompletionAPI, AnthropicModel
+
+MESSAGES = [ChatCompletionMessage(content="Hi!", role=ChatCompletionMessageRole.USER)]
+
+
+def test_parallel_calls_do_not_block_event_loop(parallel: int = 10, latency: float = 0.5):
+    async def run():
+        os.environ.setdefault(
+            AnthropicChatCompletionAPI.env_key_for_spec(AnthropicChatCompletionAPI.get_auth_variable_specs()[0]),
+            "stub")
+        server = start_stub_server(ANTHROPIC_MESSAGE_RESPONSE, delay=latency)
+        try:
+            async with AnthropicChatCompletionAPI(base_url=get_base_url(server)) as api:
+                # Warm up: the first call pays for SDK imports and the connection setup.
+                await api.run_chat_completion(AnthropicModel.CLAUDE_3_OPUS_20240229, MESSAGES, {})
+
+                start = perf_counter()
+                await asyncio.gather(*[api.run_chat_completion(AnthropicModel.CLAUDE_3_OPUS_20240229, MESSAGES, {})
+                                       for _ in range(parallel)])
+                elapsed = perf_counter() - start
+
+            # Serialized calls would take parallel times the latency.
+            assert elapsed < latency * 2, f"{parallel} parallel calls took {elapsed:.2f} s - the event loop is blocked."
+        finally:
+            server.shutdown()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_parallel_calls_do_not_block_event_loop()
+    print("Passed.")
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+from collections import Counter
+
+from benchmarks.stub_batch_server import start_stub_batch_server
+from benchmarks.stub_server import get_base_url
+from chatlib.chatbot import ChatCompletionParams
+from chatlib.llm.integration import GPTChatCompletionAPI, GPTBatchAPI, ChatGPTModel
+from chatlib.tool.converter import generate_type_converter
+from chatlib.tool.versatile_mapper import ChatCompletionFewShotMapper, ChatCompletionFewShotMapperParams, \
+    MapperBatchFailedError
+
+INPUTS = [f"input {i}" for i in range(10)]
+
+
+def run_batch(malformed_answers: dict[str, int], output_malformed_retry_count: int) -> tuple[list[dict], Counter]:
+    """
+    :param malformed_answers: Times each input is answered with malformed JSON before a valid answer
+    :return: The outputs, and the times each input was requested
+    """
+    os.environ.setdefault(GPTChatCompletionAPI.env_key_for_spec(GPTChatCompletionAPI.get_auth_variable_specs()[0]),
+                          "stub")
+    requested = Counter()
+
+    def answer(body: dict) -> str:
+        text = body["messages"][-1]["content"]
+        requested[text] += 1
+        if requested[text] <= malformed_answers.get(text, 0):
+            return "{not json"
+        return json.dumps({"length": len(text)})
+
+    str_to_dict, dict_to_str = generate_type_converter(dict, 'json')
+    mapper = ChatCompletionFewShotMapper(GPTChatCompletionAPI(), "Return the length of the input as JSON.", None,
+                                         dict_to_str, str_to_dict,
+                                         output_validator=lambda input, output: output["length"] == len(input))
+    params = ChatCompletionFewShotMapperParams(model=ChatGPTModel.GPT_4o,
+                                               api_params=ChatCompletionParams(temperature=0))
+
+    async def run():
+        server = start_stub_batch_server(answer)
+        batch_api = GPTBatchAPI(base_url=get_base_url(server, "/v1"))
+        try:
+            return await mapper.run_batch(batch_api, None, INPUTS, params, output_malformed_retry_count,
+                                          poll_interval=0.01, timeout=10)
+        finally:
+            await batch_api.aclose()
+            server.shutdown()
+
+    return asyncio.run(run()), requested
+
+
+def test_malformed_outputs_are_requeued():
+    outputs, requested = run_batch({"input 3": 1, "input 7": 2}, output_malformed_retry_count=2)
+
+    assert [output["length"] for output in outputs] == [len(input) for input in INPUTS]
+    # Only the malformed ones go into the follow-up jobs.
+    assert requested["input 3"] == 2 and requested["input 7"] == 3
+    assert all(requested[input] == 1 for input in INPUTS if input not in ("input 3", "input 7"))
+
+
+def test_batch_fails_after_all_retries():
+    try:
+        run_batch({"input 5": 3}, output_malformed_retry_count=2)
+        assert False, "MapperBatchFailedError should have been raised."
+    except MapperBatchFailedError as e:
+        assert list(e.errors.keys()) == [5]
+        assert e.outputs[5] is None
+        assert all(output["length"] == len(INPUTS[i]) for i, output in enumerate(e.outputs) if i != 5)
+
+
+if __name__ == "__main__":
+    test_malformed_outputs_are_requeued()
+    test_batch_fails_after_all_retries()
+    print("Passed.")
@@ -0,0 +1,72 @@
+import asyncio
+
+from chatlib.chatbot import DialogueTurn
+from chatlib.chatbot.response_generator import ChatCompletionResponseGenerator
+from chatlib.chatbot.session import TurnTakingChatSession
+from chatlib.llm.deadline import DeadlineExceededError, get_deadline
+from chatlib.llm.integration.mock_api import MockChatCompletionAPI, ConstantLatency
+from chatlib.llm.scheduler import get_scheduling_context, RequestPriority
+from chatlib.utils.tracing import get_current_span
+
+
+def create_session() -> TurnTakingChatSession:
+    # About 20 deltas over 0.4 seconds.
+    api = MockChatCompletionAPI(latency=ConstantLatency(0.4), time_to_first_token=ConstantLatency(0.05),
+                                completion_tokens=(20, 20))
+    generator = ChatCompletionResponseGenerator(api=api, model="mock", base_instruction="You are a helpful assistant.")
+    return TurnTakingChatSession("stream-deadline", generator, writer=None)
+
+
+async def consume(session: TurnTakingChatSession, timeout: float, pause: float) -> list[str | DialogueTurn]:
+    received = []
+    async for item in session.push_user_message_stream(DialogueTurn(message="Hello", is_user=True), timeout=timeout):
+        received.append(item)
+        # A slow consumer, e.g., writing each delta to a client: the deadline must not cancel this sleep.
+        await asyncio.sleep(pause)
+    return received
+
+
+def test_slow_consumer_runs_out_of_deadline():
+    async def run():
+        session = create_session()
+        try:
+            await consume(session, timeout=0.5, pause=1)
+            assert False, "The deadline should have been exceeded."
+        except DeadlineExceededError:
+            pass
+        assert asyncio.current_task().cancelling() == 0
+        assert len(session.dialog) == 0
+
+    asyncio.run(run())
+
+
+def test_consumer_within_deadline():
+    async def run():
+        session = create_session()
+        received = await consume(session, timeout=5, pause=0.01)
+        assert isinstance(received[-1], DialogueTurn)
+        assert received[-1].metadata["deadline"]["within_budget"] is True
+        assert asyncio.current_task().cancelling() == 0
+        assert len(session.dialog) == 2
+
+    asyncio.run(run())
+
+
+def test_stream_context_does_not_leak_to_consumer():
+    async def run():
+        session = create_session()
+        async for item in session.push_user_message_stream(DialogueTurn(message="Hello", is_user=True), timeout=5):
+            assert get_current_span() is None
+            assert get_deadline() is None
+            assert get_scheduling_context().priority == RequestPriority.Background
+        timings = item.metadata["timings"]
+        assert "provider_call" in timings and "persistence" in timings
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_slow_consumer_runs_out_of_deadline()
+    test_consumer_within_deadline()
+    test_stream_context_does_not_leak_to_consumer()
+    print("Passed.")
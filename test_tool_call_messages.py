@@ -0,0 +1,36 @@
+import asyncio
+import os
+
+from benchmarks.stub_server import start_stub_server, get_base_url, OPENAI_CHAT_COMPLETION_RESPONSE
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionMessageRole, ChatCompletionToolCall, \
+    ChatCompletionFunction
+from chatlib.llm.integration import GPTChatCompletionAPI, ChatGPTModel
+
+
+def test_tool_call_follow_up_request():
+    # The follow-up of a tool call carries the assistant message with its tool calls, then the tool's answer.
+    messages = [
+        ChatCompletionMessage(content="What's the weather in Seoul?", role=ChatCompletionMessageRole.USER),
+        ChatCompletionMessage(content=None, role=ChatCompletionMessageRole.ASSISTANT,
+                              tool_calls=[ChatCompletionToolCall(index=0, id="call_0", function=ChatCompletionFunction(
+                                  name="get_weather", arguments="{\"city\": \"Seoul\"}"))]),
+        ChatCompletionMessage(content="Sunny", role=ChatCompletionMessageRole.TOOL, tool_call_id="call_0")
+    ]
+
+    async def run():
+        os.environ.setdefault(
+            GPTChatCompletionAPI.env_key_for_spec(GPTChatCompletionAPI.get_auth_variable_specs()[0]), "stub")
+        server = start_stub_server(OPENAI_CHAT_COMPLETION_RESPONSE)
+        try:
+            async with GPTChatCompletionAPI(base_url=get_base_url(server, "/v1")) as api:
+                result = await api.run_chat_completion(ChatGPTModel.GPT_4_0613, messages, {}, trial_count=1)
+                assert result.message.content == "Hello."
+        finally:
+            server.shutdown()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_tool_call_follow_up_request()
+    print("Passed.")